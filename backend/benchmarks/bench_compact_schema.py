@@ -0,0 +1,177 @@
+"""
+Benchmark: compact vs verbose MCQ generation schema
+
+Offline (default): builds sample questions, serializes them in the old verbose
+schema and the new compact schema, and compares output token counts.
+Live (--live): sends both prompts to Gemini and compares reported output
+tokens and end-to-end latency. Needs GEMINI_API_KEY.
+
+Usage (from backend/):
+    python benchmarks/bench_compact_schema.py
+    python benchmarks/bench_compact_schema.py --live --runs 5 --out compact.json
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gemini_service import DIFFICULTY_CODES, GeminiService  # noqa: E402
+from llm_governor import estimate_tokens  # noqa: E402
+
+SAMPLE_CONTEXT = [
+    {"id": "pyq2024_chunk1", "text": "Q1. Which of the following metals reacts vigorously with cold water? "
+                                     "(a) Iron (b) Sodium (c) Copper (d) Zinc [1 mark] "
+                                     "Q2. Why is aluminium used to make cooking utensils? [2 marks]"},
+    {"id": "chunk2", "text": "Metals are lustrous, malleable and ductile. They are good conductors of heat "
+                             "and electricity. Non-metals are brittle, dull and poor conductors, except "
+                             "graphite which conducts electricity."},
+    {"id": "chunk5", "text": "A more reactive metal displaces a less reactive metal from its salt solution. "
+                             "For example, zinc displaces copper from copper sulphate solution, and the blue "
+                             "colour of the solution fades."},
+]
+
+# Prompt used before the compact schema, kept here as the benchmark baseline
+LEGACY_PROMPT = """You are an exam question generator for Class 8 students. Use ONLY the following CONTEXT to generate {num_questions} multiple-choice questions.
+
+STRICT REQUIREMENTS:
+- Each question must have exactly 4 options (A, B, C, D)
+- Mark the correct answer with its index (1-4)
+- Provide a brief explanation
+- Label difficulty: easy, medium, or hard
+- Reference the source chunk
+
+Return ONLY a valid JSON array with this exact structure:
+[
+  {{
+    "q": "question text here",
+    "options": ["option A", "option B", "option C", "option D"],
+    "answer": 2,
+    "explanation": "brief explanation using context",
+    "difficulty": "medium",
+    "source": "chunk id"
+  }}
+]
+
+CONTEXT:
+{context_text}
+
+Generate exactly {num_questions} questions. Return ONLY the JSON array, no other text.
+"""
+
+
+def sample_questions(n):
+    """Representative questions in the API (expanded) shape"""
+    base = [
+        ("Which metal reacts vigorously with cold water?", ["Iron", "Sodium", "Copper", "Zinc"], 2,
+         "Sodium is highly reactive and reacts vigorously with cold water, so it is stored in kerosene "
+         "to keep it away from moisture and air.", "easy", "pyq2024_chunk1"),
+        ("Which property allows metals to be drawn into wires?", ["Malleability", "Ductility", "Lustre", "Sonority"], 2,
+         "Ductility is the property of metals by which they can be drawn into thin wires, which is why "
+         "copper and aluminium are used for electric wiring.", "medium", "chunk2"),
+        ("What happens when zinc is added to copper sulphate solution?",
+         ["No reaction", "Copper is displaced", "Zinc is displaced", "Solution turns blue"], 2,
+         "Zinc is more reactive than copper, so it displaces copper from copper sulphate; the blue colour "
+         "fades as zinc sulphate forms.", "hard", "chunk5"),
+    ]
+    questions = []
+    for i in range(n):
+        q, options, answer, explanation, difficulty, source = base[i % len(base)]
+        questions.append({"q": q, "options": options, "answer": answer, "explanation": explanation,
+                          "difficulty": difficulty, "source": source})
+    return questions
+
+
+def to_compact(question, explanation_words):
+    letters = {v: k for k, v in DIFFICULTY_CODES.items()}
+    return {
+        "q": question["q"],
+        "o": question["options"],
+        "a": question["answer"],
+        "e": " ".join(question["explanation"].split()[:explanation_words]),
+        "d": letters[question["difficulty"]],
+        "s": question["source"],
+    }
+
+
+def run_offline(num_questions, explanation_words):
+    questions = sample_questions(num_questions)
+    # Same formatting for both, so the difference comes from the schema alone
+    verbose = json.dumps(questions, separators=(",", ":"))
+    compact = json.dumps([to_compact(q, explanation_words) for q in questions], separators=(",", ":"))
+
+    # The server-side expansion must give back the API shape
+    service = object.__new__(GeminiService)
+    expanded = [service._expand_question(q) for q in json.loads(compact)]
+    assert all(set(q) == set(questions[0]) for q in expanded), "expanded shape mismatch"
+
+    verbose_tokens = estimate_tokens(verbose)
+    compact_tokens = estimate_tokens(compact)
+    return {
+        "mode": "offline",
+        "num_questions": num_questions,
+        "verbose": {"chars": len(verbose), "est_output_tokens": verbose_tokens},
+        "compact": {"chars": len(compact), "est_output_tokens": compact_tokens},
+        "output_token_reduction": round(1 - compact_tokens / verbose_tokens, 3),
+    }
+
+
+def run_live(num_questions, explanation_words, runs):
+    service = GeminiService()
+    service.explanation_words = explanation_words
+    context_text = "\n\n---\n\n".join(f"SOURCE: {c['id']}:\n{c['text']}" for c in SAMPLE_CONTEXT)
+    prompts = {
+        "verbose": LEGACY_PROMPT.format(num_questions=num_questions, context_text=context_text),
+        "compact": service.build_mcq_prompt(SAMPLE_CONTEXT, num_questions),
+    }
+
+    results = {"mode": "live", "num_questions": num_questions, "runs": runs}
+    for name, prompt in prompts.items():
+        latencies, output_tokens = [], []
+        for _ in range(runs):
+            start = time.perf_counter()
+            response = service.model.generate_content(prompt)
+            latencies.append(time.perf_counter() - start)
+            usage = getattr(response, "usage_metadata", None)
+            output_tokens.append(getattr(usage, "candidates_token_count", 0) or estimate_tokens(response.text))
+        results[name] = {
+            "median_latency_s": round(statistics.median(latencies), 3),
+            "max_latency_s": round(max(latencies), 3),
+            "median_output_tokens": statistics.median(output_tokens),
+        }
+        print(f"{name:8s} latency p50 {results[name]['median_latency_s']}s, "
+              f"output tokens p50 {results[name]['median_output_tokens']}")
+
+    results["output_token_reduction"] = round(
+        1 - results["compact"]["median_output_tokens"] / results["verbose"]["median_output_tokens"], 3)
+    results["latency_reduction"] = round(
+        1 - results["compact"]["median_latency_s"] / results["verbose"]["median_latency_s"], 3)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--num-questions", type=int, default=10)
+    parser.add_argument("--explanation-words", type=int, default=20)
+    parser.add_argument("--live", action="store_true", help="call Gemini instead of estimating offline")
+    parser.add_argument("--runs", type=int, default=3, help="calls per schema in --live mode")
+    parser.add_argument("--out", help="write results as JSON to this file")
+    args = parser.parse_args()
+
+    if args.live:
+        results = run_live(args.num_questions, args.explanation_words, args.runs)
+    else:
+        results = run_offline(args.num_questions, args.explanation_words)
+
+    print(json.dumps(results, indent=2))
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,302 @@
+"""
+Benchmark: context selection (RetrievalService.mmr_select) and the top-k search
+under it, on synthetic corpora
+
+Generates clustered 384-dim corpora (like MiniLM chunk embeddings) of 100 to
+100k chunks and measures, per implementation:
+- query latency (p50/p95/mean), build time
+- memory held by the index representation
+- recall@k against exact search
+No network, model download or Firestore access is needed.
+
+Implementations:
+- mmr     RetrievalService.mmr_select on a ChunkSet built the way fetch_embeddings
+          builds it (EMBEDDING_CODEC index, exact rows memory-mapped)
+- mmr-python
+          baseline: the same MMR over per-chunk dicts of float lists, in pure Python
+          (skipped above --python-max chunks)
+- numpy   vectorized cosine over a contiguous float32 matrix
+- ivf     approximate search: k-means inverted file, probing `nprobe` lists
+- float16, int8, pq
+          EmbeddingIndex codecs, saved as a snapshot and loaded the way
+          RetrievalService does: codes in memory, exact float32 rows memory-mapped
+          for re-ranking the shortlist (MiB counts the in-memory part only)
+
+MMR runs with --mmr-lambda 1.0 by default, i.e. pure relevance, so its recall is
+measured against exact top-k like the others; the selection loop costs the same
+for any lambda. With the production lambda (0.7) recall is only the overlap with
+top-k.
+
+Usage (from backend/):
+    python benchmarks/bench_retrieval.py
+    python benchmarks/bench_retrieval.py --sizes 1000 10000 --out retrieval.json
+    python benchmarks/bench_retrieval.py --impls mmr mmr-python --sizes 100 1000 10000
+    python benchmarks/bench_retrieval.py --baseline retrieval.json   # fail on regressions
+"""
+
+import argparse
+import gc
+import heapq
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chunk_set import ChunkSet  # noqa: E402
+from embedding_index import EMBEDDING_CODEC, EmbeddingIndex  # noqa: E402
+from retrieval_service import DEFAULT_CHUNK_TOKENS, MMR_CANDIDATES, RetrievalService  # noqa: E402
+
+DIM = 384
+
+
+def make_corpus(n, dim=DIM, seed=0):
+    """Clustered unit vectors: ~sqrt(n) topics with per-chunk noise"""
+    rng = np.random.default_rng(seed)
+    topics = max(4, int(np.sqrt(n)))
+    centers = rng.standard_normal((topics, dim)).astype(np.float32)
+    labels = rng.integers(0, topics, n)
+    vectors = centers[labels] + 0.6 * rng.standard_normal((n, dim)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors
+
+
+def make_queries(corpus, count, seed=1):
+    rng = np.random.default_rng(seed)
+    picks = corpus[rng.integers(0, len(corpus), count)]
+    queries = picks + 0.5 * rng.standard_normal(picks.shape).astype(np.float32)
+    return queries / np.linalg.norm(queries, axis=1, keepdims=True)
+
+
+def exact_top_k(matrix, query, k):
+    scores = matrix @ query
+    k = min(k, len(scores))
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top])]
+
+
+class MMRImpl:
+    name = "mmr"
+
+    def __init__(self, lambda_mult):
+        self.lambda_mult = lambda_mult
+
+    def build(self, corpus):
+        # mmr_select uses no service state; skip __init__ (Firestore, model download)
+        self.service = object.__new__(RetrievalService)
+        index = EmbeddingIndex.build(corpus, EMBEDDING_CODEC)
+        index.keep_exact(corpus)
+        self.chunks = ChunkSet.build([f"chunk{i}" for i in range(len(corpus))], index,
+                                     [DEFAULT_CHUNK_TOKENS] * len(corpus))
+
+    def query(self, vector, k):
+        return self.service.mmr_select(self.chunks, vector, k, lambda_mult=self.lambda_mult).tolist()
+
+
+def _dot(a, b):
+    return sum(x * y for x, y in zip(a, b))
+
+
+class PythonMMRImpl:
+    """The same selection as mmr_select (exact vectors), on a dict per chunk"""
+    name = "mmr-python"
+
+    def __init__(self, lambda_mult):
+        self.lambda_mult = lambda_mult
+
+    def build(self, corpus):
+        # Embeddings arrive from Firestore as lists of floats
+        self.chunks = [{"id": i, "embedding": row.tolist(), "tokenCount": DEFAULT_CHUNK_TOKENS}
+                       for i, row in enumerate(corpus)]
+
+    def query(self, vector, k):
+        query = vector.tolist()
+        relevance = {chunk["id"]: _dot(chunk["embedding"], query) for chunk in self.chunks}
+        candidates = heapq.nlargest(MMR_CANDIDATES, self.chunks, key=lambda chunk: relevance[chunk["id"]])
+        picks = []
+        while candidates and len(picks) < k:
+            def score(chunk):
+                redundancy = max((_dot(chunk["embedding"], pick["embedding"]) for pick in picks), default=0.0)
+                return self.lambda_mult * relevance[chunk["id"]] - (1 - self.lambda_mult) * redundancy
+            best = max(candidates, key=score)
+            candidates.remove(best)
+            picks.append(best)
+        return [chunk["id"] for chunk in picks]
+
+
+class NumpyImpl:
+    name = "numpy"
+
+    def build(self, corpus):
+        self.matrix = np.array(corpus, dtype=np.float32, order="C", copy=True)
+
+    def query(self, vector, k):
+        return exact_top_k(self.matrix, vector, k).tolist()
+
+
+class IVFImpl:
+    name = "ivf"
+
+    def __init__(self, nprobe=8, iterations=8, seed=0):
+        self.nprobe = nprobe
+        self.iterations = iterations
+        self.seed = seed
+
+    def build(self, corpus):
+        rng = np.random.default_rng(self.seed)
+        n = len(corpus)
+        nlist = max(1, int(np.sqrt(n)))
+        sample = corpus[rng.choice(n, min(n, nlist * 40), replace=False)]
+        centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+        for _ in range(self.iterations):
+            assign = np.argmax(sample @ centroids.T, axis=1)
+            for c in range(nlist):
+                members = sample[assign == c]
+                if len(members):
+                    centroid = members.mean(axis=0)
+                    centroids[c] = centroid / (np.linalg.norm(centroid) or 1.0)
+
+        assign = np.argmax(corpus @ centroids.T, axis=1)
+        order = np.argsort(assign, kind="stable")
+        self.centroids = centroids
+        self.matrix = np.ascontiguousarray(corpus[order], dtype=np.float32)
+        self.ids = order
+        self.offsets = np.searchsorted(assign[order], np.arange(nlist + 1))
+
+    def query(self, vector, k):
+        nprobe = min(self.nprobe, len(self.centroids))
+        probe = np.argpartition(-(self.centroids @ vector), nprobe - 1)[:nprobe]
+        rows = np.concatenate([np.arange(self.offsets[c], self.offsets[c + 1]) for c in probe])
+        if len(rows) == 0:
+            return []
+        top = exact_top_k(self.matrix[rows], vector, k)
+        return self.ids[rows[top]].tolist()
+
+
+class CompressedImpl:
+    def __init__(self, codec):
+        self.name = codec
+        self.codec = codec
+
+    def build(self, corpus):
+        self.tmp = tempfile.TemporaryDirectory()
+        path = os.path.join(self.tmp.name, "index")
+        EmbeddingIndex.build(corpus, self.codec).save(path, exact=corpus)
+        self.index, _ = EmbeddingIndex.load(path)
+
+    def query(self, vector, k):
+        return self.index.search(vector, k).tolist()
+
+
+def measure(impl, corpus, queries, truth, k):
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    impl.build(corpus)
+    build_s = time.perf_counter() - start
+    index_bytes, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    latencies, hits = [], 0
+    for vector, expected in zip(queries, truth):
+        start = time.perf_counter()
+        got = impl.query(vector, k)
+        latencies.append(time.perf_counter() - start)
+        hits += len(set(got) & set(expected))
+
+    latencies.sort()
+    return {
+        "impl": impl.name,
+        "build_s": round(build_s, 4),
+        "index_mib": round(index_bytes / 2 ** 20, 2),
+        "p50_ms": round(1000 * statistics.median(latencies), 3),
+        "p95_ms": round(1000 * latencies[int(0.95 * (len(latencies) - 1))], 3),
+        "mean_ms": round(1000 * statistics.fmean(latencies), 3),
+        f"recall@{k}": round(hits / (k * len(queries)), 4),
+    }
+
+
+def compare(results, baseline_path, tolerance):
+    """Return regressions: p50 slower than baseline by more than `tolerance`, or lower recall"""
+    with open(baseline_path) as f:
+        baseline = {(r["size"], r["impl"]): r for r in json.load(f)["results"]}
+    regressions = []
+    for r in results:
+        base = baseline.get((r["size"], r["impl"]))
+        if not base:
+            continue
+        if r["p50_ms"] > base["p50_ms"] * (1 + tolerance):
+            regressions.append(f"{r['impl']}@{r['size']}: p50 {base['p50_ms']}ms -> {r['p50_ms']}ms")
+        recall_key = next(key for key in r if key.startswith("recall@"))
+        if r[recall_key] < base.get(recall_key, 0) - 0.01:
+            regressions.append(f"{r['impl']}@{r['size']}: {recall_key} {base[recall_key]} -> {r[recall_key]}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000, 100000])
+    parser.add_argument("--impls", nargs="+",
+                        default=["mmr", "mmr-python", "numpy", "ivf", "float16", "int8", "pq"])
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--nprobe", type=int, default=8)
+    parser.add_argument("--mmr-lambda", type=float, default=1.0,
+                        help="lambda_mult for the MMR implementations (1.0 = pure relevance)")
+    parser.add_argument("--python-max", type=int, default=10000,
+                        help="skip the pure-Python baseline above this corpus size")
+    parser.add_argument("--out", help="write results as JSON to this file")
+    parser.add_argument("--baseline", help="earlier --out file; exit 1 on regressions")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed p50 slowdown vs baseline")
+    args = parser.parse_args()
+
+    factories = {"mmr": lambda: MMRImpl(args.mmr_lambda), "mmr-python": lambda: PythonMMRImpl(args.mmr_lambda),
+                 "numpy": NumpyImpl, "ivf": lambda: IVFImpl(nprobe=args.nprobe),
+                 "float16": lambda: CompressedImpl("float16"), "int8": lambda: CompressedImpl("int8"),
+                 "pq": lambda: CompressedImpl("pq")}
+    results = []
+    print(f"{'size':>7} {'impl':>10} {'build s':>8} {'MiB':>8} {'p50 ms':>9} {'p95 ms':>9} {'recall':>7}")
+    for size in args.sizes:
+        corpus = make_corpus(size)
+        queries = make_queries(corpus, args.queries)
+        truth = [exact_top_k(corpus, q, args.k).tolist() for q in queries]
+        for name in args.impls:
+            if name == "mmr-python" and size > args.python_max:
+                continue
+            row = measure(factories[name](), corpus, queries, truth, args.k)
+            row["size"] = size
+            results.append(row)
+            print(f"{size:>7} {name:>10} {row['build_s']:>8} {row['index_mib']:>8} "
+                  f"{row['p50_ms']:>9} {row['p95_ms']:>9} {row[f'recall@{args.k}']:>7}")
+
+    report = {
+        "benchmark": "retrieval",
+        "dim": DIM,
+        "k": args.k,
+        "mmr_lambda": args.mmr_lambda,
+        "queries": args.queries,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "results": results,
+    }
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        regressions = compare(results, args.baseline, args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+"""
+Load test: /generate_mcq + /grade_quiz end to end, fully offline
+
+Runs main.app in-process against the in-memory Firestore and fake Gemini from
+local_stack.py. Each virtual student generates a quiz, answers it randomly and
+submits it for grading, in a loop. Reports throughput, status codes and
+p50/p95/p99 latency per endpoint, plus Gemini/Firestore call counts.
+
+Usage (from backend/):
+    python benchmarks/loadtest.py
+    python benchmarks/loadtest.py --users 32 --duration 60 --llm-latency 2 --llm-failure-rate 0.05
+    python benchmarks/loadtest.py --users 8 --iterations 5 --firestore-latency 0.02 --out load.json
+    python benchmarks/loadtest.py --rpm 60 --tpm 250000   # include the production rate limits
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from local_stack import FakeEncoder, FakeFirestore, FakeGenerativeModel, build_local_app, seed_corpus  # noqa: E402
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(p / 100 * len(sorted_values)))]
+
+
+class Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.statuses = defaultdict(Counter)
+
+    def record(self, endpoint, status, seconds):
+        with self.lock:
+            self.latencies[endpoint].append(seconds)
+            self.statuses[endpoint][status] += 1
+
+    def summary(self, elapsed):
+        rows = {}
+        for endpoint, values in sorted(self.latencies.items()):
+            values = sorted(values)
+            ok = self.statuses[endpoint].get(200, 0)
+            rows[endpoint] = {
+                "requests": len(values),
+                "ok": ok,
+                "statuses": {str(k): v for k, v in sorted(self.statuses[endpoint].items())},
+                "throughput_rps": round(len(values) / elapsed, 2),
+                "p50_ms": round(1000 * percentile(values, 50), 1),
+                "p95_ms": round(1000 * percentile(values, 95), 1),
+                "p99_ms": round(1000 * percentile(values, 99), 1),
+                "max_ms": round(1000 * values[-1], 1),
+            }
+        return rows
+
+
+def student(app, recorder, args, stop_at, seed):
+    """One virtual student: generate a quiz, answer it, grade it; repeat"""
+    rng = random.Random(seed)
+    client = app.test_client()
+    iteration = 0
+    while time.monotonic() < stop_at and (not args.iterations or iteration < args.iterations):
+        iteration += 1
+        chapter = rng.choice(args.chapters)
+        start = time.perf_counter()
+        response = client.post("/generate_mcq", json={
+            "class_id": "class 8", "subject_id": "science", "chapter_id": chapter,
+            "num_questions": args.questions,
+        })
+        recorder.record("generate_mcq", response.status_code, time.perf_counter() - start)
+        if response.status_code != 200:
+            continue
+
+        quiz = response.get_json()
+        answers = [rng.randint(1, 4) for _ in quiz["questions"]]
+        start = time.perf_counter()
+        response = client.post("/grade_quiz", json={
+            "quiz_id": quiz["quiz_id"], "answers": answers, "student_id": f"student{seed}",
+        })
+        recorder.record("grade_quiz", response.status_code, time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=16, help="concurrent virtual students")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds to run")
+    parser.add_argument("--iterations", type=int, default=0,
+                        help="quiz rounds per student (0 = until --duration)")
+    parser.add_argument("--questions", type=int, default=10)
+    parser.add_argument("--chapters", nargs="+", default=["chapter1", "chapter2", "chapter3", "chapter4"])
+    parser.add_argument("--chunks", type=int, default=40, help="chapter chunks per chapter")
+    parser.add_argument("--pyq-chunks", type=int, default=20, help="PYQ chunks per chapter")
+    parser.add_argument("--llm-latency", type=float, default=1.0, help="median Gemini call seconds")
+    parser.add_argument("--llm-sigma", type=float, default=0.5, help="log-normal spread of Gemini latency")
+    parser.add_argument("--llm-failure-rate", type=float, default=0.0)
+    parser.add_argument("--firestore-latency", type=float, default=0.0, help="seconds per Firestore round trip")
+    parser.add_argument("--firestore-jitter", type=float, default=0.0)
+    parser.add_argument("--rpm", type=int, default=int(os.getenv('GEMINI_RPM', '1000000')),
+                        help="Gemini requests/minute for the governor (default: effectively unlimited, "
+                             "so the service is measured rather than the rate limiter)")
+    parser.add_argument("--tpm", type=int, default=int(os.getenv('GEMINI_TPM', '1000000000')),
+                        help="Gemini tokens/minute for the governor")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", help="write the summary as JSON to this file")
+    args = parser.parse_args()
+
+    db = FakeFirestore(latency=args.firestore_latency, jitter=args.firestore_jitter, seed=args.seed)
+    encoder = FakeEncoder()
+    model = FakeGenerativeModel(latency=args.llm_latency, sigma=args.llm_sigma,
+                                failure_rate=args.llm_failure_rate, seed=args.seed)
+    seed_latency, db.latency, db.jitter = db.latency, 0.0, 0.0
+    seed_corpus(db, encoder, chapters=args.chapters, chunks_per_chapter=args.chunks,
+                pyq_per_chapter=args.pyq_chunks, seed=args.seed)
+    db.latency, db.jitter, db.reads, db.writes = seed_latency, args.firestore_jitter, 0, 0
+    # GeminiService builds its governor from the environment
+    os.environ["GEMINI_RPM"] = str(args.rpm)
+    os.environ["GEMINI_TPM"] = str(args.tpm)
+    app, _ = build_local_app(db=db, model=model, encoder=encoder)
+
+    print(f"Load test: {args.users} students, {args.duration}s, Gemini ~{args.llm_latency}s "
+          f"({args.llm_failure_rate:.0%} failures), Firestore {args.firestore_latency * 1000:.0f}ms, "
+          f"governor {args.rpm} rpm / {args.tpm} tpm")
+    recorder = Recorder()
+    start = time.monotonic()
+    stop_at = start + args.duration
+    with ThreadPoolExecutor(max_workers=args.users) as pool:
+        futures = [pool.submit(student, app, recorder, args, stop_at, args.seed + i)
+                   for i in range(args.users)]
+        for future in futures:
+            future.result()
+    elapsed = time.monotonic() - start
+
+    summary = recorder.summary(elapsed)
+    print(f"\n{'endpoint':>14} {'reqs':>6} {'ok':>6} {'rps':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}  statuses")
+    for endpoint, row in summary.items():
+        print(f"{endpoint:>14} {row['requests']:>6} {row['ok']:>6} {row['throughput_rps']:>7} "
+              f"{row['p50_ms']:>9} {row['p95_ms']:>9} {row['p99_ms']:>9}  {row['statuses']}")
+    print(f"\nelapsed {elapsed:.1f}s, Gemini calls {model.calls}, "
+          f"Firestore reads {db.reads}, writes {db.writes}")
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump({
+                "benchmark": "loadtest",
+                "config": vars(args),
+                "elapsed_s": round(elapsed, 2),
+                "gemini_calls": model.calls,
+                "firestore_reads": db.reads,
+                "firestore_writes": db.writes,
+                "endpoints": summary,
+            }, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,408 @@
+"""
+Local Stack
+In-memory stand-ins for Firestore, Gemini and the embedding model so main.app
+can be driven offline (load tests, trace replay). Only the subset of each API
+that the backend uses is implemented.
+"""
+
+import copy
+import hashlib
+import json
+import os
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from google.api_core import exceptions as google_exceptions  # noqa: E402
+
+DIM = 384
+
+
+# -----------------------------
+# FIRESTORE STAND-IN
+# -----------------------------
+class FakeSnapshot:
+    def __init__(self, reference, data, update_time=None):
+        self.reference = reference
+        self.id = reference.id
+        self._data = data
+        self.update_time = update_time
+
+    @property
+    def exists(self):
+        return self._data is not None
+
+    def to_dict(self):
+        return copy.deepcopy(self._data) if self._data is not None else None
+
+    def get(self, field):
+        return (self._data or {}).get(field)
+
+
+class FakeDocumentReference:
+    def __init__(self, client, key):
+        self._client = client
+        self._key = key
+        self.id = key[-1]
+
+    @property
+    def path(self):
+        return "/".join(self._key)
+
+    @property
+    def parent(self):
+        return FakeCollectionReference(self._client, self._key[:-1])
+
+    def collection(self, name):
+        return FakeCollectionReference(self._client, self._key + (name,))
+
+    def get(self, field_paths=None):
+        return self._client._snapshot(self, field_paths)
+
+    def set(self, data, merge=False):
+        self._client._write(self._key, data, merge)
+
+    def update(self, data):
+        batch = self._client.batch()
+        batch.update(self, data)
+        batch.commit()
+
+    def delete(self):
+        self._client._delete(self._key)
+
+
+class FakeQuery:
+    def __init__(self, client, path, filters=(), limit=None, fields=None):
+        self._client = client
+        self._path = path
+        self._filters = list(filters)
+        self._limit = limit
+        self._fields = fields
+
+    def _copy(self, **changes):
+        query = FakeQuery(self._client, self._path, self._filters, self._limit, self._fields)
+        for key, value in changes.items():
+            setattr(query, key, value)
+        return query
+
+    def where(self, field, op, value):
+        if op != "==":
+            raise NotImplementedError(f"Fake Firestore only supports '==' filters, got {op!r}")
+        return self._copy(_filters=self._filters + [(field, value)])
+
+    def limit(self, count):
+        return self._copy(_limit=count)
+
+    def select(self, field_paths):
+        return self._copy(_fields=list(field_paths))
+
+    def stream(self):
+        results = []
+        for doc_key, data, updated in self._client._list(self._path):
+            if all(data.get(field) == value for field, value in self._filters):
+                if self._fields is not None:
+                    data = {k: v for k, v in data.items() if k in self._fields}
+                results.append(FakeSnapshot(FakeDocumentReference(self._client, doc_key), data, updated))
+                if self._limit is not None and len(results) >= self._limit:
+                    break
+        self._client._charge(len(results))
+        return iter(results)
+
+    def get(self):
+        return list(self.stream())
+
+
+class FakeCollectionReference(FakeQuery):
+    def __init__(self, client, path):
+        super().__init__(client, path)
+        self.id = path[-1]
+
+    def document(self, doc_id=None):
+        return FakeDocumentReference(self._client, self._path + (doc_id or uuid.uuid4().hex[:20],))
+
+    def list_documents(self):
+        return [FakeDocumentReference(self._client, key) for key, _, _ in self._client._list(self._path)]
+
+
+class FakeWriteOption:
+    def __init__(self, last_update_time=None, exists=None):
+        self.last_update_time = last_update_time
+        self.exists = exists
+
+
+class FakeWriteBatch:
+    """Applies all writes atomically; preconditions are checked before any write"""
+
+    def __init__(self, client):
+        self._client = client
+        self._ops = []
+
+    def set(self, reference, data, merge=False):
+        self._ops.append(("set", reference._key, data, merge, None))
+
+    def create(self, reference, data):
+        self._ops.append(("set", reference._key, data, False, FakeWriteOption(exists=False)))
+
+    def update(self, reference, data, option=None):
+        self._ops.append(("update", reference._key, data, True, option or FakeWriteOption(exists=True)))
+
+    def delete(self, reference):
+        self._ops.append(("delete", reference._key, None, False, None))
+
+    def commit(self):
+        client = self._client
+        with client._lock:
+            for op, key, data, merge, option in self._ops:
+                if option is None:
+                    continue
+                name = "/".join(key)
+                if option.exists is False and key in client._docs:
+                    raise google_exceptions.AlreadyExists(f"Document already exists: {name}")
+                if option.exists is True and key not in client._docs:
+                    raise google_exceptions.NotFound(f"No document to update: {name}")
+                if option.last_update_time is not None and client._updated.get(key) != option.last_update_time:
+                    raise google_exceptions.FailedPrecondition(f"Document changed since read: {name}")
+            for op, key, data, merge, option in self._ops:
+                if op == "delete":
+                    client._docs.pop(key, None)
+                else:
+                    client._apply(key, data, merge)
+        client._charge(0)
+        self._ops = []
+
+
+class FakeFirestore:
+    """
+    Thread-safe in-memory Firestore client. `latency` seconds (+/- `jitter`)
+    are slept per round trip to imitate the network.
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, seed=0):
+        self._docs = {}
+        self._updated = {}
+        self._clock = 0
+        self._lock = threading.Lock()
+        self.latency = latency
+        self.jitter = jitter
+        self._rng = random.Random(seed)
+        self.reads = 0
+        self.writes = 0
+
+    # -- public API --
+    def collection(self, name):
+        return FakeCollectionReference(self, (name,))
+
+    def document(self, path):
+        return FakeDocumentReference(self, tuple(path.split("/")))
+
+    def batch(self):
+        return FakeWriteBatch(self)
+
+    def write_option(self, last_update_time=None, exists=None):
+        return FakeWriteOption(last_update_time, exists)
+
+    def get_all(self, references, field_paths=None):
+        references = list(references)
+        self._charge(len(references))
+        for reference in references:
+            yield self._snapshot(reference, field_paths, charge=False)
+
+    # -- storage --
+    def _charge(self, reads):
+        self.reads += reads
+        if self.latency or self.jitter:
+            time.sleep(max(0.0, self.latency + self._rng.uniform(-self.jitter, self.jitter)))
+
+    def _snapshot(self, reference, field_paths=None, charge=True):
+        if charge:
+            self._charge(1)
+        with self._lock:
+            data = self._docs.get(reference._key)
+            data = copy.deepcopy(data) if data is not None else None
+            updated = self._updated.get(reference._key)
+        if data is not None and field_paths is not None:
+            data = {k: v for k, v in data.items() if k in field_paths}
+        return FakeSnapshot(reference, data, updated)
+
+    def _write(self, key, data, merge):
+        self._charge(0)
+        with self._lock:
+            self._apply(key, data, merge)
+
+    def _apply(self, key, data, merge):
+        self.writes += 1
+        self._clock += 1
+        data = copy.deepcopy(data)
+        if merge and key in self._docs:
+            self._docs[key].update(data)
+        else:
+            self._docs[key] = data
+        self._updated[key] = self._clock
+
+    def _delete(self, key):
+        self._charge(0)
+        with self._lock:
+            self._docs.pop(key, None)
+            self._updated.pop(key, None)
+
+    def _list(self, collection_key):
+        depth = len(collection_key) + 1
+        with self._lock:
+            items = [(k, copy.deepcopy(d), self._updated.get(k)) for k, d in self._docs.items()
+                     if len(k) == depth and k[:-1] == collection_key]
+        items.sort(key=lambda item: item[0][-1])
+        return items
+
+
+# -----------------------------
+# EMBEDDING MODEL STAND-IN
+# -----------------------------
+class FakeEncoder:
+    """Deterministic bag-of-words hashing encoder producing unit 384-dim vectors"""
+
+    def encode(self, texts, show_progress_bar=False):
+        if isinstance(texts, str):
+            return self._encode_one(texts)
+        return np.stack([self._encode_one(t) for t in texts])
+
+    def _encode_one(self, text):
+        vector = np.zeros(DIM, dtype=np.float32)
+        for word in re.findall(r"\w+", text.lower()):
+            digest = hashlib.md5(word.encode("utf-8")).digest()
+            vector[int.from_bytes(digest[:4], "little") % DIM] += 1.0 if digest[4] & 1 else -1.0
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+
+# -----------------------------
+# GEMINI STAND-IN
+# -----------------------------
+class FakeUsage:
+    def __init__(self, prompt_tokens, output_tokens):
+        self.prompt_token_count = prompt_tokens
+        self.candidates_token_count = output_tokens
+        self.total_token_count = prompt_tokens + output_tokens
+
+
+class FakeResponse:
+    def __init__(self, text, prompt):
+        self.text = text
+        self.usage_metadata = FakeUsage(max(1, len(prompt) // 4), max(1, len(text) // 4))
+
+
+class FakeGenerativeModel:
+    """
+    Answers the backend's prompts with well-formed JSON after a simulated delay.
+    `latency` is the median seconds per call (log-normal with `sigma`, so there is
+    a realistic slow tail); `failure_rate` of calls raise ServiceUnavailable.
+    """
+
+    def __init__(self, latency=1.0, sigma=0.5, failure_rate=0.0, seed=0):
+        self.latency = latency
+        self.sigma = sigma
+        self.failure_rate = failure_rate
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = 0
+
+    def generate_content(self, prompt, **kwargs):
+        with self._lock:
+            self.calls += 1
+            delay = self.latency * self._rng.lognormvariate(0, self.sigma) if self.latency else 0.0
+            fail = self._rng.random() < self.failure_rate
+        time.sleep(delay)
+        if fail:
+            raise google_exceptions.ServiceUnavailable("simulated Gemini outage")
+        return FakeResponse(self._answer(prompt), prompt)
+
+    def _answer(self, prompt):
+        if "multiple-choice questions" in prompt and "SOURCE:" in prompt:
+            match = re.search(r"generate (\d+) multiple-choice", prompt)
+            count = int(match.group(1)) if match else 10
+            sources = re.findall(r"SOURCE: (\S+):", prompt) or ["unknown"]
+            explain = '"e":' in prompt
+            questions = []
+            for i in range(count):
+                item = {"q": f"Sample question {i + 1} about {sources[i % len(sources)]}?",
+                        "o": ["Option 1", "Option 2", "Option 3", "Option 4"],
+                        "a": i % 4 + 1, "d": "emh"[i % 3], "s": sources[i % len(sources)]}
+                if explain:
+                    item["e"] = "Because the context says so."
+                questions.append(item)
+            return json.dumps(questions, separators=(",", ":"))
+
+        if "mapping question number to explanation" in prompt:
+            count = len(re.findall(r"^\d+\. Q:", prompt, re.MULTILINE))
+            return json.dumps({str(i): f"Option is correct per the chapter ({i})." for i in range(1, count + 1)})
+
+        return json.dumps({
+            "weaknesses": [{"topic": "Metals and Non-metals", "count": 1, "description": "Reactivity series"}],
+            "steps": ["Read Section 4.2"],
+            "checklist": ["Solve in-text questions"],
+            "summary": "Good effort. Revise the reactivity series and retake the quiz.",
+        })
+
+
+# -----------------------------
+# CORPUS + APP WIRING
+# -----------------------------
+def seed_corpus(db, encoder, class_id="class 8", subject_id="science", chapters=("chapter4",),
+                chunks_per_chapter=40, pyq_per_chapter=20, seed=0):
+    """Fill the fake Firestore with chapter chunks and PYQ questions carrying embeddings"""
+    rng = random.Random(seed)
+    words = ("metal non-metal reactive sodium copper zinc iron oxide acid base salt ductile "
+             "malleable lustrous conductor electricity heat displacement reaction sulphate "
+             "hydrogen oxygen corrosion alloy graphite sonorous brittle").split()
+    for chapter_id in chapters:
+        chapter_ref = (db.collection("classes").document(class_id)
+                       .collection("subjects").document(subject_id)
+                       .collection("chapters").document(chapter_id))
+        chapter_ref.set({"chapter_name": chapter_id, "notesURL": "", "summary": ""})
+        for kind, count in (("chunks", chunks_per_chapter), ("past_papers", pyq_per_chapter)):
+            for i in range(1, count + 1):
+                text = " ".join(rng.choice(words) for _ in range(300))
+                data = {"chunkNumber": i, "text": text, "embedding": encoder.encode(text).tolist()}
+                data["embeddingDim"] = len(data["embedding"])
+                if kind == "past_papers":
+                    # One document per exam question, as upload_pyq.py writes them
+                    data.update({"source": "pyq2024", "type": "pyq", "questionNumber": i,
+                                 "year": 2024, "marks": float(1 + i % 3)})
+                    doc_id = f"pyq2024_q{i}"
+                else:
+                    doc_id = f"chunk{i}"
+                chapter_ref.collection(kind).document(doc_id).set(data)
+        # Minimal manifest (the upload scripts write the full one)
+        chapter_ref.collection("meta").document("manifest").set({
+            "corpus_version": 1,
+            "embedding_model": "fake-hashing-encoder",
+            "embedding_dim": len(encoder.encode("x")),
+        })
+
+
+def build_local_app(db=None, model=None, encoder=None):
+    """
+    Import main.app with injected stand-ins instead of Firebase/Gemini/MiniLM.
+    Returns (app, main_module).
+    """
+    os.environ["QUIZ_BACKEND_LAZY_INIT"] = "1"
+    # Keep the write-behind log out of the source tree
+    os.environ.setdefault("WRITE_BEHIND_DIR", tempfile.mkdtemp(prefix="quiz-writes-"))
+    import main
+    from gemini_service import GeminiService
+    from retrieval_service import RetrievalService
+
+    db = db if db is not None else FakeFirestore()
+    encoder = encoder or FakeEncoder()
+    main.init_services(
+        gemini_service=GeminiService(model=model or FakeGenerativeModel()),
+        retrieval_service=RetrievalService(db=db, embed_model=encoder),
+    )
+    return main.app, main
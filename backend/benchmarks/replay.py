@@ -0,0 +1,288 @@
+"""
+Replay recorded quiz traffic against the current build
+
+Reads traces written with TRACE_RECORD_PATH (see trace_recorder.py) and re-drives
+them through main.app on the local stack (benchmarks/local_stack.py):
+- the in-memory Firestore is seeded with the recorded context chunks
+- LLM calls are answered with the recorded responses, matched by prompt hash and
+  otherwise by order within the request, so runs are deterministic
+- grade_quiz requests are linked to the quiz created by the replayed generate_mcq
+Per endpoint it reports wall latency, CPU time and (with --alloc) peak traced
+allocations, and can compare against an earlier run to catch regressions.
+
+Usage (from backend/):
+    TRACE_RECORD_PATH=traces/quiz-{pid}.jsonl.gz python main.py     # record
+    python benchmarks/replay.py traces/*.jsonl.gz --out before.json
+    python benchmarks/replay.py traces/*.jsonl.gz --baseline before.json --alloc
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from local_stack import FakeEncoder, FakeFirestore, FakeGenerativeModel, FakeResponse, build_local_app  # noqa: E402
+from google.api_core import exceptions as google_exceptions  # noqa: E402
+from trace_recorder import prompt_hash, read_traces  # noqa: E402
+
+
+def prompt_kind(prompt):
+    if "mapping question number to explanation" in prompt:
+        return "explain"
+    if "multiple-choice questions" in prompt and "SOURCE:" in prompt:
+        return "mcq"
+    return "report"
+
+
+class ReplayModel:
+    """
+    Serves recorded LLM responses. Lookup order: same prompt hash anywhere in the
+    traces, then the next unused call of the same kind in the trace being replayed,
+    then a synthesized answer from FakeGenerativeModel.
+    """
+
+    def __init__(self, traces, recorded_latency=False, replay_errors=False):
+        self.by_hash = defaultdict(list)
+        for trace in traces:
+            for event in trace["events"]:
+                if event["t"] == "llm" and ("text" in event or replay_errors):
+                    self.by_hash[event["hash"]].append(event)
+        self.recorded_latency = recorded_latency
+        self.replay_errors = replay_errors
+        self.fallback = FakeGenerativeModel(latency=0)
+        self.served = defaultdict(int)
+        self.hash_hits = defaultdict(int)
+        self.lock = threading.Lock()
+        self.current = {}
+
+    def start_trace(self, trace):
+        """Queue the trace's own LLM calls per kind for order-based matching"""
+        queues = defaultdict(list)
+        for event in trace["events"]:
+            if event["t"] == "llm" and ("text" in event or self.replay_errors):
+                queues[event["kind"]].append(event)
+        with self.lock:
+            self.current = queues
+
+    def _pick(self, prompt):
+        with self.lock:
+            key = prompt_hash(prompt)
+            events = self.by_hash.get(key)
+            if events:
+                event = events[self.hash_hits[key] % len(events)]
+                self.hash_hits[key] += 1
+                return event, "hash"
+            queue = self.current.get(prompt_kind(prompt))
+            if queue:
+                return queue.pop(0), "order"
+        return None, "synthesized"
+
+    def generate_content(self, prompt, **kwargs):
+        event, how = self._pick(prompt)
+        with self.lock:
+            self.served[how] += 1
+        if event is None:
+            return self.fallback.generate_content(prompt)
+        if self.recorded_latency and event.get("s"):
+            time.sleep(event["s"])
+        if "error" in event:
+            raise google_exceptions.ServiceUnavailable(f"replayed {event['error']}")
+        response = FakeResponse(event["text"], prompt)
+        if event.get("usage"):
+            response.usage_metadata.prompt_token_count, response.usage_metadata.candidates_token_count = event["usage"]
+            response.usage_metadata.total_token_count = sum(event["usage"])
+        return response
+
+
+def load(paths):
+    chunks, traces = {}, []
+    for path in paths:
+        for file_chunks, trace in read_traces(path):
+            traces.append(trace)
+        chunks.update(file_chunks)
+    traces.sort(key=lambda t: t.get("ts", 0))
+    return chunks, traces
+
+
+def seed_from_traces(db, encoder, chunks, traces):
+    """Store every recorded context chunk under the chapter it was retrieved for"""
+    seeded = set()
+    for trace in traces:
+        if trace["endpoint"] != "generate_mcq":
+            continue
+        body = trace["body"]
+        chapter_ref = (db.collection("classes").document(body.get("class_id", "class 8"))
+                       .collection("subjects").document(body.get("subject_id"))
+                       .collection("chapters").document(body.get("chapter_id")))
+        for event in trace["events"]:
+            if event["t"] != "retrieval":
+                continue
+            for chunk_id in event["ids"]:
+                key = (chapter_ref.path, chunk_id)
+                if key in seeded or chunk_id not in chunks:
+                    continue
+                seeded.add(key)
+                kind, doc_id = chunk_id.split(":", 1)
+                chunk = chunks[chunk_id]
+                data = {"text": chunk["text"], "embedding": encoder.encode(chunk["text"]).tolist()}
+                if kind == "pyq":
+                    data.update({"source": chunk.get("source") or "unknown", "type": "pyq"})
+                collection = "past_papers" if kind == "pyq" else "chunks"
+                chapter_ref.collection(collection).document(doc_id).set(data)
+    return len(seeded)
+
+
+def replay(app, model, traces, alloc=False):
+    client = app.test_client()
+    quiz_ids = {}
+    rows = defaultdict(lambda: {"wall": [], "cpu": [], "alloc": [], "recorded": [],
+                                "status_mismatch": 0, "skipped": 0})
+    for trace in traces:
+        endpoint = trace["endpoint"]
+        body = dict(trace["body"])
+        row = rows[endpoint]
+        if endpoint == "grade_quiz":
+            if body.get("quiz_id") not in quiz_ids:
+                row["skipped"] += 1
+                continue
+            body["quiz_id"] = quiz_ids[body["quiz_id"]]
+
+        model.start_trace(trace)
+        if alloc:
+            tracemalloc.start()
+        wall, cpu = time.perf_counter(), time.process_time()
+        response = client.post(f"/{endpoint}", json=body)
+        wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+        if alloc:
+            row["alloc"].append(tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+
+        row["wall"].append(wall)
+        row["cpu"].append(cpu)
+        if trace.get("s") is not None:
+            row["recorded"].append(trace["s"])
+        if response.status_code != trace.get("status"):
+            row["status_mismatch"] += 1
+        recorded_quiz = trace.get("response", {}).get("quiz_id")
+        if endpoint == "generate_mcq" and recorded_quiz and response.status_code == 200:
+            quiz_ids[recorded_quiz] = response.get_json()["quiz_id"]
+    return rows
+
+
+def summarize(rows):
+    def pct(values, p):
+        values = sorted(values)
+        return values[min(len(values) - 1, int(p / 100 * len(values)))] if values else 0.0
+
+    summary = {}
+    for endpoint, row in sorted(rows.items()):
+        summary[endpoint] = {
+            "requests": len(row["wall"]),
+            "skipped": row["skipped"],
+            "status_mismatch": row["status_mismatch"],
+            "p50_ms": round(1000 * pct(row["wall"], 50), 2),
+            "p95_ms": round(1000 * pct(row["wall"], 95), 2),
+            "p99_ms": round(1000 * pct(row["wall"], 99), 2),
+            "cpu_mean_ms": round(1000 * statistics.fmean(row["cpu"]), 2) if row["cpu"] else 0.0,
+            "alloc_peak_p95_kib": round(pct(row["alloc"], 95) / 1024, 1) if row["alloc"] else None,
+            "recorded_p50_ms": round(1000 * pct(row["recorded"], 50), 2) if row["recorded"] else None,
+        }
+    return summary
+
+
+def compare(summary, baseline_path, tolerance):
+    """Regressions: p50 wall, mean CPU or p95 peak allocation worse than baseline by > tolerance"""
+    with open(baseline_path) as f:
+        baseline = json.load(f)["endpoints"]
+    regressions = []
+    for endpoint, row in summary.items():
+        base = baseline.get(endpoint)
+        if not base:
+            continue
+        for key in ("p50_ms", "cpu_mean_ms", "alloc_peak_p95_kib"):
+            if row.get(key) is None or not base.get(key):
+                continue
+            if row[key] > base[key] * (1 + tolerance):
+                regressions.append(f"{endpoint}: {key} {base[key]} -> {row[key]}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("traces", nargs="+", help="trace files written with TRACE_RECORD_PATH")
+    parser.add_argument("--repeat", type=int, default=1, help="replay the traces this many times")
+    parser.add_argument("--recorded-latency", action="store_true",
+                        help="sleep for the recorded LLM latency instead of answering immediately")
+    parser.add_argument("--replay-errors", action="store_true",
+                        help="re-raise recorded LLM failures instead of skipping them")
+    parser.add_argument("--alloc", action="store_true", help="measure peak allocations (tracemalloc; slower)")
+    parser.add_argument("--encoder", choices=["fake", "minilm"], default="fake",
+                        help="embedding model for seeding and queries")
+    parser.add_argument("--out", help="write the summary as JSON to this file")
+    parser.add_argument("--baseline", help="earlier --out file; exit 1 on regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    # Never record while replaying; recorded responses cost nothing, so keep the
+    # Gemini rate budget from dominating the measurement unless set explicitly
+    os.environ.pop("TRACE_RECORD_PATH", None)
+    os.environ.setdefault("GEMINI_RPM", "1000000")
+    os.environ.setdefault("GEMINI_TPM", "1000000000")
+
+    chunks, traces = load(args.traces)
+    if not traces:
+        sys.exit("No traces found")
+
+    if args.encoder == "minilm":
+        from sentence_transformers import SentenceTransformer
+        encoder = SentenceTransformer('all-MiniLM-L6-v2')
+    else:
+        encoder = FakeEncoder()
+    db = FakeFirestore()
+    seeded = seed_from_traces(db, encoder, chunks, traces)
+    model = ReplayModel(traces, recorded_latency=args.recorded_latency, replay_errors=args.replay_errors)
+    app, _ = build_local_app(db=db, model=model, encoder=encoder)
+    print(f"Replaying {len(traces)} requests x{args.repeat} ({seeded} chunks seeded)")
+
+    rows = defaultdict(lambda: defaultdict(list))
+    for _ in range(args.repeat):
+        for endpoint, row in replay(app, model, traces, alloc=args.alloc).items():
+            for key, value in row.items():
+                if isinstance(value, list):
+                    rows[endpoint][key].extend(value)
+                else:
+                    rows[endpoint][key] = rows[endpoint].get(key, 0) + value
+    summary = summarize(rows)
+
+    print(f"\n{'endpoint':>14} {'reqs':>5} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} "
+          f"{'cpu ms':>8} {'alloc KiB':>10} {'recorded p50':>13}")
+    for endpoint, row in summary.items():
+        print(f"{endpoint:>14} {row['requests']:>5} {row['p50_ms']:>9} {row['p95_ms']:>9} {row['p99_ms']:>9} "
+              f"{row['cpu_mean_ms']:>8} {str(row['alloc_peak_p95_kib']):>10} {str(row['recorded_p50_ms']):>13}")
+        if row["skipped"] or row["status_mismatch"]:
+            print(f"{'':>14} skipped {row['skipped']}, status differs from recording {row['status_mismatch']}")
+    print("\nLLM responses served: " + ", ".join(f"{k} {model.served[k]}" for k in ("hash", "order", "synthesized")))
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump({"benchmark": "replay", "traces": len(traces), "repeat": args.repeat,
+                       "config": vars(args), "endpoints": summary}, f, indent=2)
+
+    if args.baseline:
+        regressions = compare(summary, args.baseline, args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
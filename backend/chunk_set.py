@@ -0,0 +1,108 @@
+"""
+Chunk Set
+Columnar storage for the cached chunks of one chapter collection: one array per
+field instead of a dict per chunk
+
+    chunks = retrieval.fetch_embeddings(class_id, subject_id, chapter_id, "past_papers")
+    rows = retrieval.mmr_select(chunks, query_vec, k=5)     # row indices
+    chunks.ids[rows], chunks.tokens[rows], chunks.index.vectors(rows)
+    chunks.record(i, text)                                   # prompt dict, selected rows only
+
+- ids: numpy string array
+- index: EmbeddingIndex of the L2-normalized embeddings
+- tokens: int32 token counts
+- types and sources: small-int codes into TYPES / `source_names` (-1 = no source)
+- years and marks: exam metadata of PYQ questions (0 / NaN when unknown)
+Text is not held; it is read for the selected rows only (RetrievalService.fetch_texts).
+Selection works on row indices, so a request allocates a fixed number of arrays
+whatever the chunk count, and no per-chunk objects are created.
+"""
+
+import numpy as np
+
+TYPES = ("chapter", "pyq")
+TYPE_CODES = {name: code for code, name in enumerate(TYPES)}
+
+
+class ChunkSet:
+    __slots__ = ("ids", "index", "tokens", "types", "sources", "source_names", "years", "marks")
+
+    def __init__(self, ids, index, tokens, types, sources, source_names, years, marks):
+        self.ids = ids
+        self.index = index
+        self.tokens = tokens
+        self.types = types
+        self.sources = sources
+        self.source_names = source_names
+        self.years = years
+        self.marks = marks
+
+    @classmethod
+    def build(cls, ids, index, tokens, chunk_type="chapter", sources=None, years=None, marks=None):
+        """
+        ChunkSet from per-row lists aligned with the rows of `index`; `sources`,
+        `years` and `marks` are optional and may hold None for unknown values
+        """
+        n = len(ids)
+        source_names = sorted({name for name in sources or () if name is not None})
+        codes = {name: code for code, name in enumerate(source_names)}
+        return cls(
+            np.array(ids, dtype=str),
+            index,
+            np.array(tokens, dtype=np.int32).reshape(n),
+            np.full(n, TYPE_CODES[chunk_type], dtype=np.uint8),
+            np.array([codes.get(name, -1) for name in sources], dtype=np.int16) if sources
+            else np.full(n, -1, dtype=np.int16),
+            source_names,
+            np.array([year or 0 for year in years], dtype=np.int16) if years else np.zeros(n, dtype=np.int16),
+            np.array([np.nan if m is None else m for m in marks], dtype=np.float32) if marks
+            else np.full(n, np.nan, dtype=np.float32),
+        )
+
+    def meta(self):
+        """JSON-serializable columns (everything but the index), stored with snapshots"""
+        return {
+            "ids": self.ids.tolist(),
+            "tokens": self.tokens.tolist(),
+            "types": self.types.tolist(),
+            "sources": self.sources.tolist(),
+            "source_names": self.source_names,
+            "years": self.years.tolist(),
+            "marks": [None if np.isnan(m) else float(m) for m in self.marks],
+        }
+
+    @classmethod
+    def from_meta(cls, meta, index):
+        """ChunkSet from meta() output and the index it was saved with"""
+        return cls(
+            np.array(meta["ids"], dtype=str),
+            index,
+            np.array(meta["tokens"], dtype=np.int32),
+            np.array(meta["types"], dtype=np.uint8),
+            np.array(meta["sources"], dtype=np.int16),
+            list(meta["source_names"]),
+            np.array(meta["years"], dtype=np.int16),
+            np.array([np.nan if m is None else m for m in meta["marks"]], dtype=np.float32),
+        )
+
+    def __len__(self):
+        return len(self.ids)
+
+    def chunk_type(self, i):
+        return TYPES[self.types[i]]
+
+    def source(self, i):
+        code = self.sources[i]
+        return self.source_names[code] if code >= 0 else None
+
+    def record(self, i, text):
+        """Prompt context dict for row i: {"id", "text", "type"}, plus "source", "year", "marks" for PYQs"""
+        record = {"id": str(self.ids[i]), "text": text, "type": self.chunk_type(i)}
+        if record["type"] == "pyq":
+            record["source"] = self.source(i) or "unknown"
+            # Per-question PYQ documents carry exam metadata
+            if self.years[i]:
+                record["year"] = int(self.years[i])
+            if not np.isnan(self.marks[i]):
+                record["marks"] = float(self.marks[i])
+        return record
@@ -0,0 +1,123 @@
+"""
+Circuit Breaker
+Stops sending traffic to a failing or very slow dependency and probes it to recover
+"""
+
+import threading
+import time
+from collections import deque
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling the dependency while the circuit is open"""
+
+
+class CircuitBreaker:
+    """
+    Trips OPEN when, over the last `window` calls (and at least `min_calls`),
+    the error rate or the slow-call rate reaches its threshold.
+    After `open_seconds` it goes HALF_OPEN and lets `half_open_probes` calls
+    through: a success closes the circuit, a failure opens it again.
+    Exceptions in `ignored` (e.g. local admission timeouts) say nothing about the
+    dependency: they are re-raised without being recorded.
+    """
+
+    def __init__(self, name, failure_rate=0.5, slow_call_seconds=20.0, slow_call_rate=0.5,
+                 window=20, min_calls=5, open_seconds=30.0, half_open_probes=1, ignored=()):
+        self.name = name
+        self.ignored = tuple(ignored)
+        self.failure_rate = failure_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_call_rate = slow_call_rate
+        self.min_calls = min_calls
+        self.open_seconds = open_seconds
+        self.half_open_probes = half_open_probes
+
+        self.state = CLOSED
+        self.outcomes = deque(maxlen=window)  # (failed, slow) per call
+        self.opened_at = 0.0
+        self.probes_in_flight = 0
+        self.times_opened = 0
+        self.rejected = 0
+        self.lock = threading.Lock()
+
+    def allow(self):
+        """Admit a call or raise CircuitOpenError"""
+        with self.lock:
+            if self.state == OPEN:
+                if time.monotonic() - self.opened_at < self.open_seconds:
+                    self.rejected += 1
+                    raise CircuitOpenError(f"{self.name} circuit is open")
+                self.state = HALF_OPEN
+                self.probes_in_flight = 0
+                print(f"Circuit '{self.name}' half-open, probing")
+
+            if self.state == HALF_OPEN:
+                if self.probes_in_flight >= self.half_open_probes:
+                    self.rejected += 1
+                    raise CircuitOpenError(f"{self.name} circuit is half-open, probe in flight")
+                self.probes_in_flight += 1
+
+    def record(self, failed, duration):
+        """Record the outcome of an admitted call"""
+        slow = duration >= self.slow_call_seconds
+        with self.lock:
+            if self.state == HALF_OPEN:
+                self.probes_in_flight = max(0, self.probes_in_flight - 1)
+                if failed or slow:
+                    self._open()
+                else:
+                    self.state = CLOSED
+                    self.outcomes.clear()
+                    print(f"Circuit '{self.name}' closed")
+                return
+
+            self.outcomes.append((failed, slow))
+            if self.state == CLOSED and len(self.outcomes) >= self.min_calls:
+                total = len(self.outcomes)
+                failures = sum(1 for f, _ in self.outcomes if f)
+                slow_calls = sum(1 for _, s in self.outcomes if s)
+                if (failures / total >= self.failure_rate
+                        or slow_calls / total >= self.slow_call_rate):
+                    self._open()
+
+    def cancel(self):
+        """Forget an admitted call that never reached the dependency"""
+        with self.lock:
+            if self.state == HALF_OPEN:
+                self.probes_in_flight = max(0, self.probes_in_flight - 1)
+
+    def _open(self):
+        self.state = OPEN
+        self.opened_at = time.monotonic()
+        self.outcomes.clear()
+        self.times_opened += 1
+        print(f"Circuit '{self.name}' OPEN for {self.open_seconds:.0f}s")
+
+    def call(self, fn, *args, **kwargs):
+        """Run `fn` through the breaker, recording its outcome"""
+        self.allow()
+        start = time.monotonic()
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            if isinstance(e, self.ignored):
+                self.cancel()
+            else:
+                self.record(True, time.monotonic() - start)
+            raise
+        self.record(False, time.monotonic() - start)
+        return result
+
+    def stats(self):
+        with self.lock:
+            return {
+                "state": self.state,
+                "times_opened": self.times_opened,
+                "rejected": self.rejected,
+                "window_calls": len(self.outcomes),
+            }
@@ -0,0 +1,215 @@
+"""
+Embedding Index
+Compressed storage and search for the normalized chunk embeddings of one collection
+
+Codecs (EMBEDDING_CODEC):
+- float32  4 bytes per dimension, as read from Firestore
+- float16  2 bytes per dimension; scores within ~1e-3 of float32
+- int8     1 byte per dimension, symmetric per-dimension scale
+- pq       product quantization: one byte per 4 dimensions (96 bytes for MiniLM),
+           scored with a per-query lookup table
+
+Search scores every row on the codes, keeps a shortlist of RERANK_FACTORS[codec] * k
+rows and re-ranks it on exact float32 vectors when the index has them. An index saved
+with save(path, exact=matrix) keeps the codes in RAM after load() and memory-maps
+the float32 matrix, so only the shortlisted rows are read from disk (and the OS
+page cache shares them between worker processes). Without a snapshot,
+keep_exact(matrix) memory-maps the rows from an unlinked temporary file instead.
+"""
+
+import json
+import os
+import shutil
+import tempfile
+import uuid
+
+import numpy as np
+
+CODECS = ("float32", "float16", "int8", "pq")
+EMBEDDING_CODEC = os.getenv('EMBEDDING_CODEC', 'float16')
+
+# Shortlist size for exact re-ranking, as a multiple of k (coarser codes need more)
+RERANK_FACTORS = {"float32": 1, "float16": 2, "int8": 4, "pq": 16}
+# Rows decoded at a time while scoring, to keep the float32 temporary small
+SCORE_BLOCK_ROWS = 4096
+
+PQ_SUBSPACE_DIM = 4
+PQ_CENTROIDS = 256
+PQ_TRAIN_ROWS = 4096
+PQ_ITERATIONS = 8
+
+INDEX_FILE = "index.json"
+
+
+def _kmeans(points, count, iterations, rng):
+    """Centroids of `points` (float32 rows) by Lloyd's algorithm, `count` of them"""
+    centroids = points[rng.choice(len(points), count, replace=False)].copy()
+    for _ in range(iterations):
+        distances = (points ** 2).sum(1)[:, None] - 2 * points @ centroids.T + (centroids ** 2).sum(1)[None, :]
+        assign = distances.argmin(1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, points)
+        sizes = np.bincount(assign, minlength=count)[:, None]
+        # Empty clusters keep their previous centroid
+        centroids = np.where(sizes > 0, sums / np.maximum(sizes, 1), centroids)
+    return centroids.astype(np.float32)
+
+
+class EmbeddingIndex:
+    def __init__(self, codec, codes, dim, scale=None, codebooks=None, exact=None):
+        if codec not in CODECS:
+            raise ValueError(f"Unknown codec {codec!r}, expected one of {CODECS}")
+        self.codec = codec
+        self.codes = codes
+        self.dim = dim
+        self.scale = scale          # int8: per-dimension scale
+        self.codebooks = codebooks  # pq: (subspaces, centroids, subspace dim)
+        self.exact = exact          # optional float32 rows (usually memory-mapped) for re-ranking
+
+    @classmethod
+    def build(cls, matrix, codec=EMBEDDING_CODEC, seed=0):
+        """Index of the L2-normalized float32 rows of `matrix`"""
+        matrix = np.asarray(matrix, dtype=np.float32)
+        n, dim = matrix.shape
+        if codec == "float32":
+            return cls(codec, np.ascontiguousarray(matrix), dim)
+        if codec == "float16":
+            return cls(codec, matrix.astype(np.float16), dim)
+        if codec == "int8":
+            scale = np.abs(matrix).max(axis=0) / 127 if n else np.ones(dim, dtype=np.float32)
+            scale = np.where(scale == 0, 1.0, scale).astype(np.float32)
+            codes = np.clip(np.rint(matrix / scale), -127, 127).astype(np.int8)
+            return cls(codec, codes, dim, scale=scale)
+        if codec == "pq":
+            if dim % PQ_SUBSPACE_DIM:
+                raise ValueError(f"pq needs a dimension divisible by {PQ_SUBSPACE_DIM}, got {dim}")
+            subspaces = dim // PQ_SUBSPACE_DIM
+            parts = matrix.reshape(n, subspaces, PQ_SUBSPACE_DIM)
+            rng = np.random.default_rng(seed)
+            train = parts[rng.choice(n, min(n, PQ_TRAIN_ROWS), replace=False)] if n else parts
+            count = max(1, min(PQ_CENTROIDS, n))
+            codebooks = np.zeros((subspaces, count, PQ_SUBSPACE_DIM), dtype=np.float32)
+            codes = np.zeros((n, subspaces), dtype=np.uint8)
+            for s in range(subspaces if n else 0):
+                codebooks[s] = _kmeans(train[:, s], count, PQ_ITERATIONS, rng)
+                distances = -2 * parts[:, s] @ codebooks[s].T + (codebooks[s] ** 2).sum(1)[None, :]
+                codes[:, s] = distances.argmin(1)
+            return cls(codec, codes, dim, codebooks=codebooks)
+        raise ValueError(f"Unknown codec {codec!r}, expected one of {CODECS}")
+
+    def __len__(self):
+        return len(self.codes)
+
+    @property
+    def nbytes(self):
+        """Bytes held in memory (codes and codec tables, not the memory-mapped exact rows)"""
+        extra = sum(a.nbytes for a in (self.scale, self.codebooks) if a is not None)
+        return self.codes.nbytes + extra
+
+    def scores(self, query):
+        """Approximate similarity of every row to the normalized float32 `query`"""
+        query = np.asarray(query, dtype=np.float32)
+        if self.codec == "float32":
+            return self.codes @ query
+        if self.codec == "pq":
+            subspaces, _, subspace_dim = self.codebooks.shape
+            # (subspaces, centroids) table of partial dot products, then one gather per row
+            table = np.einsum("scd,sd->sc", self.codebooks, query.reshape(subspaces, subspace_dim))
+            return table[np.arange(subspaces), self.codes].sum(axis=1, dtype=np.float32)
+        if self.codec == "int8":
+            query = query * self.scale
+        out = np.empty(len(self.codes), dtype=np.float32)
+        for start in range(0, len(self.codes), SCORE_BLOCK_ROWS):
+            block = self.codes[start:start + SCORE_BLOCK_ROWS]
+            out[start:start + len(block)] = block.astype(np.float32) @ query
+        return out
+
+    def decode(self, rows):
+        """Approximate float32 vectors of `rows`, reconstructed from the codes"""
+        codes = self.codes[rows]
+        if self.codec == "int8":
+            return codes.astype(np.float32) * self.scale
+        if self.codec == "pq":
+            subspaces = self.codebooks.shape[0]
+            return self.codebooks[np.arange(subspaces), codes].reshape(len(codes), self.dim)
+        return codes.astype(np.float32)
+
+    def keep_exact(self, matrix):
+        """
+        Re-rank on the float32 rows of `matrix`, written to an unlinked temporary
+        file and memory-mapped (so they stay out of the process heap)
+        """
+        if self.codec == "float32":
+            return  # the codes are exact
+        matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+        if not len(matrix):
+            self.exact = matrix
+            return
+        with tempfile.TemporaryFile() as f:
+            matrix.tofile(f)
+            f.flush()
+            # The mapping keeps the data after the file is closed
+            self.exact = np.memmap(f, dtype=np.float32, mode="r", shape=matrix.shape)
+
+    def vectors(self, rows):
+        """float32 vectors of `rows`: exact if the index has them, else decoded"""
+        if self.exact is not None:
+            return np.asarray(self.exact[rows], dtype=np.float32)
+        return self.decode(rows)
+
+    def search(self, query, k, rerank=None):
+        """Row indices of the k rows most similar to `query`, best first"""
+        if len(self) == 0 or k <= 0:
+            return np.zeros(0, dtype=np.int64)
+        approx = self.scores(query)
+        n = min(len(approx), k * (rerank or RERANK_FACTORS[self.codec]))
+        shortlist = np.argpartition(-approx, n - 1)[:n]
+        if self.exact is not None and self.codec != "float32":
+            shortlist = np.sort(shortlist)  # ascending rows read the memory map in order
+            scores = self.vectors(shortlist) @ np.asarray(query, dtype=np.float32)
+        else:
+            scores = approx[shortlist]
+        return shortlist[np.argsort(-scores)[:k]]
+
+    def save(self, path, exact=None, meta=None):
+        """
+        Write the index to directory `path` (replacing it), plus the float32 `exact`
+        rows for re-ranking and a JSON-serializable `meta` dict returned by load()
+        """
+        parent = os.path.dirname(os.path.abspath(path))
+        os.makedirs(parent, exist_ok=True)
+        tmp = os.path.join(parent, f".{os.path.basename(path)}.{uuid.uuid4().hex}")
+        os.makedirs(tmp)
+        np.save(os.path.join(tmp, "codes.npy"), self.codes)
+        if self.scale is not None:
+            np.save(os.path.join(tmp, "scale.npy"), self.scale)
+        if self.codebooks is not None:
+            np.save(os.path.join(tmp, "codebooks.npy"), self.codebooks)
+        if exact is not None and self.codec != "float32":  # float32 codes are already exact
+            np.save(os.path.join(tmp, "exact.npy"), np.ascontiguousarray(exact, dtype=np.float32))
+        with open(os.path.join(tmp, INDEX_FILE), "w") as f:
+            json.dump({"codec": self.codec, "dim": self.dim, "count": len(self), "meta": meta or {}}, f)
+
+        # Swap directories so readers never see a half-written index
+        old = None
+        if os.path.exists(path):
+            old = f"{tmp}.old"
+            os.replace(path, old)
+        os.replace(tmp, path)
+        if old:
+            shutil.rmtree(old, ignore_errors=True)
+
+    @classmethod
+    def load(cls, path):
+        """(index, meta) from a directory written by save(); exact rows are memory-mapped"""
+        with open(os.path.join(path, INDEX_FILE)) as f:
+            info = json.load(f)
+
+        def optional(name, **kwargs):
+            file = os.path.join(path, name)
+            return np.load(file, **kwargs) if os.path.exists(file) else None
+
+        index = cls(info["codec"], np.load(os.path.join(path, "codes.npy")), info["dim"],
+                    scale=optional("scale.npy"), codebooks=optional("codebooks.npy"),
+                    exact=optional("exact.npy", mmap_mode="r"))
+        return index, info["meta"]
@@ -6,59 +6,168 @@ Handles all interactions with Google's Gemini API for quiz generation and gradin
 import os
 import json
 import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 import google.generativeai as genai
 
+from circuit_breaker import CircuitBreaker, CircuitOpenError
+from hedging import LLMDeadlineExceeded, LatencyTracker, hedged_call
+from llm_governor import GovernorTimeout, LLMGovernor, estimate_tokens
+from metrics import CACHE_LOOKUPS, LLM_CALLS, LLM_TOKENS, STAGE_SECONDS
+import trace_recorder
+
 load_dotenv()
 
+# Single-letter difficulty used in the compact generation schema
+DIFFICULTY_CODES = {"e": "easy", "m": "medium", "h": "hard"}
+# Letter answers ("B", "(b)") some responses use instead of 1-based option numbers
+ANSWER_LETTERS = {"a": 1, "b": 2, "c": 3, "d": 4}
+# Fail generation when fewer than this share of the requested questions are well-formed
+MIN_VALID_QUESTION_RATIO = 0.5
+
 class GeminiService:
-    def __init__(self):
-        api_key = os.getenv('GEMINI_API_KEY')
-        if not api_key:
-            raise ValueError("GEMINI_API_KEY not found in environment")
+    def __init__(self, model=None):
+        """`model` can be injected (anything with generate_content) instead of Gemini"""
+        if model is None:
+            api_key = os.getenv('GEMINI_API_KEY')
+            if not api_key:
+                raise ValueError("GEMINI_API_KEY not found in environment")
+            
+            genai.configure(api_key=api_key)
+            model = genai.GenerativeModel('gemini-2.5-flash')
+        self.model = model
+        self.governor = LLMGovernor.from_env()
+        
+        # Hedging: if a call is slower than this latency percentile, send a backup
+        self.hedge_enabled = os.getenv('GEMINI_HEDGE_ENABLED', '1') == '1'
+        self.hedge_percentile = float(os.getenv('GEMINI_HEDGE_PERCENTILE', '95'))
+        self.latency = {"mcq": LatencyTracker(), "report": LatencyTracker(),
+                        "explain": LatencyTracker()}
+        self.executor = ThreadPoolExecutor(max_workers=self.governor.max_concurrency * 2 + 2,
+                                           thread_name_prefix="gemini")
+        # Bumped from request threads and hedge threads
+        self.hedge_lock = threading.Lock()
+        self.hedge_stats = {"issued": 0, "won": 0, "deadline_exceeded": 0}
         
-        genai.configure(api_key=api_key)
-        self.model = genai.GenerativeModel('gemini-2.5-flash')
+        # Stop calling Gemini while it is failing or very slow; probe to recover
+        self.breaker = CircuitBreaker(
+            "gemini",
+            failure_rate=float(os.getenv('GEMINI_BREAKER_FAILURE_RATE', '0.5')),
+            slow_call_seconds=float(os.getenv('GEMINI_BREAKER_SLOW_SECONDS', '20')),
+            open_seconds=float(os.getenv('GEMINI_BREAKER_OPEN_SECONDS', '30')),
+            # A full local queue is not a Gemini failure
+            ignored=(GovernorTimeout,),
+        )
+        
+        # Word cap for explanations in the compact generation schema
+        self.explanation_words = int(os.getenv('GEMINI_EXPLANATION_WORDS', '20'))
+        
+        # Last good MCQs per retrieved context, served when the deadline runs out
+        self.mcq_cache = OrderedDict()
+        self.mcq_cache_size = 128
+        self.mcq_cache_lock = threading.Lock()
     
-    def generate_mcqs(self, context_chunks, num_questions=10):
+    def _generate(self, prompt, expected_output_tokens=1024, kind="mcq", deadline=None):
         """
-        Generate MCQ questions using retrieved context chunks
+        Call the model through the circuit breaker and governor (rate limits,
+        concurrency, retries), hedging slow calls and giving up at `deadline`
+        (time.monotonic()). Raises CircuitOpenError while Gemini is unhealthy.
         """
-        # Build context from chunks
-        context_text = "\n\n---\n\n".join([
-            f"SOURCE: {c.get('id', 'unknown')}:\n{c.get('text', '')[:500]}"
-            for c in context_chunks
-        ])
+        start = time.monotonic()
+        try:
+            response = self.breaker.call(self._hedged_generate, prompt, expected_output_tokens,
+                                         kind, deadline)
+        except Exception as e:
+            if isinstance(e, CircuitOpenError):
+                LLM_CALLS.inc(kind=kind, outcome="circuit_open")
+            trace_recorder.record_llm(kind, prompt, error=e, seconds=time.monotonic() - start)
+            raise
+        trace_recorder.record_llm(kind, prompt, response=response, seconds=time.monotonic() - start)
+        return response
+    
+    def _hedged_generate(self, prompt, expected_output_tokens, kind, deadline):
+        if deadline is None:
+            deadline = time.monotonic() + self.governor.default_timeout
+        tracker = self.latency[kind]
         
-        prompt = f"""You are an exam question generator for Class 8 students. Use ONLY the following CONTEXT to generate {num_questions} multiple-choice questions.
-
-STRICT REQUIREMENTS:
-- Each question must have exactly 4 options (A, B, C, D)
-- Mark the correct answer with its index (1-4)
-- Provide a brief explanation
-- Label difficulty: easy, medium, or hard
-- Reference the source chunk
-
-Return ONLY a valid JSON array with this exact structure:
-[
-  {{
-    "q": "question text here",
-    "options": ["option A", "option B", "option C", "option D"],
-    "answer": 2,
-    "explanation": "brief explanation using context",
-    "difficulty": "medium",
-    "source": "chunk id"
-  }}
-]
-
-CONTEXT:
-{context_text}
-
-Generate exactly {num_questions} questions. Return ONLY the JSON array, no other text.
-"""
+        def timed_generate(prompt, **kwargs):
+            start = time.monotonic()
+            response = self.model.generate_content(prompt, **kwargs)
+            elapsed = time.monotonic() - start
+            tracker.record(elapsed)
+            STAGE_SECONDS.observe(elapsed, stage=f"generate_content_{kind}")
+            usage = getattr(response, "usage_metadata", None)
+            if usage is not None:
+                LLM_TOKENS.inc(getattr(usage, "prompt_token_count", 0) or 0, kind=kind, direction="prompt")
+                LLM_TOKENS.inc(getattr(usage, "candidates_token_count", 0) or 0, kind=kind, direction="output")
+            return response
         
+        def call():
+            remaining = max(1.0, deadline - time.monotonic())
+            return self.governor.call(
+                timed_generate,
+                prompt,
+                estimated_tokens=estimate_tokens(prompt) + expected_output_tokens,
+                deadline=deadline,
+                request_options={"timeout": remaining},
+            )
+        
+        hedge_after = tracker.percentile(self.hedge_percentile) if self.hedge_enabled else None
         try:
-            response = self.model.generate_content(prompt)
+            with STAGE_SECONDS.time(stage=f"llm_{kind}"):
+                response, hedge_status = hedged_call(
+                    self.executor, call, deadline,
+                    hedge_after=hedge_after,
+                    allow_hedge=self._can_hedge,
+                )
+        except GovernorTimeout:
+            LLM_CALLS.inc(kind=kind, outcome="rejected")
+            raise
+        except LLMDeadlineExceeded:
+            self._bump_hedge("deadline_exceeded")
+            LLM_CALLS.inc(kind=kind, outcome="deadline_exceeded")
+            raise
+        except Exception:
+            LLM_CALLS.inc(kind=kind, outcome="error")
+            raise
+        LLM_CALLS.inc(kind=kind, outcome="ok")
+        if hedge_status != "none":
+            self._bump_hedge("issued")
+        if hedge_status == "won":
+            self._bump_hedge("won")
+        return response
+    
+    def _bump_hedge(self, key):
+        with self.hedge_lock:
+            self.hedge_stats[key] += 1
+    
+    def hedge_snapshot(self):
+        """Copy of the hedging counters"""
+        with self.hedge_lock:
+            return dict(self.hedge_stats)
+    
+    def _can_hedge(self):
+        """Only hedge when the governor has spare capacity"""
+        return self.governor.stats()["queue_depth"] == 0
+    
+    def generate_mcqs(self, context_chunks, num_questions=10, deadline=None, explanations=True):
+        """
+        Generate MCQ questions using retrieved context chunks.
+        With explanations=False (fast mode) questions come back with an empty
+        explanation; see generate_explanations() to fill them in later.
+        If `deadline` passes or the circuit is open, returns the last questions
+        generated for the same context, or re-raises when there are none.
+        """
+        cache_key = (tuple(c.get('id') for c in context_chunks), num_questions, explanations)
+        prompt = self.build_mcq_prompt(context_chunks, num_questions, explanations)
+        tokens_per_question = 70 if explanations else 45
+        
+        try:
+            response = self._generate(prompt, expected_output_tokens=tokens_per_question * num_questions,
+                                      kind="mcq", deadline=deadline)
             text = response.text
             
             # Extract JSON from response
@@ -68,103 +177,158 @@ Generate exactly {num_questions} questions. Return ONLY the JSON array, no other
             if not isinstance(questions, list):
                 raise ValueError("Response is not a list")
             
+            # Expand the compact wire format to the client's response shape,
+            # dropping malformed items (bad answer, missing options) instead of the whole quiz
+            expanded = [self._expand_question(q) for q in questions if isinstance(q, dict)]
+            valid = [q for q in expanded if q is not None]
+            if len(valid) < len(questions):
+                print(f"Dropped {len(questions) - len(valid)} malformed questions")
+            if len(valid) < max(1, MIN_VALID_QUESTION_RATIO * num_questions):
+                raise ValueError(f"Only {len(valid)} of {num_questions} questions were well-formed")
+            questions = valid
+            
+            with self.mcq_cache_lock:
+                self.mcq_cache[cache_key] = questions
+                self.mcq_cache.move_to_end(cache_key)
+                if len(self.mcq_cache) > self.mcq_cache_size:
+                    self.mcq_cache.popitem(last=False)
+            
             return questions
             
+        except (LLMDeadlineExceeded, CircuitOpenError) as e:
+            with self.mcq_cache_lock:
+                cached = self.mcq_cache.get(cache_key)
+            CACHE_LOOKUPS.inc(cache="mcq_fallback", result="hit" if cached is not None else "miss")
+            if cached is not None:
+                print(f"MCQ generation unavailable ({type(e).__name__}), serving cached questions")
+                return [dict(q) for q in cached]
+            raise
         except Exception as e:
             print(f"Error generating MCQs: {e}")
             raise
     
-    def generate_improvement_analysis(self, score, per_question, wrong_topics):
-        """
-        Generate detailed improvement analysis based on quiz performance
-        """
-        # Build errors summary
-        errors = [
-            f"Q: {pq['q'][:60]}... - Selected: {pq['selected']}, Correct: {pq['correct']}"
-            for pq in per_question if not pq.get('ok', False)
-        ]
-        errors_text = "\n".join(errors) if errors else "All correct!"
-        
-        topics_text = ", ".join([f"{topic} ({count} errors)" for topic, count in wrong_topics.items()])
-"""
-Gemini AI Service
-Handles all interactions with Google's Gemini API for quiz generation and grading
-"""
-
-import os
-import json
-import re
-from dotenv import load_dotenv
-import google.generativeai as genai
-
-load_dotenv()
-
-class GeminiService:
-    def __init__(self):
-        api_key = os.getenv('GEMINI_API_KEY')
-        if not api_key:
-            raise ValueError("GEMINI_API_KEY not found in environment")
-        
-        genai.configure(api_key=api_key)
-        self.model = genai.GenerativeModel('gemini-2.5-flash')
-    
-    def generate_mcqs(self, context_chunks, num_questions=10):
-        """
-        Generate MCQ questions using retrieved context chunks
-        """
+    def build_mcq_prompt(self, context_chunks, num_questions, explanations=True):
+        """Prompt asking for MCQs in the compact wire schema"""
         # Build context from chunks
         context_text = "\n\n---\n\n".join([
-            f"SOURCE: {c.get('id', 'unknown')}:\n{c.get('text', '')[:500]}"
+            f"SOURCE: {c.get('id', 'unknown')}{self._exam_label(c)}:\n{c.get('text', '')[:500]}"
             for c in context_chunks
         ])
         
-        prompt = f"""You are an exam question generator for Class 8 students. Use ONLY the following CONTEXT to generate {num_questions} multiple-choice questions.
+        if explanations:
+            explanation_rule = f'- "e" is an explanation of at most {self.explanation_words} words\n'
+            explanation_field = '"e":"short explanation",'
+        else:
+            explanation_rule = ""
+            explanation_field = ""
+        
+        return f"""You are an exam question generator for Class 8 students. Use ONLY the following CONTEXT to generate {num_questions} multiple-choice questions.
 
 STRICT REQUIREMENTS:
-- Each question must have exactly 4 options (A, B, C, D)
-- Mark the correct answer with its index (1-4)
-- Provide a brief explanation
-- Label difficulty: easy, medium, or hard
-- Reference the source chunk
+- Each question must have exactly 4 options
+- "a" is the index (1-4) of the correct option
+{explanation_rule}- "d" is the difficulty: "e" (easy), "m" (medium) or "h" (hard)
+- "s" is the SOURCE id of the chunk used
 
-Return ONLY a valid JSON array with this exact structure:
-[
-  {{
-    "q": "question text here",
-    "options": ["option A", "option B", "option C", "option D"],
-    "answer": 2,
-    "explanation": "brief explanation using context",
-    "difficulty": "medium",
-    "source": "chunk id"
-  }}
-]
+Return ONLY a compact JSON array (no indentation) in this exact format:
+[{{"q":"question text","o":["option 1","option 2","option 3","option 4"],"a":2,{explanation_field}"d":"m","s":"chunk id"}}]
 
 CONTEXT:
 {context_text}
 
 Generate exactly {num_questions} questions. Return ONLY the JSON array, no other text.
+"""
+    
+    def _expand_question(self, item):
+        """
+        Map a compact question {q,o,a,e,d,s} to the API shape
+        {q, options, answer, explanation, difficulty, source}.
+        Verbose keys are accepted too in case the model ignores the format.
+        Returns None for an item without question text, at least two options and
+        an answer naming one of them (a 1-based number or a letter).
+        """
+        question = item.get('q', item.get('question'))
+        options = item.get('o', item.get('options'))
+        if not isinstance(question, str) or not question.strip():
+            return None
+        if not isinstance(options, list) or len(options) < 2 or not all(isinstance(o, str) for o in options):
+            return None
+        answer = self._answer_index(item.get('a', item.get('answer')))
+        if answer is None or not 1 <= answer <= len(options):
+            return None
+        
+        difficulty = str(item.get('d', item.get('difficulty', 'm'))).lower()
+        return {
+            "q": question,
+            "options": options,
+            "answer": answer,
+            "explanation": item.get('e', item.get('explanation', '')),
+            "difficulty": DIFFICULTY_CODES.get(difficulty, difficulty),
+            "source": item.get('s', item.get('source', '')),
+        }
+    
+    @staticmethod
+    def _answer_index(answer):
+        """1-based option number from 2, "2", "B" or "(b)"; None if unrecognized"""
+        if isinstance(answer, bool):
+            return None
+        if isinstance(answer, int):
+            return answer
+        if isinstance(answer, float) and answer.is_integer():
+            return int(answer)
+        if isinstance(answer, str):
+            text = answer.strip().strip("().").strip().lower()
+            if text.isdigit():
+                return int(text)
+            return ANSWER_LETTERS.get(text)
+        return None
+    
+    def generate_explanations(self, questions, context=None, deadline=None):
+        """
+        Batch-generate short explanations for `questions` (API shape) in one call.
+        `context` optionally maps source ids to chunk text to ground the answers.
+        Returns a list of explanations in the same order ('' where unavailable).
+        """
+        if not questions:
+            return []
+        context = context or {}
+        
+        items = []
+        for i, q in enumerate(questions, 1):
+            options = " | ".join(f"{n}) {o}" for n, o in enumerate(q.get('options', []), 1))
+            correct = q.get('answer')
+            source_text = context.get(q.get('source'), '')[:300]
+            item = f"{i}. Q: {q.get('q', '')}\n   Options: {options}\n   Correct option: {correct}"
+            if source_text:
+                item += f"\n   Context: {source_text}"
+            items.append(item)
+        
+        prompt = f"""You are a Class 8 teacher. For each multiple-choice question below, explain in at most {self.explanation_words} words why the correct option is right.
+
+QUESTIONS:
+{chr(10).join(items)}
+
+Return ONLY a compact JSON object mapping question number to explanation, e.g. {{"1":"...","2":"..."}}
 """
         
         try:
-            response = self.model.generate_content(prompt)
-            text = response.text
-            
-            # Extract JSON from response
-            questions = self._extract_json(text)
-            
-            # Validate structure
-            if not isinstance(questions, list):
-                raise ValueError("Response is not a list")
-            
-            return questions
-            
+            response = self._generate(prompt, expected_output_tokens=35 * len(questions),
+                                      kind="explain", deadline=deadline)
+            result = self._extract_json(response.text)
+            if not isinstance(result, dict):
+                raise ValueError("Response is not an object")
+            return [str(result.get(str(i), '')) for i in range(1, len(questions) + 1)]
+        except CircuitOpenError:
+            return [''] * len(questions)
         except Exception as e:
-            print(f"Error generating MCQs: {e}")
-            raise
+            print(f"Error generating explanations: {e}")
+            return [''] * len(questions)
     
-    def generate_improvement_analysis(self, score, per_question, wrong_topics):
+    def generate_improvement_analysis(self, score, per_question, wrong_topics, deadline=None):
         """
-        Generate detailed improvement analysis based on quiz performance
+        Generate detailed improvement analysis based on quiz performance.
+        Falls back to a local template report on errors, when `deadline` passes
+        or while the circuit is open.
         """
         # Build errors summary
         errors = [
@@ -188,7 +352,7 @@ ERRORS:
 Provide a detailed, encouraging improvement report in JSON format.
 
 IMPORTANT INSTRUCTIONS:
-1. Map the "internal IDs" (e.g., pyq2024_chunk14) to real NCERT Chapter Topics/Subtopics based on the context of the error. Do NOT show the internal IDs to the user.
+1. Map the "internal IDs" (e.g., pyq2024_q14) to real NCERT Chapter Topics/Subtopics based on the context of the error. Do NOT show the internal IDs to the user.
 2. Suggest specific NCERT chapter sections to read.
 3. Be specific, encouraging, and actionable.
 
@@ -219,7 +383,8 @@ Return ONLY the JSON object. Do not use markdown formatting like ```json.
 """
         
         try:
-            response = self.model.generate_content(prompt)
+            response = self._generate(prompt, expected_output_tokens=800,
+                                      kind="report", deadline=deadline)
             text = response.text
             
             report = self._extract_json(text)
@@ -230,15 +395,80 @@ Return ONLY the JSON object. Do not use markdown formatting like ```json.
             
             return report
             
+        except CircuitOpenError:
+            return self.template_report(score, per_question, wrong_topics)
         except Exception as e:
             print(f"Error generating analysis: {e}")
-            # Fallback report
-            return {
-                "weaknesses": [{"topic": "General Review", "count": 1, "description": "Review the chapter content"}],
-                "steps": ["Read the chapter again", "Practice more questions"],
-                "checklist": ["Complete chapter exercises"],
-                "summary": f"You scored {score}%. Please review the chapter content and try again."
-            }
+            return self.template_report(score, per_question, wrong_topics)
+    
+    def template_report(self, score, per_question, wrong_topics):
+        """
+        Deterministic improvement report built locally from wrong_topics,
+        used when Gemini is unavailable. Same shape as the AI report.
+        """
+        missed = {}
+        for pq in per_question:
+            if not pq.get('ok', False):
+                missed.setdefault(pq.get('source') or 'unknown', []).append(pq.get('q') or '')
+        
+        weaknesses = []
+        steps = []
+        checklist = []
+        ranked = sorted(wrong_topics.items(), key=lambda item: (-item[1], item[0]))
+        for source, count in ranked:
+            topic = self._topic_label(source)
+            example = (missed.get(source) or [''])[0][:80]
+            weaknesses.append({
+                "topic": topic,
+                "count": count,
+                "description": f"Missed {count} question(s), e.g. \"{example}\"" if example
+                               else f"Missed {count} question(s) from this part"
+            })
+            steps.append(f"Re-read {topic.lower()} and note the key terms")
+            checklist.append(f"Answer 3 practice questions on {topic.lower()}")
+        
+        if not weaknesses:
+            weaknesses = [{"topic": "General Review", "count": 0, "description": "No mistakes in this quiz"}]
+            steps = ["Move on to the next chapter", "Revise this chapter once a week"]
+            checklist = ["Try a harder quiz on this chapter"]
+        else:
+            steps.append("Retake the quiz once you have revised")
+        
+        if score >= 80:
+            tone = "Great work!"
+        elif score >= 50:
+            tone = "Good effort, you are getting there."
+        else:
+            tone = "Keep going, every attempt helps."
+        if ranked:
+            advice = f"Focus first on {weaknesses[0]['topic'].lower()}, then retake the quiz."
+        else:
+            advice = "You are ready for the next chapter."
+        
+        return {
+            "weaknesses": weaknesses,
+            "steps": steps,
+            "checklist": checklist,
+            "summary": f"You scored {score}%. {tone} {advice}"
+        }
+    
+    def _topic_label(self, source):
+        """Readable label for an internal chunk id (e.g. chunk3, pyq2024_q14, pyq2024_chunk14)"""
+        match = re.match(r'^(?:(.+)_)?(?:chunk|q)(\d+)$', source or '')
+        if not match:
+            return "General Review"
+        if match.group(1):
+            return f"Past paper questions ({match.group(1)})"
+        return f"Chapter section {match.group(2)}"
+    
+    def _exam_label(self, chunk):
+        """Exam metadata suffix for a PYQ question, e.g. ' (2019, 3 marks)', or ''"""
+        parts = []
+        if chunk.get('year'):
+            parts.append(str(chunk['year']))
+        if chunk.get('marks'):
+            parts.append(f"{chunk['marks']:g} marks")
+        return f" ({', '.join(parts)})" if parts else ""
     
     def _extract_json(self, text):
         """Extract JSON from model response that might have extra text"""
@@ -0,0 +1,85 @@
+"""
+Hedged Requests
+Deadline-bounded execution with a backup ("hedged") request for slow LLM calls
+"""
+
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, wait
+
+
+class LLMDeadlineExceeded(Exception):
+    """Raised when no LLM response arrived before the caller's deadline"""
+
+
+class LatencyTracker:
+    """Rolling window of observed call latencies (seconds)"""
+
+    def __init__(self, window=200, min_samples=20):
+        self.samples = deque(maxlen=window)
+        self.min_samples = min_samples
+        self.lock = threading.Lock()
+
+    def record(self, seconds):
+        with self.lock:
+            self.samples.append(seconds)
+
+    def percentile(self, p):
+        """Latency at percentile `p` (0-100), or None until enough samples exist"""
+        with self.lock:
+            if len(self.samples) < self.min_samples:
+                return None
+            ordered = sorted(self.samples)
+        index = min(len(ordered) - 1, int(round(p / 100.0 * (len(ordered) - 1))))
+        return ordered[index]
+
+
+def hedged_call(executor, fn, deadline, hedge_after=None, allow_hedge=None):
+    """
+    Run `fn()` on `executor`. If it has not finished `hedge_after` seconds later,
+    start one backup copy; the first successful result wins.
+
+    Returns (result, hedge_status) where hedge_status is "none", "issued" (backup
+    sent but the primary won) or "won" (backup answered first).
+    Raises LLMDeadlineExceeded if nothing succeeds before `deadline`
+    (time.monotonic()), or the last error if every copy failed.
+    The losing call is left to finish in the background and its result discarded.
+    """
+    started = time.monotonic()
+    primary = executor.submit(fn)
+    pending = {primary}
+    hedge = None
+    last_error = None
+
+    while pending:
+        now = time.monotonic()
+        remaining = deadline - now
+        if remaining <= 0:
+            raise LLMDeadlineExceeded("LLM call did not complete before deadline")
+
+        timeout = remaining
+        can_hedge = hedge is None and hedge_after is not None
+        if can_hedge:
+            timeout = min(timeout, max(0.0, started + hedge_after - now))
+
+        done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+        for future in done:
+            try:
+                result = future.result()
+            except Exception as e:
+                last_error = e
+                continue
+            if hedge is None:
+                return result, "none"
+            return result, "won" if future is hedge else "issued"
+
+        if can_hedge and pending and time.monotonic() >= started + hedge_after:
+            if allow_hedge is None or allow_hedge():
+                hedge = executor.submit(fn)
+                pending.add(hedge)
+            else:
+                # Don't add load while the LLM queue is backed up; just wait
+                hedge_after = None
+
+    raise last_error
@@ -0,0 +1,45 @@
+"""
+Document Ids
+Scatter-distributed ids for write-heavy, time-ordered collections (quizzes, attempts)
+"""
+
+import secrets
+import time
+
+_ALPHABET = "0123456789abcdefghijklmnopqrstuvwxyz"
+
+# Random leading characters spread consecutive writes over the whole key range
+SCATTER_CHARS = 4
+TIME_CHARS = 9      # milliseconds since the epoch, base 36 (good until year 5188)
+RANDOM_CHARS = 8
+
+
+def _base36(value, width):
+    chars = []
+    for _ in range(width):
+        value, digit = divmod(value, 36)
+        chars.append(_ALPHABET[digit])
+    return "".join(reversed(chars))
+
+
+def now_ms():
+    """Value for the indexed `created_ts` field that keeps documents sortable by time"""
+    return time.time_ns() // 1_000_000
+
+
+def scatter_id(prefix="", ms=None):
+    """
+    Id of the form <prefix><scatter><time><random>, e.g. "quiz_k3x90lzq1c2wf8a1b2c3d".
+    Keys are not monotonic (no write hotspot on one tablet), need no shared state or
+    locks, and two ids in the same millisecond collide with probability ~36^-12.
+    """
+    ms = now_ms() if ms is None else ms
+    scatter = _base36(secrets.randbelow(36 ** SCATTER_CHARS), SCATTER_CHARS)
+    suffix = _base36(secrets.randbelow(36 ** RANDOM_CHARS), RANDOM_CHARS)
+    return f"{prefix}{scatter}{_base36(ms, TIME_CHARS)}{suffix}"
+
+
+def id_timestamp_ms(doc_id, prefix=""):
+    """Creation time (ms) encoded in a scatter id"""
+    start = len(prefix) + SCATTER_CHARS
+    return int(doc_id[start:start + TIME_CHARS], 36)
@@ -0,0 +1,255 @@
+"""
+LLM Governor
+Concurrency cap, request/token rate limiting and retry policy for Gemini calls
+"""
+
+import os
+import random
+import threading
+import time
+
+from google.api_core import exceptions as google_exceptions
+
+from hedging import LLMDeadlineExceeded
+from metrics import STAGE_SECONDS
+
+# Provider errors worth retrying: quota, overload and transient server faults
+RETRYABLE_ERRORS = (
+    google_exceptions.ResourceExhausted,
+    google_exceptions.TooManyRequests,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.InternalServerError,
+    google_exceptions.DeadlineExceeded,
+)
+
+# Errors that mean "slow down", not just "try again"
+THROTTLE_ERRORS = (
+    google_exceptions.ResourceExhausted,
+    google_exceptions.TooManyRequests,
+)
+
+
+class GovernorTimeout(LLMDeadlineExceeded):
+    """
+    Raised when a call cannot be admitted or retried before its deadline.
+    A deadline miss for callers (same fallbacks), but caused by local load, not the provider.
+    """
+
+
+def estimate_tokens(text):
+    """Rough token estimate (~4 characters per token) used for budgeting"""
+    return max(1, len(text) // 4)
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket refilled continuously at `rate_per_minute`.
+    The effective rate can be scaled down on throttling and recovers gradually.
+    """
+
+    def __init__(self, rate_per_minute, min_factor=0.1):
+        self.capacity = float(rate_per_minute)
+        self.tokens = float(rate_per_minute)
+        self.rate_per_minute = float(rate_per_minute)
+        self.factor = 1.0
+        self.min_factor = min_factor
+        self.updated = time.monotonic()
+        self.cond = threading.Condition()
+
+    def _refill(self):
+        now = time.monotonic()
+        rate_per_sec = self.rate_per_minute * self.factor / 60.0
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * rate_per_sec)
+        self.updated = now
+
+    def acquire(self, amount, deadline):
+        """
+        Block until `amount` tokens are available or `deadline` (monotonic) passes.
+        Returns the seconds spent waiting, or raises GovernorTimeout.
+        """
+        amount = min(float(amount), self.capacity)
+        started = time.monotonic()
+        with self.cond:
+            while True:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return time.monotonic() - started
+
+                rate_per_sec = self.rate_per_minute * self.factor / 60.0
+                wait = (amount - self.tokens) / rate_per_sec
+                remaining = deadline - time.monotonic()
+                if wait > remaining:
+                    raise GovernorTimeout("Rate limit budget not available before deadline")
+                self.cond.wait(wait)
+
+    def debit(self, amount):
+        """Charge extra usage discovered after the call (may go negative)"""
+        with self.cond:
+            self._refill()
+            self.tokens -= amount
+
+    def credit(self, amount):
+        """Return over-estimated usage to the bucket"""
+        with self.cond:
+            self._refill()
+            self.tokens = min(self.capacity, self.tokens + amount)
+            self.cond.notify_all()
+
+    def throttle(self):
+        """Multiplicative decrease of the effective rate after a quota error"""
+        with self.cond:
+            self._refill()
+            self.factor = max(self.min_factor, self.factor * 0.5)
+
+    def recover(self):
+        """Additive increase of the effective rate after a successful call"""
+        with self.cond:
+            if self.factor < 1.0:
+                self._refill()
+                self.factor = min(1.0, self.factor + 0.05)
+
+
+class LLMGovernor:
+    """
+    Admission control for LLM calls:
+    - bounded concurrency (semaphore)
+    - requests-per-minute and tokens-per-minute budgets
+    - deadline-aware retries with full-jitter exponential backoff
+    - queue depth / throughput counters for monitoring
+    """
+
+    def __init__(self, rpm=60, tpm=250000, max_concurrency=4, max_retries=3,
+                 base_delay=0.5, max_delay=8.0, default_timeout=60.0):
+        self.request_bucket = TokenBucket(rpm)
+        self.token_bucket = TokenBucket(tpm)
+        self.max_concurrency = max_concurrency
+        self.slots = threading.BoundedSemaphore(max_concurrency)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.default_timeout = default_timeout
+
+        self._lock = threading.Lock()
+        self._stats = {
+            "queue_depth": 0,
+            "max_queue_depth": 0,
+            "in_flight": 0,
+            "calls": 0,
+            "succeeded": 0,
+            "failed": 0,
+            "retries": 0,
+            "throttled": 0,
+            "rejected": 0,
+            "wait_seconds": 0.0,
+        }
+
+    @classmethod
+    def from_env(cls):
+        """Build a governor from GEMINI_* environment variables"""
+        return cls(
+            rpm=int(os.getenv('GEMINI_RPM', '60')),
+            tpm=int(os.getenv('GEMINI_TPM', '250000')),
+            max_concurrency=int(os.getenv('GEMINI_MAX_CONCURRENCY', '4')),
+            max_retries=int(os.getenv('GEMINI_MAX_RETRIES', '3')),
+            default_timeout=float(os.getenv('GEMINI_TIMEOUT', '60')),
+        )
+
+    def _bump(self, key, amount=1):
+        with self._lock:
+            self._stats[key] += amount
+
+    def stats(self):
+        """Snapshot of queue and throughput counters"""
+        with self._lock:
+            snapshot = dict(self._stats)
+        snapshot["max_concurrency"] = self.max_concurrency
+        snapshot["rpm_factor"] = round(self.request_bucket.factor, 3)
+        snapshot["tpm_factor"] = round(self.token_bucket.factor, 3)
+        return snapshot
+
+    def _admit(self, estimated_tokens, deadline):
+        """Wait for a concurrency slot and rate budget; returns when admitted"""
+        queued_at = time.monotonic()
+        with self._lock:
+            self._stats["queue_depth"] += 1
+            self._stats["max_queue_depth"] = max(self._stats["max_queue_depth"],
+                                                 self._stats["queue_depth"])
+        try:
+            if not self.slots.acquire(timeout=max(0.0, deadline - time.monotonic())):
+                raise GovernorTimeout("No LLM concurrency slot available before deadline")
+            try:
+                waited = self.request_bucket.acquire(1, deadline)
+                waited += self.token_bucket.acquire(estimated_tokens, deadline)
+            except GovernorTimeout:
+                self.slots.release()
+                raise
+        except GovernorTimeout:
+            self._bump("rejected")
+            raise
+        finally:
+            self._bump("queue_depth", -1)
+
+        if waited > 0:
+            self._bump("wait_seconds", waited)
+        self._bump("in_flight")
+        STAGE_SECONDS.observe(time.monotonic() - queued_at, stage="llm_queue_wait")
+
+    def _release(self):
+        self._bump("in_flight", -1)
+        self.slots.release()
+
+    def _reconcile_usage(self, response, estimated_tokens):
+        """Correct the token budget with the usage reported by the API"""
+        usage = getattr(response, "usage_metadata", None)
+        actual = getattr(usage, "total_token_count", None) if usage else None
+        if not actual:
+            return
+        if actual > estimated_tokens:
+            self.token_bucket.debit(actual - estimated_tokens)
+        else:
+            self.token_bucket.credit(estimated_tokens - actual)
+
+    def call(self, fn, *args, estimated_tokens=1000, deadline=None, **kwargs):
+        """
+        Run `fn(*args, **kwargs)` under the governor.
+        `deadline` is an absolute time.monotonic() value; defaults to now + default_timeout.
+        """
+        if deadline is None:
+            deadline = time.monotonic() + self.default_timeout
+
+        self._bump("calls")
+        attempt = 0
+        while True:
+            self._admit(estimated_tokens, deadline)
+            try:
+                response = fn(*args, **kwargs)
+            except RETRYABLE_ERRORS as e:
+                error = e
+            except Exception:
+                self._bump("failed")
+                raise
+            else:
+                self._reconcile_usage(response, estimated_tokens)
+                self.request_bucket.recover()
+                self.token_bucket.recover()
+                self._bump("succeeded")
+                return response
+            finally:
+                self._release()
+
+            # Retryable failure: back off, adapting the rate on quota errors
+            if isinstance(error, THROTTLE_ERRORS):
+                self._bump("throttled")
+                self.request_bucket.throttle()
+                self.token_bucket.throttle()
+
+            attempt += 1
+            delay = random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+            if attempt > self.max_retries or time.monotonic() + delay >= deadline:
+                self._bump("failed")
+                raise error
+
+            print(f"LLM call failed ({type(error).__name__}), retry {attempt} in {delay:.2f}s")
+            self._bump("retries")
+            time.sleep(delay)
@@ -3,14 +3,28 @@ Flask Backend for AI Quiz System
 Provides endpoints for MCQ generation and quiz grading
 """
 
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, g, Response
 from flask_cors import CORS
 from dotenv import load_dotenv
+import atexit
 import os
+import json
+import time
+import hashlib
 from datetime import datetime
 
+from circuit_breaker import CircuitOpenError
 from gemini_service import GeminiService
+from hedging import LLMDeadlineExceeded
+from ids import now_ms, scatter_id
+from profiling import profile_request
+from progress import attempt_summary, progress_path
 from retrieval_service import RetrievalService
+import metrics
+import trace_recorder
+from write_behind import create_writer
+from metrics import (CACHE_LOOKUPS, FIRESTORE_READS,
+                     REQUEST_SECONDS, STAGE_SECONDS)
 
 # Load environment
 load_dotenv()
@@ -21,18 +35,176 @@ CORS(app)  # Enable CORS for Flutter app
 
 # Initialize services
 SERVICE_ACCOUNT_PATH = os.path.join(os.path.dirname(__file__), "serviceAccountKey.json")
-gemini = GeminiService()
-retrieval = RetrievalService(SERVICE_ACCOUNT_PATH)
+gemini = None
+retrieval = None
+writer = None
+
+def init_services(gemini_service=None, retrieval_service=None):
+    """Create the services used by the handlers, or install injected ones"""
+    global gemini, retrieval, writer
+    gemini = gemini_service or GeminiService()
+    retrieval = retrieval_service or RetrievalService(SERVICE_ACCOUNT_PATH)
+    if writer is not None:
+        writer.drain()
+    # Quizzes, attempts and explanations are persisted after the response (write_behind.py)
+    writer = create_writer(retrieval.db)
+
+@atexit.register
+def drain_writes():
+    if writer is not None:
+        writer.drain()
+
+# The load-test harness sets QUIZ_BACKEND_LAZY_INIT=1 and injects local stand-ins
+if os.getenv('QUIZ_BACKEND_LAZY_INIT') != '1':
+    init_services()
+
+# Scrape-time gauges for the LLM governor and circuit breaker
+metrics.gauge("llm_queue_depth", "Gemini calls waiting for admission",
+              lambda: gemini.governor.stats()["queue_depth"])
+metrics.gauge("llm_in_flight", "Gemini calls in progress",
+              lambda: gemini.governor.stats()["in_flight"])
+metrics.gauge("llm_circuit_open", "1 while the Gemini circuit breaker is not closed",
+              lambda: 0 if gemini.breaker.stats()["state"] == "closed" else 1)
+metrics.gauge("write_behind_pending", "Write units logged locally but not yet committed",
+              lambda: writer.depth())
+
+# Per-endpoint time budgets (seconds), propagated into GeminiService
+GENERATE_MCQ_DEADLINE = float(os.getenv('GENERATE_MCQ_DEADLINE', '45'))
+GRADE_QUIZ_DEADLINE = float(os.getenv('GRADE_QUIZ_DEADLINE', '20'))
+
+# Fast mode: generate quizzes without explanations and explain only wrong answers at grading
+LAZY_EXPLANATIONS = os.getenv('LAZY_EXPLANATIONS', '1') == '1'
 
 # In-memory cache for quizzes (in production, use Redis or Firestore)
 quiz_cache = {}
 
+# Explanations shared by every student who misses the same question
+# (backed by the Firestore 'explanations' collection)
+explanation_cache = {}
+EXPLANATION_CACHE_SIZE = 5000
+
+def question_key(question):
+    """Stable id for a question: hash of its text, options and answer"""
+    raw = json.dumps([question.get('q'), question.get('options'), question.get('answer')],
+                     ensure_ascii=False)
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+def lookup_explanations(questions, context, deadline):
+    """
+    Explanations for `questions`: in-memory cache first, then Firestore,
+    then a single batched Gemini call for whatever is still missing.
+    Returns a list aligned with `questions` ('' if unavailable).
+    """
+    keys = [question_key(q) for q in questions]
+    found = {k: explanation_cache[k] for k in keys if k in explanation_cache}
+    CACHE_LOOKUPS.inc(len(found), cache="explanations", result="memory")
+    
+    missing = [k for k in dict.fromkeys(keys) if k not in found]
+    if missing:
+        refs = [retrieval.db.collection("explanations").document(k) for k in missing]
+        FIRESTORE_READS.inc(len(refs), collection="explanations")
+        for doc in retrieval.db.get_all(refs):
+            if doc.exists:
+                found[doc.id] = doc.to_dict().get("explanation", "")
+                CACHE_LOOKUPS.inc(cache="explanations", result="firestore")
+    
+    todo = {k: q for k, q in zip(keys, questions) if k not in found}
+    CACHE_LOOKUPS.inc(len(todo), cache="explanations", result="miss")
+    if todo:
+        generated = gemini.generate_explanations(list(todo.values()), context, deadline=deadline)
+        writes = []
+        for (k, q), text in zip(todo.items(), generated):
+            if not text:
+                continue
+            found[k] = text
+            writes.append({"path": f"explanations/{k}", "data": {
+                "q": q.get('q', ''),
+                "explanation": text,
+                "created_at": datetime.now().isoformat()
+            }})
+        writer.enqueue(writes)
+    
+    for k, text in found.items():
+        if text:
+            explanation_cache[k] = text
+    while len(explanation_cache) > EXPLANATION_CACHE_SIZE:
+        explanation_cache.pop(next(iter(explanation_cache)))
+    
+    return [found.get(k, '') for k in keys]
+
+# Recent quiz ids per (class, subject, chapter), served when generation times out
+quiz_pool = {}
+QUIZ_POOL_SIZE = 20
+
+def pooled_quiz(chapter_key, num_questions):
+    """
+    Pick a previously generated quiz for the chapter (degraded mode), preferring
+    one with the requested size. Checks this process first, then Firestore.
+    """
+    quiz_ids = [qid for qid in quiz_pool.get(chapter_key, []) if qid in quiz_cache]
+    for quiz_id in reversed(quiz_ids):
+        if len(quiz_cache[quiz_id]["questions"]) == num_questions:
+            return quiz_id
+    if quiz_ids:
+        return quiz_ids[-1]
+    
+    class_id, subject_id, chapter_id = chapter_key
+    docs = (retrieval.db.collection("quizzes")
+            .where("class", "==", class_id)
+            .where("subject", "==", subject_id)
+            .where("chapter", "==", chapter_id)
+            .limit(QUIZ_POOL_SIZE)
+            .stream())
+    
+    best = None
+    for doc in docs:
+        FIRESTORE_READS.inc(collection="quizzes")
+        quiz = doc.to_dict()
+        if not quiz.get("questions"):
+            continue
+        quiz_cache[doc.id] = quiz
+        quiz_pool.setdefault(chapter_key, []).append(doc.id)
+        if best is None or len(quiz["questions"]) == num_questions:
+            best = doc.id
+    return best
+
+@app.before_request
+def start_timer():
+    g.request_start = time.perf_counter()
+    if trace_recorder.enabled():
+        trace_recorder.begin(request.endpoint, request.get_json(silent=True))
+
+@app.after_request
+def record_request_latency(response):
+    start = getattr(g, "request_start", None)
+    if start is not None:
+        elapsed = time.perf_counter() - start
+        REQUEST_SECONDS.observe(elapsed,
+                                endpoint=request.endpoint or "unknown",
+                                status=response.status_code)
+        if trace_recorder.active():
+            trace_recorder.finish(response.status_code, elapsed, response.get_json(silent=True))
+    return response
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus-style metrics for this worker process"""
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
 @app.route('/health', methods=['GET'])
 def health():
     """Health check endpoint"""
-    return jsonify({"status": "ok", "message": "AI Quiz Backend is running"})
+    return jsonify({
+        "status": "ok",
+        "message": "AI Quiz Backend is running",
+        "llm": gemini.governor.stats(),
+        "hedging": gemini.hedge_snapshot(),
+        "circuit": gemini.breaker.stats(),
+        "writes": writer.snapshot()
+    })
 
 @app.route('/generate_mcq', methods=['POST'])
+@profile_request("generate_mcq")
 def generate_mcq():
     """
     Generate MCQ quiz using RAG + Gemini
@@ -42,7 +214,8 @@ def generate_mcq():
         "class_id": "class 8",
         "subject_id": "science",
         "chapter_id": "chapter4",
-        "num_questions": 10
+        "num_questions": 10,
+        "explanations": false      // optional, defaults to !LAZY_EXPLANATIONS
     }
     
     Response:
@@ -52,11 +225,13 @@ def generate_mcq():
     }
     """
     try:
+        deadline = time.monotonic() + GENERATE_MCQ_DEADLINE
         data = request.json
         class_id = data.get('class_id', 'class 8')
         subject_id = data.get('subject_id')
         chapter_id = data.get('chapter_id')
         num_questions = data.get('num_questions', 10)
+        explanations = data.get('explanations', not LAZY_EXPLANATIONS)
         
         if not subject_id or not chapter_id:
             return jsonify({"error": "subject_id and chapter_id are required"}), 400
@@ -64,9 +239,10 @@ def generate_mcq():
         print(f"Generating quiz: {class_id}/{subject_id}/{chapter_id} ({num_questions} questions)")
         
         # Step 1: Retrieve relevant context using RAG
-        context_chunks = retrieval.retrieve_context_for_quiz(
-            class_id, subject_id, chapter_id, num_questions
-        )
+        with STAGE_SECONDS.time(stage="retrieve_context"):
+            context_chunks = retrieval.retrieve_context_for_quiz(
+                class_id, subject_id, chapter_id, num_questions
+            )
         
         if not context_chunks:
             return jsonify({"error": "No content found for this chapter"}), 404
@@ -74,7 +250,21 @@ def generate_mcq():
         print(f"Retrieved {len(context_chunks)} context chunks")
         
         # Step 2: Generate MCQs using Gemini
-        questions = gemini.generate_mcqs(context_chunks, num_questions)
+        chapter_key = (class_id, subject_id, chapter_id)
+        try:
+            questions = gemini.generate_mcqs(context_chunks, num_questions, deadline=deadline,
+                                             explanations=explanations)
+        except (LLMDeadlineExceeded, CircuitOpenError) as e:
+            quiz_id = pooled_quiz(chapter_key, num_questions)
+            if not quiz_id:
+                return jsonify({"error": "Quiz generation is temporarily unavailable, please try again"}), 503
+            print(f"Generation unavailable ({type(e).__name__}), serving pooled quiz {quiz_id}")
+            pooled = quiz_cache[quiz_id]["questions"]
+            return jsonify({
+                "quiz_id": quiz_id,
+                "questions": pooled,
+                "total_questions": len(pooled)
+            })
         
         if not questions:
             return jsonify({"error": "Failed to generate questions"}), 500
@@ -82,18 +272,27 @@ def generate_mcq():
         print(f"Generated {len(questions)} questions")
         
         # Step 3: Store quiz (simple in-memory for now)
-        quiz_id = f"quiz_{datetime.now().timestamp()}"
+        # Scattered id avoids a hot key range; created_ts keeps quizzes sortable by time
+        quiz_id = scatter_id("quiz_")
         quiz_data = {
             "class": class_id,
             "subject": subject_id,
             "chapter": chapter_id,
             "questions": questions,
-            "generated_at": datetime.now().isoformat()
+            "generated_at": datetime.now().isoformat(),
+            "created_ts": now_ms()
         }
+        if not explanations:
+            # Keep the source text so explanations can be grounded at grading time
+            quiz_data["context"] = {c.get('id'): c.get('text', '')[:500] for c in context_chunks}
         quiz_cache[quiz_id] = quiz_data
+        pool = quiz_pool.setdefault(chapter_key, [])
+        pool.append(quiz_id)
+        del pool[:-QUIZ_POOL_SIZE]
         
-        # Also save to Firestore
-        retrieval.db.collection("quizzes").document(quiz_id).set(quiz_data)
+        # Also save to Firestore (logged locally, committed in the background)
+        with STAGE_SECONDS.time(stage="quizzes_write"):
+            writer.set(f"quizzes/{quiz_id}", quiz_data)
         
         return jsonify({
             "quiz_id": quiz_id,
@@ -106,6 +305,7 @@ def generate_mcq():
         return jsonify({"error": str(e)}), 500
 
 @app.route('/grade_quiz', methods=['POST'])
+@profile_request("grade_quiz")
 def grade_quiz():
     """
     Grade quiz and generate improvement analysis
@@ -128,6 +328,7 @@ def grade_quiz():
     }
     """
     try:
+        deadline = time.monotonic() + GRADE_QUIZ_DEADLINE
         data = request.json
         quiz_id = data.get('quiz_id')
         answers = data.get('answers', [])
@@ -136,10 +337,17 @@ def grade_quiz():
         if not quiz_id or not answers:
             return jsonify({"error": "quiz_id and answers are required"}), 400
         
+        # Stored with the attempt: reject what Firestore would refuse (e.g. nested arrays)
+        if not isinstance(answers, list) or not all(type(a) is int for a in answers):
+            return jsonify({"error": "answers must be a list of option numbers"}), 400
+        
         # Get quiz from cache or Firestore
         quiz = quiz_cache.get(quiz_id)
+        CACHE_LOOKUPS.inc(cache="quizzes", result="hit" if quiz else "miss")
         if not quiz:
-            quiz_doc = retrieval.db.collection("quizzes").document(quiz_id).get()
+            with STAGE_SECONDS.time(stage="quiz_lookup"):
+                quiz_doc = retrieval.db.collection("quizzes").document(quiz_id).get()
+            FIRESTORE_READS.inc(collection="quizzes")
             if not quiz_doc.exists:
                 return jsonify({"error": "Quiz not found"}), 404
             quiz = quiz_doc.to_dict()
@@ -174,11 +382,23 @@ def grade_quiz():
                 source = question.get('source', 'unknown')
                 wrong_topics[source] = wrong_topics.get(source, 0) + 1
         
+        # Explain wrong answers that were generated without an explanation
+        unexplained = [i for i, pq in enumerate(per_question)
+                       if not pq["ok"] and not pq["explanation"]]
+        if unexplained:
+            with STAGE_SECONDS.time(stage="explanations"):
+                explained = lookup_explanations([questions[i] for i in unexplained],
+                                                quiz.get('context'), deadline)
+            for i, text in zip(unexplained, explained):
+                per_question[i]["explanation"] = text
+        
         # Calculate score
         score = int(100 * correct_count / len(questions)) if questions else 0
         
         # Generate improvement analysis using Gemini
-        report = gemini.generate_improvement_analysis(score, per_question, wrong_topics)
+        with STAGE_SECONDS.time(stage="improvement_report"):
+            report = gemini.generate_improvement_analysis(score, per_question, wrong_topics,
+                                                          deadline=deadline)
         
         # Save attempt to Firestore
         attempt_data = {
@@ -190,11 +410,23 @@ def grade_quiz():
             "total": len(questions),
             "per_question": per_question,
             "report": report,
-            "submitted_at": datetime.now().isoformat()
+            "submitted_at": datetime.now().isoformat(),
+            "created_ts": now_ms()
         }
         
-        attempt_ref = retrieval.db.collection("attempts").document()
-        attempt_ref.set(attempt_data)
+        # Id is generated here, so a redelivered write hits the same document
+        attempt_id = scatter_id("attempt_")
+        writes = [{"path": f"attempts/{attempt_id}", "data": attempt_data}]
+        if student_id != 'anonymous':
+            # Per-student, per-chapter progress, updated in the same batch as the attempt
+            writes.append({
+                "path": progress_path(student_id, quiz.get('class'), quiz.get('subject'), quiz.get('chapter')),
+                "reduce": "progress",
+                "args": attempt_summary(attempt_id, quiz, score, correct_count, len(questions),
+                                        wrong_topics, attempt_data["created_ts"])
+            })
+        with STAGE_SECONDS.time(stage="attempts_write"):
+            writer.enqueue(writes)
         
         return jsonify({
             "score": score,
@@ -203,7 +435,7 @@ def grade_quiz():
             "incorrect": len(questions) - correct_count,
             "per_question": per_question,
             "report": report,
-            "attempt_id": attempt_ref.id
+            "attempt_id": attempt_id
         })
         
     except Exception as e:
@@ -216,6 +448,7 @@ if __name__ == '__main__':
     print("=" * 70)
     print("\nEndpoints:")
     print("  GET  /health          - Health check")
+    print("  GET  /metrics         - Prometheus metrics")
     print("  POST /generate_mcq    - Generate quiz")
     print("  POST /grade_quiz      - Grade and analyze")
     print("\n" + "=" * 70)
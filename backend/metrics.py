@@ -0,0 +1,154 @@
+"""
+Metrics
+Minimal in-process counters/histograms rendered in the Prometheus text format
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+
+# Latency buckets (seconds) covering Firestore reads up to slow LLM calls
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60)
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    body = ",".join('{}="{}"'.format(k, str(v).replace("\\", "\\\\").replace('"', '\\"'))
+                    for k, v in pairs)
+    return "{" + body + "}"
+
+
+class Counter:
+    """Monotonic counter with optional labels"""
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(l, "") for l in self.labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            items = sorted(self.values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labels, key)} {value}")
+        return lines
+
+
+class Histogram:
+    """Cumulative-bucket histogram with optional labels"""
+
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self.series = {}  # label values -> [bucket counts..., sum, count]
+        self.lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(l, "") for l in self.labels)
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of the `with` block (also when it raises)"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            items = sorted((k, list(v)) for k, v in self.series.items())
+        for key, series in items:
+            for bound, count in zip(self.buckets, series):
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, ('le', bound))} {count}")
+            lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, ('le', '+Inf'))} {series[-1]}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {series[-2]:.6f}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {series[-1]}")
+        return lines
+
+
+class Gauge:
+    """Gauge whose value is read from a callback at scrape time"""
+
+    def __init__(self, name, help_text, callback):
+        self.name = name
+        self.help = help_text
+        self.callback = callback
+
+    def render(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge",
+                f"{self.name} {float(self.callback())}"]
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def register(self, metric):
+        with self.lock:
+            self.metrics[metric.name] = metric
+        return metric
+
+    def render(self):
+        with self.lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+# Shared metrics used across main.py and the services
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    "quiz_stage_seconds", "Time spent in each pipeline stage", labels=("stage",)))
+REQUEST_SECONDS = REGISTRY.register(Histogram(
+    "http_request_seconds", "HTTP request latency", labels=("endpoint", "status")))
+CACHE_LOOKUPS = REGISTRY.register(Counter(
+    "cache_lookups_total", "Cache lookups by cache and result", labels=("cache", "result")))
+LLM_TOKENS = REGISTRY.register(Counter(
+    "llm_tokens_total", "Gemini tokens reported by the API", labels=("kind", "direction")))
+LLM_CALLS = REGISTRY.register(Counter(
+    "llm_calls_total", "Gemini calls by kind and outcome", labels=("kind", "outcome")))
+FIRESTORE_READS = REGISTRY.register(Counter(
+    "firestore_document_reads_total", "Firestore documents read", labels=("collection",)))
+FIRESTORE_WRITES = REGISTRY.register(Counter(
+    "firestore_document_writes_total", "Firestore documents written", labels=("collection",)))
+WRITE_BEHIND_DEAD_LETTERS = REGISTRY.register(Counter(
+    "write_behind_dead_letters_total", "Write units that could not be committed, by error",
+    labels=("error",)))
+
+
+def gauge(name, help_text, callback):
+    """Register a callback gauge on the shared registry"""
+    return REGISTRY.register(Gauge(name, help_text, callback))
+
+
+def render():
+    return REGISTRY.render()
@@ -1,11 +1,25 @@
 """
 Migration Script: Copy data from 'users' collection to 'students' collection in Firestore.
 Then optionally delete the 'users' collection.
+
+Reads are paginated by document id, each page is committed as one batch (up to
+500 writes) on a pool of workers, and the last fully committed cursor is saved
+to a checkpoint file, so an interrupted run resumes where it stopped.
+
+Usage:
+    python migrate_users_to_students.py [--workers 4] [--page-size 500] [--reset] [--yes]
 """
 
+import argparse
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
 import firebase_admin
 from firebase_admin import credentials, firestore
-import os
+from google.cloud.firestore_v1.field_path import FieldPath
 
 # Initialize Firebase (if not already initialized)
 if not firebase_admin._apps:
@@ -15,63 +29,144 @@ if not firebase_admin._apps:
 
 db = firestore.client()
 
-def migrate_users_to_students():
+# Firestore's limit on writes per batched commit
+MAX_BATCH_WRITES = 500
+
+CHECKPOINT_PATH = os.getenv('MIGRATION_CHECKPOINT',
+                            os.path.join(os.path.dirname(__file__), 'migrate_users_to_students.checkpoint.json'))
+
+
+def load_checkpoint():
+    """{"copy": {"cursor", "count"}, "delete": {...}} from the last run, or {}"""
+    try:
+        with open(CHECKPOINT_PATH) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_checkpoint(checkpoint):
+    tmp = CHECKPOINT_PATH + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp, CHECKPOINT_PATH)
+
+
+def pages(query, page_size, cursor=None):
+    """Yield lists of snapshots, `page_size` at a time, ordered by document id after `cursor`"""
+    query = query.order_by(FieldPath.document_id()).limit(page_size)
+    while True:
+        page_query = query.start_after({FieldPath.document_id(): cursor}) if cursor else query
+        page = list(page_query.stream())
+        if not page:
+            return
+        yield page
+        cursor = page[-1].id
+        if len(page) < page_size:
+            return
+
+
+def run_paged(phase, query, write_page, page_size, workers, checkpoint):
+    """
+    Read `query` page by page and commit each page with write_page(snapshots) on
+    `workers` threads. The checkpoint only advances past a page once it and every
+    page before it are committed, so resuming never skips documents (pages after
+    it may be written again, which is harmless for sets and deletes).
+    """
+    state = checkpoint.setdefault(phase, {"cursor": None, "count": 0})
+    if state["cursor"]:
+        print(f"  Resuming after '{state['cursor']}' ({state['count']} already done)")
+
+    started = time.time()
+    done = 0
+    in_flight = deque()  # (future, last id of the page, page length) in read order
+
+    def settle(max_in_flight):
+        """Record finished pages in read order; wait while more than `max_in_flight` are pending"""
+        nonlocal done
+        while in_flight and (len(in_flight) > max_in_flight or in_flight[0][0].done()):
+            future, last_id, size = in_flight.popleft()
+            future.result()  # re-raises a failed commit; the checkpoint stays before it
+            done += size
+            state["cursor"], state["count"] = last_id, state["count"] + size
+            save_checkpoint(checkpoint)
+            elapsed = time.time() - started
+            print(f"  {phase}: {state['count']} documents ({done / max(elapsed, 1e-6):.0f} docs/s)")
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for page in pages(query, page_size, state["cursor"]):
+            in_flight.append((pool.submit(write_page, page), page[-1].id, len(page)))
+            settle(max_in_flight=workers * 2)
+        settle(max_in_flight=0)
+
+    elapsed = time.time() - started
+    print(f"  {phase}: {done} documents in {elapsed:.1f}s ({done / max(elapsed, 1e-6):.0f} docs/s)")
+    return state["count"]
+
+
+def migrate_users_to_students(workers=4, page_size=MAX_BATCH_WRITES, checkpoint=None):
     """Copy all documents from 'users' collection to 'students' collection."""
-    
+
     print("Starting migration from 'users' to 'students'...")
-    
-    # Get all documents from 'users' collection
-    users_ref = db.collection('users')
-    users_docs = users_ref.stream()
-    
-    migrated_count = 0
-    
-    for doc in users_docs:
-        user_data = doc.to_dict()
-        user_id = doc.id
-        
-        print(f"Migrating user: {user_id}")
-        print(f"  Data: {user_data}")
-        
-        # Copy to 'students' collection with same document ID
-        students_ref = db.collection('students').document(user_id)
-        students_ref.set(user_data)
-        
-        print(f"  ✓ Copied to students/{user_id}")
-        migrated_count += 1
-    
+    checkpoint = load_checkpoint() if checkpoint is None else checkpoint
+
+    def copy_page(snapshots):
+        # Same document id in 'students'; a repeated set after a resume is a no-op
+        batch = db.batch()
+        for doc in snapshots:
+            batch.set(db.collection('students').document(doc.id), doc.to_dict())
+        batch.commit()
+
+    migrated_count = run_paged("copy", db.collection('users'), copy_page,
+                               min(page_size, MAX_BATCH_WRITES), workers, checkpoint)
+
     print(f"\n✅ Migration complete! {migrated_count} document(s) migrated.")
     return migrated_count
 
-def delete_users_collection():
+def delete_users_collection(workers=4, page_size=MAX_BATCH_WRITES, checkpoint=None):
     """Delete all documents from 'users' collection."""
-    
+
     print("\nDeleting 'users' collection...")
-    
-    users_ref = db.collection('users')
-    users_docs = users_ref.stream()
-    
-    deleted_count = 0
-    
-    for doc in users_docs:
-        print(f"Deleting: users/{doc.id}")
-        doc.reference.delete()
-        deleted_count += 1
-    
+    checkpoint = load_checkpoint() if checkpoint is None else checkpoint
+
+    def delete_page(snapshots):
+        batch = db.batch()
+        for doc in snapshots:
+            batch.delete(doc.reference)
+        batch.commit()
+
+    # Ids only: nothing but the reference is needed to delete
+    deleted_count = run_paged("delete", db.collection('users').select([]), delete_page,
+                              min(page_size, MAX_BATCH_WRITES), workers, checkpoint)
+
     print(f"\n🗑️ Deleted {deleted_count} document(s) from 'users' collection.")
     return deleted_count
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Copy 'users' to 'students', then optionally delete 'users'")
+    parser.add_argument("--workers", type=int, default=4, help="batches committed in parallel")
+    parser.add_argument("--page-size", type=int, default=MAX_BATCH_WRITES, help="documents per page/batch (max 500)")
+    parser.add_argument("--reset", action="store_true", help="ignore the checkpoint and start over")
+    parser.add_argument("--yes", action="store_true", help="delete 'users' without asking")
+    args = parser.parse_args()
+
+    if args.reset and os.path.exists(CHECKPOINT_PATH):
+        os.remove(CHECKPOINT_PATH)
+    checkpoint = load_checkpoint()
+
     # Step 1: Migrate data
-    count = migrate_users_to_students()
-    
+    count = migrate_users_to_students(args.workers, args.page_size, checkpoint)
+
     if count > 0:
         # Step 2: Ask before deleting
-        confirm = input("\nDo you want to delete the 'users' collection now? (yes/no): ")
+        confirm = 'yes' if args.yes else input("\nDo you want to delete the 'users' collection now? (yes/no): ")
         if confirm.lower() == 'yes':
-            delete_users_collection()
+            delete_users_collection(args.workers, args.page_size, checkpoint)
+            if os.path.exists(CHECKPOINT_PATH):
+                os.remove(CHECKPOINT_PATH)
             print("\n🎉 Migration and cleanup complete!")
         else:
             print("\n✓ Migration complete. 'users' collection preserved.")
+            print(f"  (checkpoint kept in {CHECKPOINT_PATH}; use --reset to copy again)")
     else:
         print("\nNo documents found in 'users' collection to migrate.")
@@ -0,0 +1,147 @@
+"""
+Request Profiling
+Opt-in profiler for a single request, switched on by a privileged header or query flag
+"""
+
+import cProfile
+import hmac
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from datetime import datetime
+from functools import wraps
+
+from flask import make_response, request
+
+# Profiling is disabled unless PROFILE_TOKEN is set
+PROFILE_TOKEN = os.getenv('PROFILE_TOKEN')
+PROFILE_DIR = os.getenv('PROFILE_DIR', os.path.join(os.path.dirname(__file__), "profiles"))
+PROFILE_SAMPLE_INTERVAL = float(os.getenv('PROFILE_SAMPLE_INTERVAL', '0.005'))
+
+# tracemalloc and the sampler are process-wide: profile one request at a time
+_profile_lock = threading.Lock()
+
+
+class StackSampler:
+    """
+    Samples one thread's Python stack at a fixed interval and aggregates the
+    stacks in the "folded" format read by flamegraph.pl, speedscope, etc.
+    """
+
+    def __init__(self, thread_id, interval=PROFILE_SAMPLE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}")
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def write_folded(self, path):
+        with open(path, "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+def _requested():
+    """True if the request carries a valid profiling token"""
+    if not PROFILE_TOKEN:
+        return False
+    token = request.headers.get('X-Profile-Token') or request.args.get('profile')
+    # Bytes: compare_digest rejects str with non-ASCII characters (TypeError)
+    return bool(token) and hmac.compare_digest(token.encode(), PROFILE_TOKEN.encode())
+
+
+def _write_alloc_summary(path, snapshot, peak, current, elapsed, top=25):
+    stats = snapshot.statistics('lineno')
+    with open(path, "w") as f:
+        f.write(f"endpoint: {request.path}\n")
+        f.write(f"wall time: {elapsed:.3f}s\n")
+        f.write(f"peak traced memory: {peak / 1024:.1f} KiB\n")
+        f.write(f"traced memory at end: {current / 1024:.1f} KiB\n\n")
+        f.write(f"top {top} allocation sites still alive at end of request:\n")
+        for stat in stats[:top]:
+            frame = stat.traceback[0]
+            f.write(f"  {stat.size / 1024:10.1f} KiB  {stat.count:7d} blocks  "
+                    f"{frame.filename}:{frame.lineno}\n")
+
+
+def profile_request(name):
+    """
+    Decorator for Flask views. When the request has `X-Profile-Token: <PROFILE_TOKEN>`
+    (or `?profile=<PROFILE_TOKEN>`), the view runs under a profiler and writes to PROFILE_DIR:
+    - <id>.folded     sampled stacks (mode "sample", default) for flame graphs
+    - <id>.prof       cProfile stats (mode "cprofile", via X-Profile-Mode header)
+    - <id>.alloc.txt  peak memory and top allocation sites from tracemalloc
+    The dump id is returned in the X-Profile-Id response header.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if not _requested() or not _profile_lock.acquire(blocking=False):
+                return view(*args, **kwargs)
+
+            try:
+                mode = request.headers.get('X-Profile-Mode', 'sample')
+                profile_id = f"{name}_{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}"
+                base = os.path.join(PROFILE_DIR, profile_id)
+                os.makedirs(PROFILE_DIR, exist_ok=True)
+
+                sampler = profiler = None
+                if mode == 'cprofile':
+                    profiler = cProfile.Profile()
+                else:
+                    sampler = StackSampler(threading.get_ident())
+
+                tracemalloc.start()
+                start = time.perf_counter()
+                if profiler:
+                    profiler.enable()
+                if sampler:
+                    sampler.start()
+                try:
+                    response = view(*args, **kwargs)
+                finally:
+                    if sampler:
+                        sampler.stop()
+                    if profiler:
+                        profiler.disable()
+                    elapsed = time.perf_counter() - start
+                    current, peak = tracemalloc.get_traced_memory()
+                    snapshot = tracemalloc.take_snapshot()
+                    tracemalloc.stop()
+
+                if sampler:
+                    sampler.write_folded(base + ".folded")
+                if profiler:
+                    profiler.dump_stats(base + ".prof")
+                _write_alloc_summary(base + ".alloc.txt", snapshot, peak, current, elapsed)
+                print(f"Profiled {request.path} -> {base} ({elapsed:.3f}s, peak {peak / 1024:.0f} KiB)")
+            finally:
+                _profile_lock.release()
+
+            # Views may return (body, status) tuples; normalise before adding the header
+            response = make_response(response)
+            response.headers['X-Profile-Id'] = profile_id
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,78 @@
+"""
+Student Progress
+Per-student, per-chapter aggregates updated incrementally with each graded attempt,
+so progress views read one document instead of scanning `attempts`
+"""
+
+from write_behind import register_reducer
+
+# Scores kept for the trend line, and attempt ids remembered to skip redelivered updates
+RECENT_SCORES = 10
+RECENT_ATTEMPT_IDS = 20
+
+
+def progress_path(student_id, class_id, subject_id, chapter_id):
+    """students/{student}/progress/{class}|{subject}|{chapter}"""
+    key = "|".join(str(part).replace("/", "_") for part in (class_id, subject_id, chapter_id))
+    return f"students/{str(student_id).replace('/', '_')}/progress/{key}"
+
+
+def attempt_summary(attempt_id, quiz, score, correct, total, wrong_topics, created_ts):
+    """The part of an attempt an aggregate needs (stored in the write-behind log)"""
+    return {
+        "attempt_id": attempt_id,
+        "class": quiz.get("class"),
+        "subject": quiz.get("subject"),
+        "chapter": quiz.get("chapter"),
+        "score": score,
+        "correct": correct,
+        "total": total,
+        "wrong_topics": wrong_topics,
+        "created_ts": created_ts,
+    }
+
+
+def apply_attempt(aggregate, attempt):
+    """
+    Fold one attempt summary into an aggregate document (None for a new one).
+    Pure and idempotent: an attempt already in `recent_attempt_ids` is a no-op.
+    Returns the new aggregate.
+    """
+    aggregate = dict(aggregate or {
+        "class": attempt["class"],
+        "subject": attempt["subject"],
+        "chapter": attempt["chapter"],
+        "attempts": 0,
+        "questions": 0,
+        "correct": 0,
+        "score_sum": 0,
+        "best_score": 0,
+        "topic_errors": {},
+        "recent_scores": [],
+        "recent_attempt_ids": [],
+    })
+    if attempt["attempt_id"] in aggregate.get("recent_attempt_ids", []):
+        return aggregate
+
+    aggregate["attempts"] += 1
+    aggregate["questions"] += attempt["total"]
+    aggregate["correct"] += attempt["correct"]
+    aggregate["score_sum"] += attempt["score"]
+    aggregate["accuracy"] = round(aggregate["correct"] / aggregate["questions"], 4) if aggregate["questions"] else 0.0
+    aggregate["avg_score"] = round(aggregate["score_sum"] / aggregate["attempts"], 2)
+    aggregate["best_score"] = max(aggregate["best_score"], attempt["score"])
+    aggregate["last_score"] = attempt["score"]
+    aggregate["last_attempt_ts"] = attempt["created_ts"]
+
+    topic_errors = dict(aggregate.get("topic_errors", {}))
+    for topic, count in attempt["wrong_topics"].items():
+        topic_errors[topic] = topic_errors.get(topic, 0) + count
+    aggregate["topic_errors"] = topic_errors
+
+    aggregate["recent_scores"] = (list(aggregate.get("recent_scores", [])) + [attempt["score"]])[-RECENT_SCORES:]
+    aggregate["recent_attempt_ids"] = (list(aggregate.get("recent_attempt_ids", []))
+                                       + [attempt["attempt_id"]])[-RECENT_ATTEMPT_IDS:]
+    return aggregate
+
+
+register_reducer("progress", apply_attempt)
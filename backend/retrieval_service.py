@@ -3,120 +3,277 @@ Retrieval Service
 Handles RAG (Retrieval-Augmented Generation) using embeddings and similarity search
 """
 
-import math
+import os
+import threading
+import time
+from urllib.parse import quote
+import numpy as np
 import firebase_admin
 from firebase_admin import credentials, firestore
 from sentence_transformers import SentenceTransformer
 
+from chunk_set import ChunkSet
+from embedding_index import EMBEDDING_CODEC, EmbeddingIndex
+from metrics import CACHE_LOOKUPS, FIRESTORE_READS, STAGE_SECONDS
+import trace_recorder
+
+# How long ids + embeddings of a chapter collection are reused before re-reading them
+EMBEDDING_CACHE_TTL = float(os.getenv('RETRIEVAL_EMBEDDING_TTL', '600'))
+# Directory for per-chapter index snapshots (compressed codes + memory-mapped float32
+# rows for re-ranking), reused by every worker while corpus_version is unchanged;
+# empty = keep indexes in memory only
+EMBEDDING_SNAPSHOT_DIR = os.getenv('EMBEDDING_SNAPSHOT_DIR', '')
+
+# all-MiniLM-L6-v2 output size; chapters embedded with another model will not rank
+EMBEDDING_DIM = 384
+
+# Maximal marginal relevance: 1.0 ranks on relevance only, lower values favour
+# chunks that add something the already selected ones don't cover
+MMR_LAMBDA = float(os.getenv('RETRIEVAL_MMR_LAMBDA', '0.7'))
+# Most relevant rows MMR chooses from (pairwise similarities are computed for these only)
+MMR_CANDIDATES = 64
+# Tokens of context per quiz prompt (8 chunks at the chunker's 200-token maximum)
+CONTEXT_TOKEN_BUDGET = int(os.getenv('RETRIEVAL_TOKEN_BUDGET', '1600'))
+# Assumed size of chunks uploaded before tokenCount was stored
+DEFAULT_CHUNK_TOKENS = 200
+
 class RetrievalService:
-    def __init__(self, service_account_path):
-        # Initialize Firebase
-        try:
-            firebase_admin.get_app()
-        except ValueError:
-            cred = credentials.Certificate(service_account_path)
-            firebase_admin.initialize_app(cred)
-        
-        self.db = firestore.client()
-        self.embed_model = SentenceTransformer('all-MiniLM-L6-v2')
-    
-    def fetch_chapter_chunks(self, class_id, subject_id, chapter_id):
-        """Fetch all chunks for a chapter"""
-        chunks = []
-        docs = (self.db.collection("classes").document(class_id)
-                .collection("subjects").document(subject_id)
-                .collection("chapters").document(chapter_id)
-                .collection("chunks").stream())
+    def __init__(self, service_account_path=None, db=None, embed_model=None):
+        """
+        `db` and `embed_model` can be injected (e.g. local stand-ins for load tests);
+        otherwise Firebase and the MiniLM model are initialized here.
+        """
+        if db is None:
+            # Initialize Firebase
+            try:
+                firebase_admin.get_app()
+            except ValueError:
+                cred = credentials.Certificate(service_account_path)
+                firebase_admin.initialize_app(cred)
+            db = firestore.client()
         
-        for doc in docs:
-            data = doc.to_dict()
-            chunks.append({
-                "id": doc.id,
-                "text": data.get("text", ""),
-                "embedding": data.get("embedding"),
-                "type": "chapter"
-            })
+        self.db = db
+        self.embed_model = embed_model or SentenceTransformer('all-MiniLM-L6-v2')
         
-        return chunks
+        # (class, subject, chapter, collection) -> (loaded_at, ChunkSet, corpus_version)
+        self.embedding_cache = {}
+        self.embedding_cache_lock = threading.Lock()
     
-    def fetch_pyq_chunks(self, class_id, subject_id, chapter_id):
-        """Fetch all PYQ chunks for a chapter"""
-        chunks = []
-        docs = (self.db.collection("classes").document(class_id)
+    def chapter_ref(self, class_id, subject_id, chapter_id):
+        return (self.db.collection("classes").document(class_id)
                 .collection("subjects").document(subject_id)
-                .collection("chapters").document(chapter_id)
-                .collection("past_papers").stream())
+                .collection("chapters").document(chapter_id))
+    
+    def corpus_version(self, class_id, subject_id, chapter_id):
+        """
+        corpus_version from the chapter manifest written by the upload scripts
+        (chapters/{chapter}/meta/manifest), or None if the chapter has none yet
+        """
+        snapshot = (self.chapter_ref(class_id, subject_id, chapter_id)
+                    .collection("meta").document("manifest").get())
+        FIRESTORE_READS.inc(collection="meta")
+        if not snapshot.exists:
+            return None
+        manifest = snapshot.to_dict()
+        dim = manifest.get("embedding_dim")
+        if dim and dim != EMBEDDING_DIM:
+            print(f"Warning: {chapter_id} was embedded with {manifest.get('embedding_model')} "
+                  f"({dim} dims), queries use {EMBEDDING_DIM}")
+        return manifest.get("corpus_version")
+    
+    def fetch_embeddings(self, class_id, subject_id, chapter_id, collection):
+        """
+        ChunkSet of a chapter collection ("chunks" or "past_papers"): ids, embeddings,
+        token counts and source/year/marks, read with a projection (no text) and
+        cached for EMBEDDING_CACHE_TTL. When the TTL runs out, the chapter manifest is
+        read first: an unchanged corpus_version keeps the cached set for another TTL.
+        With EMBEDDING_SNAPSHOT_DIR set, a snapshot of the same corpus_version is
+        loaded instead of reading Firestore, and fresh reads are snapshotted.
+        The set's EmbeddingIndex holds the L2-normalized rows compressed with
+        EMBEDDING_CODEC, with the exact rows memory-mapped for re-ranking.
+        """
+        key = (class_id, subject_id, chapter_id, collection)
+        cached = self.embedding_cache.get(key)
+        if cached and time.monotonic() - cached[0] < EMBEDDING_CACHE_TTL:
+            CACHE_LOOKUPS.inc(cache="embeddings", result="hit")
+            return cached[1]
         
-        for doc in docs:
-            data = doc.to_dict()
-            chunks.append({
-                "id": doc.id,
-                "text": data.get("text", ""),
-                "embedding": data.get("embedding"),
-                "type": "pyq",
-                "source": data.get("source", "unknown")
-            })
+        version = self.corpus_version(class_id, subject_id, chapter_id)
+        if cached and version is not None and version == cached[2]:
+            CACHE_LOOKUPS.inc(cache="embeddings", result="revalidated")
+            with self.embedding_cache_lock:
+                self.embedding_cache[key] = (time.monotonic(), cached[1], version)
+            return cached[1]
         
-        return chunks
-    
-    def cosine_similarity(self, vec1, vec2):
-        """Calculate cosine similarity between two vectors"""
-        if not vec1 or not vec2:
-            return 0.0
+        chunks = self.load_snapshot(key, version)
+        if chunks is not None:
+            CACHE_LOOKUPS.inc(cache="embeddings", result="snapshot")
+            with self.embedding_cache_lock:
+                self.embedding_cache[key] = (time.monotonic(), chunks, version)
+            return chunks
+        CACHE_LOOKUPS.inc(cache="embeddings", result="miss")
         
-        dot = sum(a * b for a, b in zip(vec1, vec2))
-        norm1 = math.sqrt(sum(a * a for a in vec1))
-        norm2 = math.sqrt(sum(b * b for b in vec2))
+        ids, vectors, tokens, sources, years, marks = [], [], [], [], [], []
+        with STAGE_SECONDS.time(stage=f"fetch_{collection}_embeddings"):
+            docs = (self.chapter_ref(class_id, subject_id, chapter_id).collection(collection)
+                    .select(["embedding", "tokenCount", "source", "year", "marks"]).stream())
+            for doc in docs:
+                data = doc.to_dict()
+                embedding = data.get("embedding")
+                if embedding:
+                    ids.append(doc.id)
+                    vectors.append(embedding)
+                    tokens.append(data.get("tokenCount") or DEFAULT_CHUNK_TOKENS)
+                    sources.append(data.get("source"))
+                    years.append(data.get("year"))
+                    marks.append(data.get("marks"))
+        FIRESTORE_READS.inc(len(ids), collection=collection)
         
-        if norm1 == 0 or norm2 == 0:
-            return 0.0
+        # An empty collection (chapter without PYQs, unknown chapter) is a 0-row index
+        matrix = (np.array(vectors, dtype=np.float32) if vectors
+                  else np.zeros((0, EMBEDDING_DIM), dtype=np.float32))
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        matrix /= np.where(norms == 0, 1.0, norms)
+        chunk_type = "pyq" if collection == "past_papers" else "chapter"
+        chunks = ChunkSet.build(ids, EmbeddingIndex.build(matrix, EMBEDDING_CODEC), tokens,
+                                chunk_type, sources, years, marks)
+        if EMBEDDING_SNAPSHOT_DIR and version is not None:
+            self.save_snapshot(key, version, chunks, matrix)
+        if chunks.index.exact is None:
+            # No snapshot: the exact rows for re-ranking go to a memory-mapped temporary file
+            chunks.index.keep_exact(matrix)
         
-        return dot / (norm1 * norm2)
+        with self.embedding_cache_lock:
+            self.embedding_cache[key] = (time.monotonic(), chunks, version)
+        return chunks
+    
+    def snapshot_path(self, key):
+        return os.path.join(EMBEDDING_SNAPSHOT_DIR, *(quote(part, safe="") for part in key))
+    
+    def load_snapshot(self, key, version):
+        """ChunkSet from a snapshot of `version` in the current codec, else None"""
+        if not EMBEDDING_SNAPSHOT_DIR or version is None:
+            return None
+        try:
+            index, meta = EmbeddingIndex.load(self.snapshot_path(key))
+            if meta.get("corpus_version") != version or index.codec != EMBEDDING_CODEC:
+                return None
+            return ChunkSet.from_meta(meta["chunks"], index)
+        except (OSError, ValueError, KeyError):
+            return None  # missing, or written by an older version
     
-    def retrieve_top_k(self, chunks, query, k=6):
+    def save_snapshot(self, key, version, chunks, matrix):
         """
-        Retrieve top-k most relevant chunks using semantic similarity
+        Snapshot the chunk set's index with its exact rows and columns; the set then
+        uses the reloaded index, whose float32 rows are memory-mapped from disk
         """
-        # Generate query embedding
-        query_vec = self.embed_model.encode(query).tolist()
-        
-        # Score all chunks
-        scored = []
-        for chunk in chunks:
-            embedding = chunk.get("embedding")
-            if not embedding:
-                continue
+        path = self.snapshot_path(key)
+        try:
+            chunks.index.save(path, exact=matrix, meta={"corpus_version": version, "chunks": chunks.meta()})
+            chunks.index = EmbeddingIndex.load(path)[0]
+        except OSError as e:
+            print(f"Warning: could not write embedding snapshot {path}: {e}")
+    
+    def fetch_texts(self, class_id, subject_id, chapter_id, wanted):
+        """
+        Read text for selected chunks only, in one batched get_all.
+        `wanted` is a list of (collection, doc_id); returns {(collection, doc_id): text}.
+        """
+        if not wanted:
+            return {}
+        chapter = self.chapter_ref(class_id, subject_id, chapter_id)
+        refs = [chapter.collection(collection).document(doc_id) for collection, doc_id in wanted]
+        texts = {}
+        with STAGE_SECONDS.time(stage="fetch_texts"):
+            for snapshot in self.db.get_all(refs, field_paths=["text"]):
+                if snapshot.exists:
+                    texts[(snapshot.reference.parent.id, snapshot.id)] = snapshot.to_dict().get("text", "")
+        FIRESTORE_READS.inc(len(texts), collection="chunk_texts")
+        return texts
+    
+    def mmr_select(self, chunks, query_vec, k, lambda_mult=MMR_LAMBDA, token_budget=None, selected=None):
+        """
+        Row indices (int array) of up to k rows of a ChunkSet picked by maximal marginal relevance:
+        each step takes the row maximizing
+            lambda_mult * sim(row, query) - (1 - lambda_mult) * max sim(row, already picked)
+        among the MMR_CANDIDATES most relevant rows (shortlisted on the compressed
+        codes, then scored on exact vectors). Rows whose token counts no longer
+        fit in `token_budget` are skipped. `selected` holds vectors picked earlier
+        (e.g. from another collection) that new rows should not repeat.
+        """
+        index = chunks.index
+        if len(index) == 0 or k <= 0:
+            return np.zeros(0, dtype=np.int64)
+        with STAGE_SECONDS.time(stage="mmr"):
+            approx = index.scores(query_vec)
+            n = min(MMR_CANDIDATES, len(approx))
+            candidates = np.sort(np.argpartition(-approx, n - 1)[:n])
+            vectors = index.vectors(candidates)
+            relevance = vectors @ query_vec
+            pairwise = vectors @ vectors.T
             
-            score = self.cosine_similarity(query_vec, embedding)
-            scored.append((score, chunk))
-        
-        # Sort by score (highest first)
-        scored.sort(key=lambda x: x[0], reverse=True)
-        
-        # Return top-k chunks
-        return [chunk for score, chunk in scored[:k]]
+            # Highest similarity of each candidate to anything picked so far
+            redundancy = np.full(n, -np.inf, dtype=np.float32)
+            if selected is not None and len(selected):
+                redundancy = (vectors @ np.asarray(selected, dtype=np.float32).T).max(axis=1)
+            
+            costs = chunks.tokens[candidates]
+            remaining = np.inf if token_budget is None else token_budget
+            available = np.ones(n, dtype=bool)
+            picks = []
+            for _ in range(min(k, n)):
+                available &= costs <= remaining
+                if not available.any():
+                    break
+                penalty = np.where(np.isfinite(redundancy), redundancy, 0.0)
+                scores = lambda_mult * relevance - (1 - lambda_mult) * penalty
+                best = int(np.argmax(np.where(available, scores, -np.inf)))
+                picks.append(best)
+                available[best] = False
+                remaining -= costs[best]
+                redundancy = np.maximum(redundancy, pairwise[best])
+        return candidates[picks]
     
-    def retrieve_context_for_quiz(self, class_id, subject_id, chapter_id, num_questions=10):
+    def retrieve_context_for_quiz(self, class_id, subject_id, chapter_id, num_questions=10,
+                                  lambda_mult=MMR_LAMBDA, token_budget=CONTEXT_TOKEN_BUDGET):
         """
         Retrieve relevant context for quiz generation
-        Prioritizes PYQs and adds chapter chunks
+        Prioritizes PYQs and adds chapter chunks.
+        Selects on cached ids + embeddings with MMR (relevant but not redundant,
+        within `token_budget`), then reads text only for the winners.
         """
-        # Fetch both types of chunks
-        chapter_chunks = self.fetch_chapter_chunks(class_id, subject_id, chapter_id)
-        pyq_chunks = self.fetch_pyq_chunks(class_id, subject_id, chapter_id)
-        
         # Build query
         query = f"Generate {num_questions} multiple choice questions for class 8 {subject_id} {chapter_id}"
+        with STAGE_SECONDS.time(stage="encode_query"):
+            query_vec = np.asarray(self.embed_model.encode(query), dtype=np.float32)
+        norm = np.linalg.norm(query_vec)
+        if norm:
+            query_vec = query_vec / norm
         
-        # Combine all chunks
-        all_chunks = pyq_chunks + chapter_chunks
-        
-        # Retrieve top 8 chunks (prioritize variety)
-        # Get top 5 PYQs and top 3 chapter chunks
-        pyq_top = self.retrieve_top_k(pyq_chunks, query, k=5) if pyq_chunks else []
-        chapter_top = self.retrieve_top_k(chapter_chunks, query, k=3) if chapter_chunks else []
+        # Up to 5 PYQs and 3 chapter chunks
+        # PYQs first (to bias generation toward exam-style questions); chapter
+        # chunks must then add something the chosen PYQs don't already cover
+        picked = []  # (collection, ChunkSet, row indices)
+        selected = np.zeros((0, len(query_vec)), dtype=np.float32)
+        remaining = token_budget
+        for collection, k in (("past_papers", 5), ("chunks", 3)):
+            chunks = self.fetch_embeddings(class_id, subject_id, chapter_id, collection)
+            rows = self.mmr_select(chunks, query_vec, k, lambda_mult, remaining, selected)
+            if len(rows):
+                picked.append((collection, chunks, rows))
+                remaining -= int(chunks.tokens[rows].sum())
+                selected = np.vstack([selected, chunks.index.vectors(rows)])
         
-        # Combine with PYQs first (to bias generation toward exam-style questions)
-        context = pyq_top + chapter_top
+        # Dicts are built only for the chunks that go into the prompt
+        wanted = [(collection, str(chunks.ids[i])) for collection, chunks, rows in picked for i in rows]
+        texts = self.fetch_texts(class_id, subject_id, chapter_id, wanted)
+        context = []
+        for collection, chunks, rows in picked:
+            for i in rows:
+                text = texts.get((collection, str(chunks.ids[i])))
+                if text is None:
+                    continue  # deleted since the embeddings were cached
+                context.append(chunks.record(i, text))
         
-        return context[:8]  # Limit to 8 total chunks to manage token count
+        trace_recorder.record_retrieval(context)
+        return context
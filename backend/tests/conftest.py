@@ -0,0 +1,19 @@
+"""
+Shared pytest setup: the backend modules and the local stand-ins in
+benchmarks/local_stack.py are imported by name, as the benchmarks do.
+
+Run from backend/:
+    python -m pytest tests
+"""
+
+import os
+import sys
+import tempfile
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(BACKEND_DIR, "benchmarks"))
+sys.path.insert(0, BACKEND_DIR)
+
+# Services are injected by the tests; write-behind logs stay out of the source tree
+os.environ["QUIZ_BACKEND_LAZY_INIT"] = "1"
+os.environ.setdefault("WRITE_BEHIND_DIR", tempfile.mkdtemp(prefix="quiz-writes-"))
@@ -0,0 +1,55 @@
+"""
+MCQ generation: expanding and checking the compact items Gemini returns
+"""
+
+import json
+
+import pytest
+
+from gemini_service import GeminiService
+
+CONTEXT = [{"id": "chunk1", "text": "Sodium reacts vigorously with cold water.", "type": "chapter"}]
+
+
+class ScriptedResponse:
+    def __init__(self, text):
+        self.text = text
+        self.usage_metadata = None
+
+
+class ScriptedModel:
+    """Returns the same JSON text for every prompt"""
+
+    def __init__(self, items):
+        self.text = json.dumps(items)
+
+    def generate_content(self, prompt, **kwargs):
+        return ScriptedResponse(self.text)
+
+
+def item(answer, options=("Iron", "Sodium", "Copper", "Zinc")):
+    return {"q": "Which metal reacts with cold water?", "o": list(options), "a": answer, "e": "", "d": "e", "s": "chunk1"}
+
+
+def test_letter_answers_are_mapped_to_option_numbers():
+    service = GeminiService(model=ScriptedModel([]))
+    assert service._expand_question(item("B"))["answer"] == 2
+    assert service._expand_question(item("(d)"))["answer"] == 4
+    assert service._expand_question(item("3"))["answer"] == 3
+    assert service._expand_question(item("sodium")) is None
+    assert service._expand_question(item(5)) is None
+    assert service._expand_question(item(1, options=["only one"])) is None
+
+
+def test_malformed_questions_are_dropped():
+    items = [item(2), item("B"), item("not an answer"), {"q": "", "o": [], "a": 1}, item(1)]
+    service = GeminiService(model=ScriptedModel(items))
+
+    questions = service.generate_mcqs(CONTEXT, num_questions=5)
+    assert [q["answer"] for q in questions] == [2, 2, 1]
+
+
+def test_too_few_valid_questions_fail():
+    service = GeminiService(model=ScriptedModel([item("?"), item("?"), item(2)]))
+    with pytest.raises(ValueError):
+        service.generate_mcqs(CONTEXT, num_questions=3)
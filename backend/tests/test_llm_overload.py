@@ -0,0 +1,46 @@
+"""
+Gemini calls rejected by the local governor: fallbacks and the circuit breaker
+"""
+
+import pytest
+
+import local_stack
+from circuit_breaker import CircuitBreaker
+from llm_governor import GovernorTimeout
+
+
+def test_breaker_ignores_local_rejections():
+    breaker = CircuitBreaker("test", min_calls=2, ignored=(GovernorTimeout,))
+
+    def rejected():
+        raise GovernorTimeout("No LLM concurrency slot available before deadline")
+
+    for _ in range(5):
+        with pytest.raises(GovernorTimeout):
+            breaker.call(rejected)
+    assert breaker.stats()["state"] == "closed"
+    assert breaker.stats()["window_calls"] == 0
+
+
+def test_full_governor_serves_an_earlier_quiz(monkeypatch):
+    app, main = local_stack.build_local_app(model=local_stack.FakeGenerativeModel(latency=0.01, sigma=0))
+    client = app.test_client()
+    body = {"subject_id": "science", "chapter_id": "chapter4", "num_questions": 3}
+    local_stack.seed_corpus(main.retrieval.db, main.retrieval.embed_model)
+    assert client.post("/generate_mcq", json=body).status_code == 200
+
+    # Every concurrency slot is taken until the request's deadline passes
+    monkeypatch.setattr(main, "GENERATE_MCQ_DEADLINE", 0.3)
+    governor = main.gemini.governor
+    for _ in range(governor.max_concurrency):
+        governor.slots.acquire()
+    try:
+        response = client.post("/generate_mcq", json=body)
+    finally:
+        for _ in range(governor.max_concurrency):
+            governor.slots.release()
+
+    assert response.status_code == 200
+    assert len(response.get_json()["questions"]) == 3
+    assert governor.stats()["rejected"] >= 1
+    assert main.gemini.breaker.stats()["state"] == "closed"
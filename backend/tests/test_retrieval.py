@@ -0,0 +1,90 @@
+"""
+Retrieval on the local Firestore stand-in: chapters with missing collections,
+exact re-ranking of compressed embeddings, cached chunk sets and snapshots
+"""
+
+import numpy as np
+import pytest
+
+import local_stack
+import retrieval_service
+from retrieval_service import RetrievalService
+
+
+@pytest.fixture
+def stack():
+    db = local_stack.FakeFirestore()
+    encoder = local_stack.FakeEncoder()
+    local_stack.seed_corpus(db, encoder, pyq_per_chapter=0)
+    return db, encoder
+
+
+def test_chapter_without_pyqs_uses_chapter_chunks(stack):
+    db, encoder = stack
+    retrieval = RetrievalService(db=db, embed_model=encoder)
+
+    context = retrieval.retrieve_context_for_quiz("class 8", "science", "chapter4", num_questions=3)
+
+    assert context
+    assert all(chunk["type"] == "chapter" for chunk in context)
+
+
+def test_generate_mcq_for_chapter_without_pyqs(stack):
+    db, encoder = stack
+    app, main = local_stack.build_local_app(db=db, encoder=encoder)
+    client = app.test_client()
+
+    response = client.post("/generate_mcq", json={
+        "subject_id": "science", "chapter_id": "chapter4", "num_questions": 3})
+    assert response.status_code == 200
+    assert len(response.get_json()["questions"]) == 3
+
+    response = client.post("/generate_mcq", json={
+        "subject_id": "science", "chapter_id": "no_such_chapter", "num_questions": 3})
+    assert response.status_code == 404
+
+
+@pytest.mark.parametrize("codec", ["float16", "int8", "pq"])
+def test_default_config_reranks_on_exact_rows(monkeypatch, codec):
+    monkeypatch.setattr(retrieval_service, "EMBEDDING_CODEC", codec)
+    monkeypatch.setattr(retrieval_service, "EMBEDDING_SNAPSHOT_DIR", "")
+    db = local_stack.FakeFirestore()
+    encoder = local_stack.FakeEncoder()
+    local_stack.seed_corpus(db, encoder, chunks_per_chapter=600, pyq_per_chapter=0)
+    retrieval = RetrievalService(db=db, embed_model=encoder)
+
+    chunks = retrieval.fetch_embeddings("class 8", "science", "chapter4", "chunks")
+    ids, index = chunks.ids.tolist(), chunks.index
+    assert index.codec == codec
+    assert index.exact is not None
+
+    docs = retrieval.chapter_ref("class 8", "science", "chapter4").collection("chunks").stream()
+    embeddings = {doc.id: doc.to_dict()["embedding"] for doc in docs}
+    matrix = np.array([embeddings[doc_id] for doc_id in ids], dtype=np.float32)
+    matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+    query = encoder.encode("reactivity of sodium and copper")
+    query = query / np.linalg.norm(query)
+
+    assert index.search(query, 10).tolist() == np.argsort(-(matrix @ query))[:10].tolist()
+
+
+def test_context_is_built_from_cached_columns(monkeypatch, tmp_path):
+    monkeypatch.setattr(retrieval_service, "EMBEDDING_SNAPSHOT_DIR", str(tmp_path))
+    db = local_stack.FakeFirestore()
+    encoder = local_stack.FakeEncoder()
+    local_stack.seed_corpus(db, encoder)
+
+    first = RetrievalService(db=db, embed_model=encoder)
+    context = first.retrieve_context_for_quiz("class 8", "science", "chapter4", num_questions=5)
+    pyqs = [chunk for chunk in context if chunk["type"] == "pyq"]
+    assert pyqs and len(pyqs) < len(context)
+    for chunk in pyqs:
+        assert chunk["source"] == "pyq2024" and chunk["year"] == 2024
+        assert chunk["marks"] == float(1 + int(chunk["id"].split("_q")[1]) % 3)
+    assert all(chunk["text"] for chunk in context)
+
+    # A second worker restores the same columns from the snapshot, without the embedding reads
+    reads = db.reads
+    second = RetrievalService(db=db, embed_model=encoder)
+    assert second.retrieve_context_for_quiz("class 8", "science", "chapter4", num_questions=5) == context
+    assert db.reads - reads == 2 + len(context)  # two manifest reads, then the selected texts
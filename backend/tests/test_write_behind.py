@@ -0,0 +1,125 @@
+"""
+Write-behind queue: dead-lettering, shutdown and re-initialization
+"""
+
+import json
+import os
+import threading
+
+from google.api_core import exceptions as google_exceptions
+
+import local_stack
+from write_behind import WriteBehindQueue
+
+
+class RejectingBatch(local_stack.FakeWriteBatch):
+    """Refuses arrays inside arrays, as Firestore does"""
+
+    def commit(self):
+        for op, key, data, merge, option in self._ops:
+            for value in (data or {}).values():
+                if isinstance(value, list) and any(isinstance(item, list) for item in value):
+                    raise google_exceptions.InvalidArgument("Cannot convert an array value in an array value.")
+        super().commit()
+
+
+class RejectingFirestore(local_stack.FakeFirestore):
+    def batch(self):
+        return RejectingBatch(self)
+
+
+class UnavailableBatch(local_stack.FakeWriteBatch):
+    """Fails with a transient error until `available` is set"""
+
+    def commit(self):
+        if not self._client.available.is_set():
+            raise google_exceptions.ServiceUnavailable("Firestore unavailable")
+        super().commit()
+
+
+class UnavailableFirestore(local_stack.FakeFirestore):
+    def __init__(self):
+        super().__init__()
+        self.available = threading.Event()
+
+    def batch(self):
+        return UnavailableBatch(self)
+
+
+def test_uncommittable_unit_is_dead_lettered(tmp_path):
+    db = RejectingFirestore()
+    queue = WriteBehindQueue(db, directory=str(tmp_path), flush_interval=0.01)
+    queue.set("attempts/a1", {"answers": [1, 2]})
+    queue.set("attempts/a2", {"answers": [[1], [2]]})
+    queue.set("attempts/a3", {"answers": [3, 4]})
+    queue.drain()
+
+    assert db.document("attempts/a1").get().exists
+    assert not db.document("attempts/a2").get().exists
+    assert db.document("attempts/a3").get().exists
+    assert queue.snapshot()["dead_lettered"] == 1
+    assert queue.snapshot()["pending_units"] == 0
+
+    with open(queue.dead_letter_path) as f:
+        dead = [json.loads(line) for line in f]
+    assert [d["unit"]["writes"][0]["path"] for d in dead] == ["attempts/a2"]
+    assert dead[0]["error"].startswith("InvalidArgument")
+    # Everything in the log is accounted for, so a restart re-sends nothing
+    with open(queue.checkpoint_path) as f:
+        assert int(f.read()) == os.path.getsize(queue.log_path)
+
+
+def test_drain_releases_the_log(tmp_path):
+    db = local_stack.FakeFirestore()
+    first = WriteBehindQueue(db, directory=str(tmp_path), flush_interval=0.01)
+    first.set("quizzes/q1", {"n": 1})
+    first.drain()
+    first.drain()  # atexit drains again
+
+    second = WriteBehindQueue(db, directory=str(tmp_path), flush_interval=0.01)
+    second.set("quizzes/q2", {"n": 2})
+    second.drain()
+    assert db.document("quizzes/q1").get().exists
+    assert db.document("quizzes/q2").get().exists
+
+
+def test_drain_timeout_keeps_the_log_until_the_flusher_exits(tmp_path):
+    db = UnavailableFirestore()
+    first = WriteBehindQueue(db, directory=str(tmp_path), flush_interval=0.01)
+    first.set("quizzes/q1", {"n": 1})
+    first.drain(timeout=0.1)
+    # Still retrying: the log stays open and locked
+    assert first.thread.is_alive()
+    assert not first.log.closed
+
+    second = WriteBehindQueue(db, directory=str(tmp_path), flush_interval=0.01)
+    assert second.log_path != first.log_path
+    db.available.set()
+    first.thread.join(10)
+    assert first.log.closed
+    assert db.document("quizzes/q1").get().exists
+
+    second.set("quizzes/q2", {"n": 2})
+    second.drain()
+    assert db.document("quizzes/q2").get().exists
+
+
+def test_init_services_twice():
+    app, main = local_stack.build_local_app()
+    main.init_services(gemini_service=main.gemini, retrieval_service=main.retrieval)
+    main.init_services(gemini_service=main.gemini, retrieval_service=main.retrieval)
+
+    main.writer.set("quizzes/q1", {"n": 1})
+    main.writer.drain()
+    assert main.retrieval.db.document("quizzes/q1").get().exists
+
+
+def test_grade_quiz_rejects_nested_answers():
+    app, main = local_stack.build_local_app()
+    main.quiz_cache["quiz_1"] = {"questions": [{"q": "?", "options": ["a", "b"], "answer": 1}]}
+    client = app.test_client()
+
+    response = client.post("/grade_quiz", json={"quiz_id": "quiz_1", "answers": [[1]]})
+    assert response.status_code == 400
+    response = client.post("/grade_quiz", json={"quiz_id": "quiz_1", "answers": ["1"]})
+    assert response.status_code == 400
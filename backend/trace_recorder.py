@@ -0,0 +1,148 @@
+"""
+Trace Recorder
+Optional recording of quiz traffic (request bodies, retrieved chunks, LLM prompts
+and responses) to a gzipped JSONL file for replay with benchmarks/replay.py
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+
+# Recording is disabled unless TRACE_RECORD_PATH is set; "{pid}" in the path gives
+# each worker process its own file
+TRACE_RECORD_PATH = os.getenv('TRACE_RECORD_PATH')
+TRACE_SAMPLE_RATE = float(os.getenv('TRACE_SAMPLE_RATE', '1'))
+TRACED_ENDPOINTS = ("generate_mcq", "grade_quiz")
+
+_current = threading.local()
+
+
+def prompt_hash(prompt):
+    """Key used to match recorded LLM responses to prompts on replay"""
+    return hashlib.sha1(prompt.encode("utf-8")).hexdigest()[:16]
+
+
+def _pseudonym(value):
+    return "s_" + hashlib.sha1(str(value).encode("utf-8")).hexdigest()[:12]
+
+
+class TraceWriter:
+    """
+    Appends one JSON line per record to a gzip file. Chunk texts are written once
+    per file as {"chunk": ...} records and referenced by id from the traces.
+    """
+
+    def __init__(self, path):
+        self.path = path.format(pid=os.getpid())
+        self.lock = threading.Lock()
+        self.seen_chunks = set()
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Restarts append a new gzip member; readers see one continuous stream
+        self.file = gzip.open(self.path, "at", encoding="utf-8")
+
+    def _write(self, record):
+        self.file.write(json.dumps(record, separators=(",", ":")) + "\n")
+
+    def write(self, trace, chunks):
+        with self.lock:
+            for chunk in chunks:
+                if chunk["id"] not in self.seen_chunks:
+                    self.seen_chunks.add(chunk["id"])
+                    self._write({"chunk": chunk})
+            self._write(trace)
+            self.file.flush()
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+
+_writer = TraceWriter(TRACE_RECORD_PATH) if TRACE_RECORD_PATH else None
+
+
+def enabled():
+    return _writer is not None
+
+
+def begin(endpoint, body):
+    """Start a trace for the current request (no-op unless recording and sampled)"""
+    _current.trace = None
+    if _writer is None or endpoint not in TRACED_ENDPOINTS or random.random() >= TRACE_SAMPLE_RATE:
+        return
+    body = dict(body or {})
+    if "student_id" in body:
+        body["student_id"] = _pseudonym(body["student_id"])
+    _current.trace = {"endpoint": endpoint, "ts": time.time(), "body": body, "events": []}
+    _current.chunks = {}
+
+
+def active():
+    return getattr(_current, "trace", None) is not None
+
+
+def record_retrieval(chunks):
+    """Note the chunks retrieved as quiz context (texts are stored once per file)"""
+    if not active():
+        return
+    ids = []
+    for c in chunks:
+        chunk_id = f"{c.get('type', 'chapter')}:{c.get('id')}"
+        _current.chunks[chunk_id] = {"id": chunk_id, "text": c.get("text", ""),
+                                     "source": c.get("source")}
+        ids.append(chunk_id)
+    _current.trace["events"].append({"t": "retrieval", "ids": ids})
+
+
+def record_llm(kind, prompt, response=None, error=None, seconds=None):
+    """Note one LLM call: the prompt, then either the response text and usage or the error"""
+    if not active():
+        return
+    event = {"t": "llm", "kind": kind, "hash": prompt_hash(prompt), "prompt": prompt,
+             "s": round(seconds, 4) if seconds is not None else None}
+    if error is not None:
+        event["error"] = type(error).__name__
+    else:
+        usage = getattr(response, "usage_metadata", None)
+        event["text"] = response.text
+        event["usage"] = [getattr(usage, "prompt_token_count", 0) or 0,
+                          getattr(usage, "candidates_token_count", 0) or 0] if usage else None
+    _current.trace["events"].append(event)
+
+
+def finish(status, seconds, response_body=None):
+    """Write the current request's trace, if any"""
+    trace = getattr(_current, "trace", None)
+    _current.trace = None
+    if trace is None:
+        return
+    trace["status"] = status
+    trace["s"] = round(seconds, 4)
+    if response_body:
+        # Keep only what replay needs to link a grade_quiz to its generate_mcq
+        trace["response"] = {k: response_body[k] for k in ("quiz_id", "score") if k in response_body}
+    try:
+        _writer.write(trace, _current.chunks.values())
+    except Exception as e:
+        print(f"Failed to write trace: {e}")
+
+
+def read_traces(path):
+    """Yield (chunks, trace) pairs: chunks is the id -> chunk dict accumulated so far"""
+    chunks = {}
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        try:
+            for line in f:
+                record = json.loads(line)
+                if "chunk" in record:
+                    chunks[record["chunk"]["id"]] = record["chunk"]
+                else:
+                    yield chunks, record
+        except (EOFError, json.JSONDecodeError):
+            # File of a worker that is still running or was killed: stop at the last full line
+            return
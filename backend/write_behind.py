@@ -0,0 +1,449 @@
+"""
+Write-Behind Queue
+Durable local log + background flusher for Firestore writes that do not need to
+finish before the HTTP response (quizzes, attempts, explanations)
+"""
+
+import json
+import os
+import random
+import threading
+import time
+from collections import deque
+
+from google.api_core import exceptions as google_exceptions
+
+from metrics import FIRESTORE_READS, FIRESTORE_WRITES, STAGE_SECONDS, WRITE_BEHIND_DEAD_LETTERS
+
+try:
+    import fcntl
+except ImportError:  # Windows: single-process dev server, no orphan recovery
+    fcntl = None
+
+# Firestore's limit on writes per batched commit
+MAX_BATCH_WRITES = 500
+
+WRITE_BEHIND_ENABLED = os.getenv('WRITE_BEHIND', '1') == '1'
+WRITE_BEHIND_DIR = os.getenv('WRITE_BEHIND_DIR', os.path.join(os.path.dirname(__file__), "write_behind"))
+WRITE_BEHIND_FSYNC = os.getenv('WRITE_BEHIND_FSYNC', '0') == '1'
+WRITE_BEHIND_FLUSH_INTERVAL = float(os.getenv('WRITE_BEHIND_FLUSH_INTERVAL', '0.2'))
+
+# Truncate the log once everything in it is committed and it is bigger than this
+COMPACT_BYTES = 4 * 2 ** 20
+
+# Reduced documents changed between read and commit: re-read and retry, up to this
+# many times in a row before the unit is treated as uncommittable
+MAX_CONFLICT_RETRIES = 10
+# Raised when a reduced document changed, appeared or disappeared between read and commit
+CONFLICT_ERRORS = (google_exceptions.FailedPrecondition, google_exceptions.AlreadyExists,
+                   google_exceptions.NotFound)
+
+# name -> fn(current document dict or None, args) -> new document dict
+REDUCERS = {}
+
+
+def register_reducer(name, fn):
+    """Make `fn` usable in {"path", "reduce": name, "args": ...} writes"""
+    REDUCERS[name] = fn
+
+
+def is_permanent_error(error, writes):
+    """
+    True when committing `writes` again cannot succeed: Firestore rejected the
+    data (InvalidArgument, e.g. nested arrays or a document over 1 MiB), a
+    precondition failed on a batch without reducer writes, or the client could
+    not encode the data
+    """
+    if isinstance(error, google_exceptions.InvalidArgument):
+        return True
+    if isinstance(error, CONFLICT_ERRORS):
+        return not any("reduce" in write for write in writes)
+    return isinstance(error, (ValueError, TypeError))
+
+
+def commit_writes(db, writes, stage="firestore_commit"):
+    """
+    Commit `writes` in one batch and return the number of documents written.
+    {"path", "data", "merge"} writes are sets. {"path", "reduce", "args"} writes
+    read the document, fold `args` in with the registered reducer and write the
+    result back only if the document is unchanged since the read (or still
+    missing), so a concurrent update makes the whole batch fail and be retried
+    instead of being lost.
+    """
+    batch = db.batch()
+    collections = {}
+    reduced = {}
+    for write in writes:
+        if "reduce" in write:
+            reduced.setdefault(write["path"], []).append(write)
+            continue
+        batch.set(db.document(write["path"]), write["data"], merge=write.get("merge", False))
+        collection = write["path"].split("/")[0]
+        collections[collection] = collections.get(collection, 0) + 1
+
+    if reduced:
+        snapshots = db.get_all([db.document(path) for path in reduced])
+        for snapshot in snapshots:
+            path = snapshot.reference.path
+            document = snapshot.to_dict() if snapshot.exists else None
+            for write in reduced[path]:
+                document = REDUCERS[write["reduce"]](document, write["args"])
+            if snapshot.exists:
+                batch.update(snapshot.reference, document,
+                             option=db.write_option(last_update_time=snapshot.update_time))
+            else:
+                batch.create(snapshot.reference, document)
+            collection = path.split("/")[0]
+            collections[collection] = collections.get(collection, 0) + 1
+        FIRESTORE_READS.inc(len(reduced), collection="reduced")
+
+    with STAGE_SECONDS.time(stage=stage):
+        batch.commit()
+    for collection, count in collections.items():
+        FIRESTORE_WRITES.inc(count, collection=collection)
+    return sum(collections.values())
+
+
+class WriteBehindQueue:
+    """
+    Each enqueue() appends one JSON line (a "unit" of writes that must commit
+    together) to a local log and returns. A background thread packs units into
+    batched commits of up to 500 writes and records the log offset it has
+    committed up to in a checkpoint file.
+
+    Delivery is at-least-once: after a crash, units past the checkpoint are
+    committed again on the next start, so writes must be idempotent (full-document
+    sets with client-chosen ids, or reducers that skip updates already applied).
+    Logs left behind by dead worker processes are picked up by the next process
+    that starts.
+
+    A unit that can never commit (see is_permanent_error) would block every unit
+    behind it, so it is appended to a dead-letter file next to the log
+    ("writes-{pid}.dead.jsonl", one {"ts", "error", "unit"} line each) and skipped.
+    When a packed batch fails that way, its units are retried one per commit to
+    find the bad one.
+    """
+
+    def __init__(self, db, directory=WRITE_BEHIND_DIR, flush_interval=WRITE_BEHIND_FLUSH_INTERVAL,
+                 fsync=WRITE_BEHIND_FSYNC, max_batch_writes=MAX_BATCH_WRITES):
+        self.db = db
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.max_batch_writes = max_batch_writes
+
+        os.makedirs(directory, exist_ok=True)
+        self.log, self.log_path = self._open_log(directory)
+        self.checkpoint_path = self.log_path + ".offset"
+        self.dead_letter_path = self.log_path[:-len(".log")] + ".dead.jsonl"
+
+        self.lock = threading.Lock()
+        self.cond = threading.Condition(self.lock)
+        self.pending = deque()  # (end offset in log, unit)
+        self.stopping = False
+        self.stats = {"enqueued": 0, "committed_writes": 0, "commits": 0, "failed_commits": 0,
+                      "recovered_units": 0, "dead_lettered": 0}
+        # Log offset up to which units are committed one at a time (isolating a bad unit)
+        self.isolate_until = 0
+
+        self.offset = self.log.seek(0, os.SEEK_END)
+        self._recover()
+
+        self.thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+        self.thread.start()
+
+    @staticmethod
+    def _open_log(directory):
+        """
+        (file, path) of this process's log, locked. If an earlier queue of the same
+        process still holds writes-{pid}.log (its flusher outlived drain()), the
+        next free writes-{pid}-{n}.log is used; the held one is adopted once released.
+        """
+        if not fcntl:
+            path = os.path.join(directory, "writes.log")
+            return open(path, "a+b"), path
+        n = 0
+        while True:
+            name = f"writes-{os.getpid()}.log" if n == 0 else f"writes-{os.getpid()}-{n}.log"
+            path = os.path.join(directory, name)
+            log = open(path, "a+b")
+            try:
+                fcntl.flock(log, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return log, path
+            except OSError:
+                log.close()
+                n += 1
+
+    def _close_log(self):
+        """Release the lock so another queue (or process) can open the log"""
+        with self.cond:
+            if self.log.closed:
+                return
+            if fcntl:
+                fcntl.flock(self.log, fcntl.LOCK_UN)
+            self.log.close()
+
+    # -- recovery --
+    def _read_checkpoint(self, checkpoint_path):
+        try:
+            with open(checkpoint_path) as f:
+                return int(f.read().strip() or 0)
+        except (OSError, ValueError):
+            return 0
+
+    def _uncommitted_units(self, log_path, checkpoint_path):
+        """
+        (end offset, unit) for each unit written to a log after its checkpoint.
+        A torn last line (crash mid-append) is dropped.
+        """
+        units = []
+        with open(log_path, "rb") as f:
+            offset = f.seek(self._read_checkpoint(checkpoint_path))
+            for line in f:
+                try:
+                    unit = json.loads(line)
+                except ValueError:
+                    break
+                offset += len(line)
+                units.append((offset, unit))
+        return units
+
+    def _recover(self):
+        """Re-queue this log's uncommitted units and adopt logs of dead processes"""
+        units = self._uncommitted_units(self.log_path, self.checkpoint_path)
+        self.pending.extend(units)
+        recovered = len(units)
+
+        if fcntl:
+            for name in sorted(os.listdir(self.directory)):
+                path = os.path.join(self.directory, name)
+                if not name.endswith(".log") or path == self.log_path:
+                    continue
+                try:
+                    orphan = open(path, "rb")
+                except FileNotFoundError:
+                    continue  # adopted by another worker meanwhile
+                with orphan:
+                    try:
+                        fcntl.flock(orphan, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except OSError:
+                        continue  # owned by a live worker
+                    adopted = self._uncommitted_units(path, path + ".offset")
+                    # Copy into our own log first, then drop the orphan
+                    for _, unit in adopted:
+                        self._append(unit)
+                    os.remove(path)
+                    if os.path.exists(path + ".offset"):
+                        os.remove(path + ".offset")
+                recovered += len(adopted)
+
+        self.stats["recovered_units"] = recovered
+        if recovered:
+            print(f"Write-behind: recovered {recovered} uncommitted write units")
+
+    # -- producer side --
+    @staticmethod
+    def _encode(unit):
+        return (json.dumps(unit, separators=(",", ":"), ensure_ascii=False) + "\n").encode("utf-8")
+
+    def _append(self, unit):
+        line = self._encode(unit)
+        with self.cond:
+            self.log.write(line)
+            self.log.flush()
+            if self.fsync:
+                os.fsync(self.log.fileno())
+            self.offset += len(line)
+            self.pending.append((self.offset, unit))
+            self.stats["enqueued"] += 1
+            self.cond.notify()
+
+    def set(self, path, data, merge=False):
+        """Queue `db.document(path).set(data, merge=merge)`"""
+        self.enqueue([{"path": path, "data": data, "merge": merge}])
+
+    def enqueue(self, writes):
+        """
+        Queue a list of writes (see commit_writes) that are committed in the same
+        batch. Returns once they are in the local log.
+        """
+        if not writes:
+            return
+        if len(writes) > self.max_batch_writes:
+            raise ValueError(f"A write unit holds at most {self.max_batch_writes} writes")
+        self._append({"ts": time.time(), "writes": writes})
+
+    def depth(self):
+        with self.lock:
+            return len(self.pending)
+
+    def snapshot(self):
+        with self.lock:
+            stats = dict(self.stats)
+            stats["pending_units"] = len(self.pending)
+        return stats
+
+    # -- flusher --
+    def _take_batch(self):
+        """Whole units from the head of the queue, up to max_batch_writes writes"""
+        units, count = [], 0
+        for end, unit in self.pending:
+            size = len(unit["writes"])
+            if units and (count + size > self.max_batch_writes or end <= self.isolate_until):
+                break
+            units.append((end, unit))
+            count += size
+        return units
+
+    def _commit(self, units):
+        writes = [write for _, unit in units for write in unit["writes"]]
+        return commit_writes(self.db, writes, stage="write_behind_commit")
+
+    def _save_checkpoint(self, offset):
+        tmp = self.checkpoint_path + ".tmp"
+        with open(tmp, "w") as f:
+            f.write(str(offset))
+        os.replace(tmp, self.checkpoint_path)
+
+    def _dead_letter(self, end, unit, error):
+        """Move the unit at the head of the queue to the dead-letter file and skip it"""
+        line = self._encode({"ts": time.time(), "error": f"{type(error).__name__}: {error}", "unit": unit})
+        with open(self.dead_letter_path, "ab") as f:
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+        self._save_checkpoint(end)
+        with self.cond:
+            self.pending.popleft()
+            self.stats["dead_lettered"] += 1
+            self.cond.notify_all()
+        WRITE_BEHIND_DEAD_LETTERS.inc(error=type(error).__name__)
+        print(f"Write-behind: unit could not be committed ({error}), moved to {self.dead_letter_path}")
+
+    def _maybe_compact(self, committed_offset):
+        with self.cond:
+            if self.log.closed:
+                return
+            if self.pending or committed_offset != self.offset or self.offset < COMPACT_BYTES:
+                return
+            self.log.truncate(0)
+            self.log.seek(0)
+            self.offset = 0
+            self._save_checkpoint(0)
+
+    def _run(self):
+        try:
+            self._flush()
+        finally:
+            # Stopped by drain(): nothing more is appended
+            self._close_log()
+
+    def _flush(self):
+        failures = 0
+        conflicts = 0
+        while True:
+            with self.cond:
+                while not self.pending and not self.stopping:
+                    self.cond.wait()
+                if not self.pending and self.stopping:
+                    return
+                units = self._take_batch()
+            if not self.stopping:
+                # Let a few more units arrive so commits are batched under load
+                time.sleep(self.flush_interval)
+                with self.cond:
+                    units = self._take_batch()
+
+            try:
+                written = self._commit(units)
+            except Exception as e:
+                with self.cond:
+                    self.stats["failed_commits"] += 1
+                writes = [write for _, unit in units for write in unit["writes"]]
+                permanent = is_permanent_error(e, writes)
+                if not permanent and isinstance(e, CONFLICT_ERRORS):
+                    conflicts += 1
+                    permanent = conflicts > MAX_CONFLICT_RETRIES
+                if permanent:
+                    conflicts = 0
+                    if len(units) > 1:
+                        # Find the bad unit: commit this batch's units one at a time
+                        self.isolate_until = units[-1][0]
+                    else:
+                        self._dead_letter(units[0][0], units[0][1], e)
+                        self._maybe_compact(units[0][0])
+                    continue
+                failures += 1
+                delay = random.uniform(0, min(30.0, 0.5 * 2 ** failures))
+                print(f"Write-behind commit failed ({e}), retrying in {delay:.1f}s")
+                if self.stopping and failures > 5:
+                    print(f"Write-behind: giving up with {len(self.pending)} units left in {self.log_path}")
+                    return
+                time.sleep(delay)
+                continue
+
+            failures = 0
+            conflicts = 0
+            committed_offset = units[-1][0]
+            self._save_checkpoint(committed_offset)
+            with self.cond:
+                for _ in units:
+                    self.pending.popleft()
+                self.stats["commits"] += 1
+                self.stats["committed_writes"] += written
+                self.cond.notify_all()
+            self._maybe_compact(committed_offset)
+
+    def drain(self, timeout=30.0):
+        """
+        Commit everything queued and stop the flusher, which then closes the log
+        (call on shutdown, or before creating another queue in the same process).
+        If the flusher is still retrying after `timeout`, it keeps the log open
+        until it gives up; units left in it are recovered by a later queue.
+        """
+        with self.cond:
+            if self.log.closed:
+                return
+            self.stopping = True
+            self.cond.notify_all()
+        self.thread.join(timeout)
+        if self.pending:
+            print(f"Write-behind: {len(self.pending)} units not committed, kept in {self.log_path}")
+
+
+class DirectWriter:
+    """Same interface, writing synchronously (WRITE_BEHIND=0)"""
+
+    def __init__(self, db):
+        self.db = db
+
+    def set(self, path, data, merge=False):
+        self.enqueue([{"path": path, "data": data, "merge": merge}])
+
+    def enqueue(self, writes, attempts=5):
+        if not writes:
+            return
+        for attempt in range(attempts):
+            try:
+                commit_writes(self.db, writes)
+                return
+            except Exception as e:
+                # Reduced documents changed under us: re-read and try again
+                if attempt == attempts - 1 or is_permanent_error(e, writes):
+                    raise
+                print(f"Commit failed ({e}), retrying")
+                time.sleep(random.uniform(0, 0.05 * 2 ** attempt))
+
+    def depth(self):
+        return 0
+
+    def snapshot(self):
+        return {"pending_units": 0}
+
+    def drain(self, timeout=30.0):
+        pass
+
+
+def create_writer(db):
+    """Write-behind queue unless WRITE_BEHIND=0"""
+    return WriteBehindQueue(db) if WRITE_BEHIND_ENABLED else DirectWriter(db)
@@ -0,0 +1,165 @@
+"""
+Bulk Delete
+Recursive delete of a document or collection together with every nested
+subcollection (chunks, past_papers, meta, ...), which `.delete()` on a single
+document leaves behind.
+
+The target is split into independent subtrees (e.g. deleting a subject gives
+one subtree per chapter subcollection), each handled by its own worker. A
+worker lists its subtree page by page with one all-descendants query
+(document ids only, no fields) and deletes each page in batched commits of up
+to 500 that run in parallel. Dry runs count with aggregation queries instead
+of listing.
+"""
+
+import itertools
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from google.cloud.firestore_v1.field_path import FieldPath
+
+from tree_walker import collection_path
+from verification import count_docs
+
+# Firestore's limit on writes per batched commit
+MAX_BATCH_DELETES = 500
+
+DEFAULT_WORKERS = 8
+
+# Documents listed per page; each page becomes PAGE_SIZE / 500 parallel commits
+PAGE_SIZE = 2000
+
+# A collection with at most this many documents (e.g. a subject's chapters) is split
+# into its documents' subcollections so those subtrees are deleted in parallel
+SPLIT_MAX_DOCS = 200
+SPLIT_LEVELS = 2
+
+
+def is_document_path(path):
+    """classes/class 8 is a document, classes/class 8/subjects a collection"""
+    return len(path.strip("/").split("/")) % 2 == 0
+
+
+def reference(db, path):
+    """Document or collection reference for a slash-separated path"""
+    path = path.strip("/")
+    return db.document(path) if is_document_path(path) else db.collection(path)
+
+
+def _is_collection(ref):
+    return hasattr(ref, "list_documents")
+
+
+def _subtrees(ref):
+    """Collections that can be deleted independently: ref itself, or a document's subcollections"""
+    return [ref] if _is_collection(ref) else list(ref.collections())
+
+
+def _plan(ref, workers):
+    """
+    (subtrees, shallow): collections to delete recursively in parallel, and the
+    documents above them (deleted afterwards, without recursion). Small collections
+    are split into their documents' subcollections until there is enough work for
+    `workers`; big flat ones (chunks) stay a single subtree.
+    """
+    subtrees, shallow = _subtrees(ref), []
+    for _ in range(SPLIT_LEVELS):
+        if len(subtrees) >= workers:
+            break
+        split = []
+        for collection in subtrees:
+            # list_documents also returns "missing" parents that only hold subcollections
+            docs = list(itertools.islice(collection.list_documents(page_size=SPLIT_MAX_DOCS + 1),
+                                         SPLIT_MAX_DOCS + 1))
+            if len(docs) > SPLIT_MAX_DOCS:
+                split.append(collection)
+                continue
+            shallow.extend(docs)
+            for doc in docs:
+                split.extend(doc.collections())
+        subtrees = split
+    return subtrees, shallow
+
+
+def _delete_batch(db, refs):
+    batch = db.batch()
+    for ref in refs:
+        batch.delete(ref)
+    batch.commit()
+    return len(refs)
+
+
+def _delete_subtree(db, collection_ref, pool, page_size, on_progress):
+    """Delete every document in `collection_ref` and below it; returns the number deleted"""
+    query = collection_ref.recursive().select([FieldPath.document_id()]).limit(page_size)
+    deleted = 0
+    while True:
+        # Deleted documents drop out of the query, so each page starts from the top again
+        refs = [snapshot.reference for snapshot in query.stream()]
+        if not refs:
+            return deleted
+        chunks = [refs[i:i + MAX_BATCH_DELETES] for i in range(0, len(refs), MAX_BATCH_DELETES)]
+        deleted += sum(pool.map(lambda chunk: _delete_batch(db, chunk), chunks))
+        if on_progress:
+            on_progress(deleted)
+
+
+def count_tree(db, ref, workers=DEFAULT_WORKERS):
+    """
+    Dry run: {path: documents} for everything delete_tree(ref) would remove,
+    counted per subtree with aggregation queries
+    """
+    subtrees = _subtrees(ref)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        counts = list(pool.map(lambda collection: count_docs(collection.recursive()), subtrees))
+    result = {collection_path(c): n for c, n in zip(subtrees, counts)}
+    if not _is_collection(ref) and ref.get().exists:
+        result[ref.path] = 1
+    return result
+
+
+def delete_tree(db, ref, dry_run=False, workers=DEFAULT_WORKERS, page_size=PAGE_SIZE, verbose=True):
+    """
+    Delete `ref` (a DocumentReference or CollectionReference) and all of its
+    descendants. Returns {"documents": n, "seconds": s, "dry_run": bool,
+    "subtrees": {path: n}}.
+    """
+    started = time.time()
+    if dry_run:
+        subtrees = count_tree(db, ref, workers)
+        total = sum(subtrees.values())
+        if verbose:
+            for path, count in sorted(subtrees.items()):
+                print(f"   would delete {count} docs under {path}")
+            print(f"   🔎 Dry run: {total} documents would be deleted")
+        return {"documents": total, "seconds": time.time() - started, "dry_run": True, "subtrees": subtrees}
+
+    subtrees, shallow = _plan(ref, workers)
+    progress = {}
+
+    def report(path):
+        def on_progress(deleted):
+            progress[path] = deleted
+            if verbose:
+                print(f"   🗑️  {path}: {deleted} deleted ({sum(progress.values()) / (time.time() - started):.0f} docs/s)")
+        return on_progress
+
+    # Subtree workers list pages; batch commits share a separate pool so neither starves the other
+    with ThreadPoolExecutor(max_workers=workers) as commit_pool, \
+            ThreadPoolExecutor(max_workers=max(1, min(workers, len(subtrees)))) as subtree_pool:
+        counts = list(subtree_pool.map(
+            lambda collection: _delete_subtree(db, collection, commit_pool, page_size, report(collection_path(collection))),
+            subtrees))
+        result = {collection_path(c): n for c, n in zip(subtrees, counts)}
+
+        # Then the documents the subtrees hung from, and finally the target document
+        if not _is_collection(ref):
+            shallow.append(ref)
+        chunks = [shallow[i:i + MAX_BATCH_DELETES] for i in range(0, len(shallow), MAX_BATCH_DELETES)]
+        result["(parent documents)"] = sum(commit_pool.map(lambda chunk: _delete_batch(db, chunk), chunks))
+
+    total = sum(result.values())
+    elapsed = time.time() - started
+    if verbose:
+        print(f"   ✓ Deleted {total} documents in {elapsed:.1f}s ({total / max(elapsed, 1e-6):.0f} docs/s)")
+    return {"documents": total, "seconds": elapsed, "dry_run": False, "subtrees": result}
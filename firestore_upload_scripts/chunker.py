@@ -0,0 +1,187 @@
+"""
+Chunker
+Shared sentence- and heading-aware chunking for the upload scripts.
+
+Chunks are sized in tokens of the embedding model's own tokenizer, so every
+chunk fits all-MiniLM-L6-v2's 256-token input window instead of being silently
+truncated at embedding time. Chunks never cross a heading, break only between
+sentences (a single over-long sentence is split on words), repeat up to
+`overlap_tokens` of trailing sentences from the previous chunk, and record
+their character offsets in the extracted text.
+
+    for chunk in chunk_text(text):
+        chunk["text"], chunk["start"], chunk["end"], chunk["tokens"], chunk["heading"]
+"""
+
+import re
+
+EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+
+# all-MiniLM-L6-v2 reads at most 256 word pieces, including [CLS] and [SEP]
+MODEL_MAX_TOKENS = 256
+MAX_TOKENS = 200
+OVERLAP_TOKENS = 30
+
+# Headings as they come out of textbook PDFs: "4.2 Chemical Properties of Metals",
+# "Activity 4.1", "CHAPTER 4", "EXERCISES" - short lines without closing punctuation.
+# Case-sensitive on purpose: PDF lines wrap mid-sentence, so a lowercase line
+# without a full stop is usually just the middle of a paragraph.
+_HEADING_WORDS = ("Chapter", "Unit", "Activity", "Exercise", "Exercises", "Summary", "Keywords",
+                  "Let us recall", "What you have learnt")
+HEADING_RE = re.compile(
+    r"^(?:(?:" + "|".join(w for word in _HEADING_WORDS for w in (word, word.upper())) + r")"
+    r"(?:\s+[\dIVX.]+)?(?:\s*[:\-–]\s*.*)?"
+    r"|\d+\.\d+(?:\.\d+)*\s+[A-Z].*"
+    # All caps, but not a running page header ("MATERIALS : METALS AND NON-METALS 45")
+    r"|(?!.*\s\d+$)[A-Z][A-Z0-9 ,:&'-]{3,})$"
+)
+MAX_HEADING_CHARS = 80
+
+# A sentence ends at . ! ? (optionally followed by a quote/bracket) before whitespace
+SENTENCE_END_RE = re.compile(r"[.!?][\"')\]]*(?=\s)")
+PARAGRAPH_BREAK_RE = re.compile(r"\n\s*\n")
+
+_tokenizer = None
+
+
+def _load_tokenizer():
+    """The embedding model's tokenizer, or None if transformers or the model files are unavailable"""
+    global _tokenizer
+    if _tokenizer is None:
+        try:
+            from transformers import AutoTokenizer
+            _tokenizer = AutoTokenizer.from_pretrained(f"sentence-transformers/{EMBEDDING_MODEL}")
+        except ImportError:
+            print("WARNING: transformers not installed - token counts are estimated "
+                  "(pip install sentence-transformers)")
+            _tokenizer = False
+        except OSError as e:
+            # Offline with no cached copy, or the model name can't be found
+            print(f"WARNING: could not load the {EMBEDDING_MODEL} tokenizer ({e}) - "
+                  "token counts are estimated")
+            _tokenizer = False
+    return _tokenizer or None
+
+
+def count_tokens(text):
+    """Word pieces the embedding model sees for `text` (without [CLS]/[SEP])"""
+    tokenizer = _load_tokenizer()
+    if tokenizer is not None:
+        return len(tokenizer.encode(text, add_special_tokens=False))
+    # Estimate: one piece per ~4 characters of each word, one per punctuation mark
+    return sum(max(1, -(-len(word) // 4)) for word in re.findall(r"\w+|[^\w\s]", text))
+
+
+def is_heading(line):
+    line = line.strip()
+    return (0 < len(line) <= MAX_HEADING_CHARS and not line.endswith((".", ",", ";", "?", "!"))
+            and HEADING_RE.match(line) is not None)
+
+
+def _sections(text):
+    """(heading or None, start, body start, end) spans of text between headings"""
+    sections = []
+    heading, start, body = None, 0, 0
+    for match in re.finditer(r"[^\n]+", text):
+        if is_heading(match.group()):
+            if text[start:match.start()].strip():
+                sections.append((heading, start, body, match.start()))
+            heading, start, body = match.group().strip(), match.start(), match.end()
+    if text[start:].strip():
+        sections.append((heading, start, body, len(text)))
+    return sections
+
+
+def _sentences(text, start, end):
+    """(start, end) character spans of the sentences in text[start:end], whitespace trimmed"""
+    boundaries = {m.end() for m in SENTENCE_END_RE.finditer(text, start, end)}
+    boundaries |= {m.start() for m in PARAGRAPH_BREAK_RE.finditer(text, start, end)}
+    spans, cursor = [], start
+    for boundary in sorted(boundaries) + [end]:
+        piece = text[cursor:boundary]
+        if piece.strip():
+            spans.append((cursor + len(piece) - len(piece.lstrip()), boundary - (len(piece) - len(piece.rstrip()))))
+        cursor = boundary
+    return spans
+
+
+def _split_long(text, start, end, max_tokens):
+    """Word-boundary spans of at most max_tokens for a sentence that is too long alone"""
+    spans = []
+    span_start, span_end, tokens = None, None, 0
+    for word in re.finditer(r"\S+", text[start:end]):
+        word_tokens = count_tokens(word.group())
+        if span_start is not None and tokens + word_tokens > max_tokens:
+            spans.append((span_start, span_end))
+            span_start, tokens = None, 0
+        if span_start is None:
+            span_start = start + word.start()
+        span_end = start + word.end()
+        tokens += word_tokens
+    if span_start is not None:
+        spans.append((span_start, span_end))
+    return spans
+
+
+def chunk_text(text, max_tokens=MAX_TOKENS, overlap_tokens=OVERLAP_TOKENS):
+    """
+    List of {"text", "start", "end", "tokens", "heading"} chunks of `text`.
+    `start`/`end` are character offsets into `text`; `tokens` is the exact token
+    count of the chunk text (estimated if transformers is missing).
+    """
+    if max_tokens > MODEL_MAX_TOKENS - 2:
+        raise ValueError(f"max_tokens must leave room for [CLS]/[SEP] ({MODEL_MAX_TOKENS - 2} max)")
+    if not text:
+        return []
+
+    chunks = []
+    for heading, section_start, body_start, section_end in _sections(text):
+        # (start, end, tokens) units that fit the budget on their own; the heading is the first
+        units = []
+        for s, e in _sentences(text, section_start, body_start) + _sentences(text, body_start, section_end):
+            n = count_tokens(text[s:e])
+            if n <= max_tokens:
+                units.append((s, e, n))
+            else:
+                units.extend((ws, we, count_tokens(text[ws:we])) for ws, we in _split_long(text, s, e, max_tokens))
+
+        current, current_tokens = [], 0
+        for unit in units:
+            if current and current_tokens + unit[2] > max_tokens:
+                chunks.append(_make_chunk(text, current, heading))
+                # Carry trailing sentences (up to overlap_tokens) into the next chunk
+                carried, carried_tokens = [], 0
+                for previous in reversed(current):
+                    if carried_tokens + previous[2] > overlap_tokens or carried_tokens + previous[2] + unit[2] > max_tokens:
+                        break
+                    carried.insert(0, previous)
+                    carried_tokens += previous[2]
+                current, current_tokens = carried, carried_tokens
+            current.append(unit)
+            current_tokens += unit[2]
+        if current:
+            chunks.append(_make_chunk(text, current, heading))
+    return chunks
+
+
+def _make_chunk(text, units, heading):
+    start, end = units[0][0], units[-1][1]
+    # Collapse PDF line breaks inside the chunk; offsets still point at the original text
+    chunk_text = re.sub(r"\s+", " ", text[start:end]).strip()
+    return {
+        "text": chunk_text,
+        "start": start,
+        "end": end,
+        "tokens": count_tokens(chunk_text),
+        "heading": heading,
+    }
+
+
+def chunk_fields(chunk):
+    """Firestore fields stored alongside "text" for one chunk"""
+    return {
+        "charStart": chunk["start"],
+        "charEnd": chunk["end"],
+        "tokenCount": chunk["tokens"],
+        "heading": chunk["heading"],
+    }
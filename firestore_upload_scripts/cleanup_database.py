@@ -2,11 +2,19 @@
 PHASE 1: Database Cleanup Script
 - Delete 'mathametics' subject
 - Rename English chapters 'ch1' → 'chapter 1', 'ch2' → 'chapter 2'
+
+Deleting any document/collection with everything nested below it:
+    python cleanup_database.py --delete "classes/class 8/subjects/science/chapters/chapter4" --dry-run
+    python cleanup_database.py --delete "classes/class 8/subjects/science/chapters/chapter4"
 """
 
+import sys
+
 import firebase_admin
 from firebase_admin import credentials, firestore
 
+from bulk_delete import delete_tree, reference
+
 # Initialize Firebase
 try:
     app = firebase_admin.get_app()
@@ -17,11 +25,21 @@ except ValueError:
 db = firestore.client()
 
 CLASS_ID = "class 8"
+DRY_RUN = "--dry-run" in sys.argv
 
 print("=" * 70)
-print("DATABASE CLEANUP")
+print("DATABASE CLEANUP" + (" (DRY RUN)" if DRY_RUN else ""))
 print("=" * 70)
 
+# ============================================================================
+# --delete <path>: remove one document/collection subtree and stop
+# ============================================================================
+if "--delete" in sys.argv:
+    target = sys.argv[sys.argv.index("--delete") + 1]
+    print(f"\nDeleting '{target}' and everything below it...")
+    delete_tree(db, reference(db, target), dry_run=DRY_RUN)
+    sys.exit(0)
+
 # ============================================================================
 # TASK 1: Delete 'mathametics' subject
 # ============================================================================
@@ -32,20 +50,20 @@ mathametics_ref = (db.collection("classes")
                     .collection("subjects")
                     .document("mathametics"))
 
-# Check if exists
-if mathametics_ref.get().exists:
-    # Delete all subcollections first (chapters if any)
-    chapters = mathametics_ref.collection("chapters").stream()
-    for ch in chapters:
-        ch.reference.delete()
-        print(f"   Deleted chapter: {ch.id}")
-    
-    # Delete the subject document
-    mathametics_ref.delete()
-    print("   ✓ Deleted 'mathametics' subject")
+# The subject document may be gone while its chapters/chunks are still there,
+# so check for subcollections too
+if mathametics_ref.get().exists or list(mathametics_ref.collections()):
+    # Chapters, their chunks/past_papers/manifest, then the subject document
+    delete_tree(db, mathametics_ref, dry_run=DRY_RUN)
+    if not DRY_RUN:
+        print("   ✓ Deleted 'mathametics' subject")
 else:
     print("   ⚠️  'mathametics' not found (may already be deleted)")
 
+if DRY_RUN:
+    print("\nDry run: skipping chapter renames")
+    sys.exit(0)
+
 # ============================================================================
 # TASK 2: Rename English chapters
 # ============================================================================
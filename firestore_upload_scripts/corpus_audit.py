@@ -0,0 +1,185 @@
+"""
+Corpus Audit
+Structured report over the whole database, built on tree_walker + verification:
+document counts per collection, missing embeddings and schema drift per chapter.
+
+Per chapter the audit costs the chapter and manifest reads, four count
+aggregations and a 3-document sample of each chunk collection, and chapters are
+audited in parallel.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+from google.api_core import exceptions as google_exceptions
+
+from manifest import MANIFEST_COLLECTION, read_manifest
+from tree_walker import DEFAULT_WORKERS, collection_path, walk_tree
+from verification import (EXPECTED_EMBEDDING_DIM, SAMPLE_FIELDS, check_sample, collection_stats, count_docs,
+                          random_sample)
+
+# Fields the upload scripts write (anything missing is drift; anything else too, on chapter
+# documents, which are read whole)
+EXPECTED_FIELDS = {
+    "chapter": {"chapter_name", "notesURL", "summary"},
+    "chunks": {"chunkNumber", "text"},
+    "past_papers": {"chunkNumber", "text", "embedding", "embeddingDim", "source", "type"},
+}
+# Written by the shared chunker (charStart/charEnd/tokenCount/heading) or by older uploads
+CHUNK_FIELDS = {"charStart", "charEnd", "tokenCount", "heading"}
+# Written by upload_pyq.py for one-document-per-question past papers
+QUESTION_FIELDS = {"questionNumber", "question", "options", "answer", "marks", "year", "section",
+                   "paper", "questionType"}
+OPTIONAL_FIELDS = {
+    "chapter": set(),
+    "chunks": {"embedding", "embeddingDim", "source", "type"} | CHUNK_FIELDS,
+    "past_papers": CHUNK_FIELDS | QUESTION_FIELDS,
+}
+CHAPTER_COLLECTIONS = {"chunks", "past_papers", MANIFEST_COLLECTION}
+SAMPLE_SIZE = 3
+
+
+def is_chapter(ref):
+    """classes/{class}/subjects/{subject}/chapters/{chapter}"""
+    parts = ref.path.split("/")
+    return len(parts) == 6 and parts[0] == "classes" and parts[2] == "subjects" and parts[4] == "chapters"
+
+
+def _drift(kind, fields):
+    """Missing / unexpected field names for one document"""
+    expected = EXPECTED_FIELDS[kind]
+    missing = sorted(expected - fields)
+    unexpected = sorted(fields - expected - OPTIONAL_FIELDS[kind])
+    return {"missing": missing, "unexpected": unexpected} if missing or unexpected else None
+
+
+def audit_chapter(chapter_ref, subcollections):
+    """Report entry for one chapter; `subcollections` are the names found by the walk"""
+    entry = {"path": chapter_ref.path, "collections": {}, "schema_drift": {}, "problems": []}
+
+    snapshot = chapter_ref.get()
+    if not snapshot.exists:
+        entry["problems"].append("chapter document missing (only subcollections exist)")
+    else:
+        drift = _drift("chapter", set(snapshot.to_dict()))
+        if drift:
+            entry["schema_drift"]["chapter"] = drift
+
+    manifest = read_manifest(chapter_ref)
+    entry["corpus_version"] = (manifest or {}).get("corpus_version")
+    expected_dim = (manifest or {}).get("embedding_dim") or EXPECTED_EMBEDDING_DIM
+    if manifest is None:
+        entry["problems"].append("no manifest")
+
+    for name in ("chunks", "past_papers"):
+        collection = chapter_ref.collection(name)
+        if name not in subcollections:
+            entry["collections"][name] = {"count": 0, "with_embedding": 0, "missing_embeddings": 0}
+            continue
+        stats = collection_stats(collection, (manifest or {}).get("collections", {}).get(name))
+        stats["missing_embeddings"] = stats["count"] - stats["with_embedding"]
+        entry["collections"][name] = stats
+        if stats["manifest_count"] is not None and stats["manifest_count"] != stats["count"]:
+            entry["problems"].append(f"{name}: manifest says {stats['manifest_count']}, found {stats['count']}")
+
+        # Only the known fields are read, so drift in samples shows up as missing fields
+        fields = sorted(EXPECTED_FIELDS[name] | OPTIONAL_FIELDS[name] | set(SAMPLE_FIELDS))
+        sample = random_sample(collection, SAMPLE_SIZE, fields=fields)
+        drifts = {doc.id: _drift(name, set(doc.to_dict())) for doc in sample}
+        drifts = {doc_id: drift for doc_id, drift in drifts.items() if drift}
+        if drifts:
+            entry["schema_drift"][name] = drifts
+        entry["problems"].extend(f"{name}/{problem}" for problem in
+                                 check_sample(sample, expected_dim, require_embedding=stats["with_embedding"] > 0))
+
+    unexpected = sorted(set(subcollections) - CHAPTER_COLLECTIONS)
+    if unexpected:
+        entry["schema_drift"]["subcollections"] = {"unexpected": unexpected}
+    return entry
+
+
+def _count_leaf(ref):
+    try:
+        return count_docs(ref)
+    except google_exceptions.GoogleAPICallError as e:
+        return f"error: {e}"
+
+
+def run_audit(db, roots=None, workers=DEFAULT_WORKERS, on_level=None):
+    """
+    Walk the database and audit every chapter. Returns
+    {"chapters": [...], "collection_counts": {collection path: n}, "totals": {...},
+     "levels": n, "truncated": [...]}
+    """
+    tree = walk_tree(db, roots=roots, workers=workers, on_level=on_level)
+
+    # Which subcollections each document has (leaves and listed collections alike)
+    subcollections = {}
+    for ref in tree["collections"] + tree["leaves"]:
+        if ref.parent is not None:
+            subcollections.setdefault(ref.parent.path, set()).add(ref.id)
+
+    chapter_refs = [doc for doc in tree["documents"] if is_chapter(doc)]
+    # Chapter chunk collections are counted by audit_chapter; count every other leaf here
+    leaves = [ref for ref in tree["leaves"]
+              if not (ref.id in ("chunks", "past_papers") and ref.parent is not None and is_chapter(ref.parent))]
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        chapters = list(pool.map(lambda ref: audit_chapter(ref, subcollections.get(ref.path, set())),
+                                 chapter_refs))
+        leaf_counts = list(pool.map(_count_leaf, leaves))
+
+    collection_counts = {}
+    for ref in tree["collections"]:
+        collection_counts[collection_path(ref)] = 0
+    for doc in tree["documents"]:
+        parent = collection_path(doc.parent)
+        collection_counts[parent] = collection_counts.get(parent, 0) + 1
+    for ref, count in zip(leaves, leaf_counts):
+        collection_counts[collection_path(ref)] = count
+    for chapter in chapters:
+        for name, stats in chapter["collections"].items():
+            if stats["count"]:
+                collection_counts[f"{chapter['path']}/{name}"] = stats["count"]
+
+    totals = {
+        "chapters": len(chapters),
+        "chunks": sum(c["collections"]["chunks"]["count"] for c in chapters),
+        "past_papers": sum(c["collections"]["past_papers"]["count"] for c in chapters),
+        "missing_embeddings": sum(s["missing_embeddings"] for c in chapters for s in c["collections"].values()),
+        "chapters_with_drift": sum(1 for c in chapters if c["schema_drift"]),
+        "chapters_with_problems": sum(1 for c in chapters if c["problems"]),
+    }
+    return {
+        "chapters": sorted(chapters, key=lambda c: c["path"]),
+        "collection_counts": dict(sorted(collection_counts.items())),
+        "totals": totals,
+        "levels": tree["levels"],
+        "truncated": [ref.path if hasattr(ref, "path") else collection_path(ref) for ref in tree["truncated"]],
+    }
+
+
+def print_report(report):
+    totals = report["totals"]
+    print(f"✓ Walked {report['levels']} levels, audited {totals['chapters']} chapters")
+    print(f"   chunks: {totals['chunks']}, past_papers: {totals['past_papers']}, "
+          f"missing embeddings: {totals['missing_embeddings']}")
+    print(f"   chapters with schema drift: {totals['chapters_with_drift']}, "
+          f"with problems: {totals['chapters_with_problems']}")
+
+    print("\n📂 Document counts:")
+    for path, count in report["collection_counts"].items():
+        print(f"   {path}: {count}")
+
+    for chapter in report["chapters"]:
+        if not chapter["schema_drift"] and not chapter["problems"]:
+            continue
+        print(f"\n📗 {chapter['path']} (corpus version {chapter['corpus_version']})")
+        for name, stats in chapter["collections"].items():
+            print(f"   {name}: {stats['count']} docs, {stats['missing_embeddings']} missing embeddings")
+        for kind, drift in chapter["schema_drift"].items():
+            print(f"   ⚠️  schema drift in {kind}: {drift}")
+        for problem in chapter["problems"]:
+            print(f"   ❌ {problem}")
+
+    if report["truncated"]:
+        print(f"\n⚠️  Depth limit reached at {len(report['truncated'])} nodes (not audited)")
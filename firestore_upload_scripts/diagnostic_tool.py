@@ -1,11 +1,22 @@
 """
 🔍 FIRESTORE DIAGNOSTIC TOOL
 This script runs all diagnostics to find why your upload might not be working.
+
+Usage:
+    python diagnostic_tool.py                           # checks for CLASS_ID/SUBJECT_ID/CHAPTER_ID
+    python diagnostic_tool.py --audit                   # + audit of every class/subject/chapter
+    python diagnostic_tool.py --audit --json report.json
 """
 
 import firebase_admin
 from firebase_admin import credentials, firestore
+import json
 import os
+import sys
+import time
+
+from corpus_audit import print_report, run_audit
+from manifest import print_manifest, read_manifest
 
 # -----------------------------
 # INITIALIZE FIREBASE
@@ -176,6 +187,23 @@ try:
 except Exception as e:
     print(f"❌ ERROR in subject analysis: {e}")
 
+# -----------------------------
+# DIAGNOSTIC 7b: Chapter manifest (counts without scanning chunks)
+# -----------------------------
+print("\n📋 DIAGNOSTIC 7b: Chapter Manifest")
+print("-" * 70)
+try:
+    chapter_ref = (db.collection("classes")
+                    .document(CLASS_ID)
+                    .collection("subjects")
+                    .document(SUBJECT_ID)
+                    .collection("chapters")
+                    .document(CHAPTER_ID))
+    print(f"📒 classes/{CLASS_ID}/subjects/{SUBJECT_ID}/chapters/{CHAPTER_ID}/meta/manifest")
+    print_manifest(read_manifest(chapter_ref))
+except Exception as e:
+    print(f"❌ ERROR reading manifest: {e}")
+
 # -----------------------------
 # DIAGNOSTIC 8: Search for 'chunks' globally
 # -----------------------------
@@ -203,6 +231,26 @@ except Exception as e:
     print(f"❌ WRITE PERMISSION ERROR: {e}")
     print("   Check your service account IAM permissions!")
 
+# -----------------------------
+# DIAGNOSTIC 10: Full database audit (--audit)
+# -----------------------------
+if "--audit" in sys.argv:
+    print("\n📋 DIAGNOSTIC 10: Full Database Audit")
+    print("-" * 70)
+    try:
+        started = time.time()
+        report = run_audit(db, on_level=lambda depth, count: print(f"   level {depth}: {count} nodes to expand"))
+        print(f"   ({time.time() - started:.1f}s)\n")
+        print_report(report)
+
+        if "--json" in sys.argv:
+            json_path = sys.argv[sys.argv.index("--json") + 1]
+            with open(json_path, "w", encoding="utf-8") as f:
+                json.dump(report, f, indent=2, ensure_ascii=False)
+            print(f"\n💾 Report saved to {json_path}")
+    except Exception as e:
+        print(f"❌ ERROR during audit: {e}")
+
 # -----------------------------
 # SUMMARY & RECOMMENDATIONS
 # -----------------------------
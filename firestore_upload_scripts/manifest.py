@@ -0,0 +1,129 @@
+"""
+Chapter Manifest
+Shared helper for the ingestion scripts: keeps one small metadata document per
+chapter so tools (and the backend's RetrievalService) can answer "how many chunks,
+which embedding model, has anything changed?" without scanning the chunks.
+
+Location:
+    classes/{class}/subjects/{subject}/chapters/{chapter}/meta/manifest
+
+Shape:
+    {
+      "corpus_version": 7,                  # bumped on every ingestion
+      "embedding_model": "all-MiniLM-L6-v2",
+      "embedding_dim": 384,
+      "collections": {
+        "chunks":      {"count": 40, "with_embedding": 40, "content_hash": "...",
+                        "sources": {"chapter": {...}}},
+        "past_papers": {"count": 20, "with_embedding": 20, "content_hash": "...",
+                        "sources": {"pyq2024": {"count": 20, "with_embedding": 20,
+                                                "content_hash": "...", "chunk_hashes": {...}}}}
+      },
+      "last_ingested_at": <server timestamp>,
+      "last_ingested_by": "upload_pyq.py"
+    }
+"""
+
+import hashlib
+import os
+import sys
+
+from firebase_admin import firestore
+
+MANIFEST_COLLECTION = "meta"
+MANIFEST_DOC = "manifest"
+
+
+def manifest_ref(chapter_ref):
+    return chapter_ref.collection(MANIFEST_COLLECTION).document(MANIFEST_DOC)
+
+
+def text_hash(text):
+    """Short content hash of one chunk's text"""
+    return hashlib.sha256((text or "").encode("utf-8")).hexdigest()[:16]
+
+
+def _combined_hash(chunk_hashes):
+    joined = "\n".join(f"{doc_id}:{h}" for doc_id, h in sorted(chunk_hashes.items()))
+    return hashlib.sha256(joined.encode("utf-8")).hexdigest()[:16]
+
+
+def source_entry(chunks):
+    """
+    Manifest entry for one ingested source.
+    `chunks` maps document id -> uploaded data ({"text", optional "embedding"}).
+    """
+    chunk_hashes = {doc_id: text_hash(data.get("text")) for doc_id, data in chunks.items()}
+    return {
+        "count": len(chunks),
+        "with_embedding": sum(1 for data in chunks.values() if data.get("embedding")),
+        "content_hash": _combined_hash(chunk_hashes),
+        "chunk_hashes": chunk_hashes,
+    }
+
+
+def _collection_totals(sources):
+    return {
+        "count": sum(s["count"] for s in sources.values()),
+        "with_embedding": sum(s["with_embedding"] for s in sources.values()),
+        "content_hash": _combined_hash({name: s["content_hash"] for name, s in sources.items()}),
+        "sources": sources,
+    }
+
+
+def read_manifest(chapter_ref):
+    """The chapter's manifest dict, or None if it was never written"""
+    snapshot = manifest_ref(chapter_ref).get()
+    return snapshot.to_dict() if snapshot.exists else None
+
+
+def record_ingest(db, chapter_ref, collection, source, chunks, embedding_model=None, embedding_dim=None):
+    """
+    Record that `chunks` (doc id -> data) were uploaded to `collection` for `source`
+    (e.g. "chapter" for chapter text, "pyq2024" for a past paper). Replaces that
+    source's entry, recomputes the collection totals and bumps corpus_version,
+    all in one transaction so concurrent uploads don't lose updates.
+    Returns the new corpus_version.
+    """
+    ref = manifest_ref(chapter_ref)
+    entry = source_entry(chunks)
+
+    @firestore.transactional
+    def update(transaction):
+        snapshot = ref.get(transaction=transaction)
+        manifest = snapshot.to_dict() if snapshot.exists else {}
+        collections = manifest.get("collections", {})
+        sources = dict(collections.get(collection, {}).get("sources", {}))
+        sources[source] = entry
+        collections[collection] = _collection_totals(sources)
+
+        manifest["collections"] = collections
+        manifest["corpus_version"] = manifest.get("corpus_version", 0) + 1
+        if embedding_model:
+            manifest["embedding_model"] = embedding_model
+            manifest["embedding_dim"] = embedding_dim
+        manifest["last_ingested_at"] = firestore.SERVER_TIMESTAMP
+        manifest["last_ingested_by"] = os.path.basename(sys.argv[0]) or "unknown"
+        transaction.set(ref, manifest)
+        return manifest["corpus_version"]
+
+    version = update(db.transaction())
+    print(f"📒 Manifest updated: {collection}/{source} = {entry['count']} chunks "
+          f"(corpus version {version})")
+    return version
+
+
+def print_manifest(manifest):
+    """Human-readable summary used by the verify/diagnostic tools"""
+    if not manifest:
+        print("   (no manifest - re-run an upload script to create one)")
+        return
+    print(f"   Corpus version: {manifest.get('corpus_version')}")
+    print(f"   Embedding model: {manifest.get('embedding_model', 'N/A')} "
+          f"({manifest.get('embedding_dim', '?')} dims)")
+    print(f"   Last ingested: {manifest.get('last_ingested_at')} by {manifest.get('last_ingested_by')}")
+    for collection, totals in sorted(manifest.get("collections", {}).items()):
+        print(f"   {collection}: {totals['count']} docs, {totals['with_embedding']} with embeddings "
+              f"(hash {totals['content_hash']})")
+        for source, entry in sorted(totals.get("sources", {}).items()):
+            print(f"      - {source}: {entry['count']} docs, {entry['with_embedding']} with embeddings")
@@ -0,0 +1,221 @@
+"""
+Schema Migrations
+Small framework for rolling structural changes across every class/subject.
+
+    @migration(1, "subject_name", scope="subjects")
+    def add_subject_name(snapshot, writer):
+        if not (snapshot.to_dict() or {}).get("subject_name"):
+            writer.set(snapshot.reference, {"subject_name": snapshot.id}, merge=True)
+
+- Migrations have a version and a name, and run in version order.
+- The highest applied version (plus a history entry per migration) is recorded in
+  `_migrations/state`; applied migrations are skipped on the next run.
+- Targets are listed level by level in parallel (`list_documents`, which also
+  finds documents that only hold subcollections) and read with batched `get_all`.
+- Each target is handled on a thread pool; writes are collected into batched
+  commits of up to 500. create() writes are batched apart from the rest and a
+  document that already exists is skipped, so it cannot fail unrelated writes.
+- A migration must be idempotent (check before writing), so a failed run is
+  simply run again.
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from firebase_admin import firestore
+from google.api_core import exceptions as google_exceptions
+
+# Firestore's limit on writes per batched commit
+MAX_BATCH_WRITES = 500
+# Documents per get_all call
+READ_CHUNK = 100
+DEFAULT_WORKERS = 16
+
+STATE_COLLECTION = "_migrations"
+STATE_DOC = "state"
+
+# Target levels: scope -> collection names below "classes"
+SCOPES = {
+    "classes": (),
+    "subjects": ("subjects",),
+    "chapters": ("subjects", "chapters"),
+}
+
+MIGRATIONS = []
+
+
+class Migration:
+    def __init__(self, version, name, scope, fn):
+        self.version = version
+        self.name = name
+        self.scope = scope
+        self.fn = fn
+
+
+def migration(version, name, scope="subjects"):
+    """Register fn(snapshot, writer) to run once for every document of `scope`"""
+    if scope not in SCOPES:
+        raise ValueError(f"Unknown scope {scope!r}, expected one of {sorted(SCOPES)}")
+
+    def register(fn):
+        if any(m.version == version for m in MIGRATIONS):
+            raise ValueError(f"Migration version {version} is already registered")
+        MIGRATIONS.append(Migration(version, name, scope, fn))
+        MIGRATIONS.sort(key=lambda m: m.version)
+        return fn
+    return register
+
+
+def has_documents(collection_ref):
+    """Existence check that reads at most one document id"""
+    return any(True for _ in collection_ref.select([]).limit(1).stream())
+
+
+class BatchWriter:
+    """
+    Thread-safe write buffer: set/create/update/delete calls from many workers are
+    committed in batches of up to 500. With dry_run=True nothing is written and
+    only the number of writes is counted.
+
+    create() never overwrites: creates are batched on their own, and when such a
+    batch fails because a document already exists (nothing in it is applied), its
+    creates are committed one by one and the existing documents are skipped.
+    """
+
+    def __init__(self, db, dry_run=False):
+        self.db = db
+        self.dry_run = dry_run
+        self.lock = threading.Lock()
+        self.ops = []
+        self.creates = []
+        self.writes = 0
+        self.commits = 0
+        self.skipped = 0
+
+    def _add(self, op, buffer):
+        with self.lock:
+            buffer.append(op)
+            self.writes += 1
+            if len(buffer) < MAX_BATCH_WRITES:
+                return
+            ops = list(buffer)
+            buffer.clear()
+        self._commit(ops)
+
+    def _commit(self, ops):
+        if not ops or self.dry_run:
+            return
+        batch = self.db.batch()
+        for method, args, kwargs in ops:
+            getattr(batch, method)(*args, **kwargs)
+        try:
+            batch.commit()
+        except google_exceptions.AlreadyExists:
+            if any(method != "create" for method, _, _ in ops):
+                raise
+            self._commit_each(ops)
+            return
+        with self.lock:
+            self.commits += 1
+
+    def _commit_each(self, creates):
+        """One commit per create, skipping documents that already exist"""
+        for _, (ref, data), _ in creates:
+            try:
+                ref.create(data)
+            except google_exceptions.AlreadyExists:
+                with self.lock:
+                    self.skipped += 1
+                print(f"   ⚠️  {ref.path} already exists, not overwritten")
+                continue
+            with self.lock:
+                self.commits += 1
+
+    def set(self, ref, data, merge=False):
+        self._add(("set", (ref, data), {"merge": merge}), self.ops)
+
+    def create(self, ref, data):
+        self._add(("create", (ref, data), {}), self.creates)
+
+    def update(self, ref, data):
+        self._add(("update", (ref, data), {}), self.ops)
+
+    def delete(self, ref):
+        self._add(("delete", (ref,), {}), self.ops)
+
+    def flush(self):
+        with self.lock:
+            ops, self.ops = self.ops, []
+            creates, self.creates = self.creates, []
+        self._commit(ops)
+        self._commit(creates)
+
+
+def list_targets(db, scope, pool, class_ids=None):
+    """References of every document at `scope`, listed level by level in parallel"""
+    if class_ids:
+        level = [db.collection("classes").document(class_id) for class_id in class_ids]
+    else:
+        level = list(db.collection("classes").list_documents())
+    for name in SCOPES[scope]:
+        children = pool.map(lambda ref: list(ref.collection(name).list_documents()), level)
+        level = [ref for refs in children for ref in refs]
+    return level
+
+
+def read_snapshots(db, refs, pool):
+    """Snapshots for `refs` via get_all, READ_CHUNK documents per call, in parallel"""
+    chunks = [refs[i:i + READ_CHUNK] for i in range(0, len(refs), READ_CHUNK)]
+    return [snapshot for snapshots in pool.map(lambda chunk: list(db.get_all(chunk)), chunks)
+            for snapshot in snapshots]
+
+
+def read_state(db):
+    snapshot = db.collection(STATE_COLLECTION).document(STATE_DOC).get()
+    return snapshot.to_dict() if snapshot.exists else {"version": 0, "history": {}}
+
+
+def run_migrations(db, migrations=None, workers=DEFAULT_WORKERS, dry_run=False, class_ids=None):
+    """
+    Apply every registered migration newer than the recorded version, in order.
+    `class_ids` limits the run to some classes (the recorded version is then not
+    advanced, since other classes were not migrated). Returns the list of
+    {"version", "name", "targets", "writes", "skipped", "seconds"} for migrations run.
+    """
+    migrations = MIGRATIONS if migrations is None else migrations
+    state = read_state(db)
+    pending = [m for m in migrations if m.version > state.get("version", 0)]
+    if not pending:
+        print(f"✓ Schema is up to date (version {state.get('version', 0)})")
+        return []
+
+    results = []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for m in pending:
+            started = time.time()
+            print(f"\n🔧 Migration {m.version}: {m.name} ({m.scope})" + (" [dry run]" if dry_run else ""))
+
+            refs = list_targets(db, m.scope, pool, class_ids)
+            snapshots = read_snapshots(db, refs, pool)
+            writer = BatchWriter(db, dry_run=dry_run)
+            # list() re-raises the first failure; nothing is recorded for this migration then
+            list(pool.map(lambda snapshot: m.fn(snapshot, writer), snapshots))
+            writer.flush()
+
+            result = {"version": m.version, "name": m.name, "targets": len(snapshots),
+                      "writes": writer.writes, "skipped": writer.skipped,
+                      "seconds": round(time.time() - started, 2)}
+            results.append(result)
+            print(f"   ✓ {len(snapshots)} targets, {writer.writes} writes in {writer.commits} commits "
+                  f"({writer.skipped} creates skipped, {result['seconds']}s)")
+
+            if dry_run or class_ids:
+                continue
+            db.collection(STATE_COLLECTION).document(STATE_DOC).set({
+                "version": m.version,
+                "history": {str(m.version): {"name": m.name, "targets": len(snapshots),
+                                             "writes": writer.writes,
+                                             "applied_at": firestore.SERVER_TIMESTAMP}},
+            }, merge=True)
+    return results
@@ -0,0 +1,231 @@
+"""
+PYQ Parser
+Splits the extracted text of a past paper into individual exam questions, so
+each question can be stored, embedded and retrieved on its own.
+
+    for question in parse_questions(text, default_year=2024):
+        question["number"], question["question"], question["options"], question["answer"],
+        question["marks"], question["year"], question["section"], question["kind"]
+
+- Question boundaries are numbering markers at the start of a line ("Q1:",
+  "Q1.", "Question 1.", "1.", "1)"). If a section uses "Q"/"Question" markers,
+  bare "1." lines are treated as part of a question (crossword clues,
+  fill-in-the-blank lists) instead of new questions. Numbering only moves
+  forward within a section, so an answer key ("Answer:\n1. (d)\n2. (b)") at
+  the end of a section is recognised and its answers are given to the questions.
+- Paper headers ("QUESTION PAPER 2", "CBSE 2019 Board Paper") and section headers
+  ("Short Answer Type Questions", "Section B (3 marks each)") are not part of any
+  question; they set the year, section and default marks of the questions after them.
+- Marks come from an annotation on the question ("[2 marks]", "(3 M)"), else
+  from the section header; years from an annotation ("[CBSE 2019]") or paper header.
+- Options "(a) ..." to "(d) ..." (one per line or several on a line) are kept
+  as a list; a question with options and a one-option answer is an MCQ.
+"""
+
+import re
+
+Q_MARKER_RE = re.compile(r"^\s*Q(?:uestion)?\s*\.?\s*(\d{1,3})\s*[:.)\-]?(?=\s|$)\s*", re.IGNORECASE)
+NUMBER_MARKER_RE = re.compile(r"^\s*(\d{1,3})\s*[.)](?=\s|$)\s*")
+ANSWER_RE = re.compile(r"^\s*(?:Answer|Ans|Solution)\s*[:.\-]?(?=\s|$)\s*", re.IGNORECASE)
+OPTION_RE = re.compile(r"(?<!\S)\(?([a-dA-D])\)[ \t]*(?=\S)")
+MARKS_RE = re.compile(r"[\[(]\s*(\d+(?:\.\d+)?)\s*(?:marks?|M)\b(?:\s*each)?\s*[\])]", re.IGNORECASE)
+YEAR_RE = re.compile(r"\b((?:19|20)\d{2})\b")
+YEAR_ANNOTATION_RE = re.compile(r"[\[(][^\[\]()]*\b((?:19|20)\d{2})\b[^\[\]()]*[\])]")
+PAPER_HEADER_RE = re.compile(r"^.*\b(?:QUESTION|SAMPLE|BOARD|EXAM(?:INATION)?)\s+PAPER\b.*$", re.IGNORECASE)
+# "Short Answer Type Questions", "MCQ Questions (1 mark each)", "SECTION B ...", "II. Fill in the Blanks"
+SECTION_HEADER_RE = re.compile(r"^\s*(?:SECTION\s+[A-Z]\b.*|[IVX]+\.\s+[A-Z].*"
+                               r"|.*\bQuestions\s*(?:[\[(][^\[\]()]*[\])])?)\s*$", re.IGNORECASE)
+MAX_HEADER_CHARS = 80
+
+# Section names -> question kind; checked in order ("very short" before "short")
+SECTION_KINDS = (
+    ("mcq", "mcq"),
+    ("multiple choice", "mcq"),
+    ("objective", "mcq"),
+    ("very short", "very_short"),
+    ("short", "short"),
+    ("long", "long"),
+    ("fill in the blank", "fill_blank"),
+    ("true or false", "true_false"),
+    ("match", "match"),
+)
+
+
+def _section_kind(section):
+    lowered = (section or "").lower()
+    for needle, kind in SECTION_KINDS:
+        if needle in lowered:
+            return kind
+    return None
+
+
+def _is_header(line):
+    """Paper/section header lines: short, not a question, not an answer"""
+    stripped = line.strip()
+    if not stripped or len(stripped) > MAX_HEADER_CHARS or stripped.endswith(("?", ".", ":")):
+        return False
+    if Q_MARKER_RE.match(stripped) or NUMBER_MARKER_RE.match(stripped) or ANSWER_RE.match(stripped):
+        return False
+    return bool(PAPER_HEADER_RE.match(stripped) or SECTION_HEADER_RE.match(stripped))
+
+
+def _options(stem):
+    """(question text without options, ["option a", ...]) when the stem lists (a), (b), ..."""
+    # Take the run (a), (b), (c)... in order; a later "(a)" ("both (a) and (b)") is option text
+    matches = []
+    for match in OPTION_RE.finditer(stem):
+        if match.group(1).lower() == chr(ord("a") + len(matches)):
+            matches.append(match)
+    if len(matches) < 2:
+        return stem.strip(), []
+    options = [stem[m.end():(matches[i + 1].start() if i + 1 < len(matches) else len(stem))].strip()
+               for i, m in enumerate(matches)]
+    return stem[:matches[0].start()].strip(), options
+
+
+def _answer_line(block):
+    """Offset of the "Answer:" line in a question block, or None"""
+    for match in re.finditer(r"\n([^\n]*)", block):
+        if ANSWER_RE.match(match.group(1)):
+            return match.start() + 1
+    return None
+
+
+def _answer_key(answer):
+    """{number: answer} when every line of `answer` is "1. (d)", "2. (b)", ... from 1, else None"""
+    key = {}
+    for line in filter(str.strip, answer.split("\n")):
+        match = NUMBER_MARKER_RE.match(line)
+        if not match or int(match.group(1)) != len(key) + 1:
+            return None
+        key[len(key) + 1] = line[match.end():].strip()
+    return key if len(key) >= 2 else None
+
+
+def _question(text, block_start, block_end, number, marker_re, context):
+    """One question dict from text[block_start:block_end] (marker included)"""
+    block = text[block_start:block_end].rstrip()
+    answer_at = _answer_line(block)
+    stem = marker_re.sub("", block[:answer_at], count=1)
+    answer = ANSWER_RE.sub("", block[answer_at:], count=1).strip() if answer_at is not None else ""
+
+    marks_match = MARKS_RE.search(stem)
+    year_match = YEAR_ANNOTATION_RE.search(stem)
+    question, options = _options(MARKS_RE.sub("", stem))
+
+    return {
+        "number": number,
+        "question": re.sub(r"\s+", " ", question).strip(),
+        "options": [re.sub(r"\s+", " ", option) for option in options],
+        "answer": re.sub(r"[ \t]+", " ", answer),
+        "marks": float(marks_match.group(1)) if marks_match else context["marks"],
+        "year": int(year_match.group(1)) if year_match else context["year"],
+        "section": context["section"],
+        "paper": context["paper"],
+        "kind": None,
+        "start": block_start,
+        "end": block_start + len(block),
+        "text": re.sub(r"[ \t]+", " ", block.strip()),
+        "answer_at": answer_at,
+    }
+
+
+def _parse_section(text, lines, context):
+    """Questions of one paper section (the lines between two headers)"""
+    # "Q1"/"Question 1" numbering wins over bare "1." when the section uses it,
+    # so numbered lists inside a question (crossword clues, blanks) stay in it
+    marker_re = Q_MARKER_RE if any(Q_MARKER_RE.match(m.group()) for m in lines) else NUMBER_MARKER_RE
+    blocks = []  # [start, number]
+    answers_without_question = False
+    for match in lines:
+        line = match.group()
+        marker = marker_re.match(line)
+        if blocks and marker is None and ANSWER_RE.match(line) is None:
+            continue
+        if not blocks and ANSWER_RE.match(line):
+            # An answer key under an instruction line ("Match the following"): no questions
+            answers_without_question = True
+        elif marker and not answers_without_question:
+            # Numbering only moves forward; "1." after question 20 is an answer key line
+            if not blocks or int(marker.group(1)) > blocks[-1][1]:
+                blocks.append([match.start(), int(marker.group(1))])
+    if not blocks:
+        return []
+    end = lines[-1].end()
+    questions = [_question(text, start, blocks[i + 1][0] if i + 1 < len(blocks) else end, number,
+                           marker_re, context)
+                 for i, (start, number) in enumerate(blocks)]
+
+    # Answer key after the last question: "Answer:\n1. (d)\n2. (d)..." for the whole section
+    last = questions[-1]
+    key = _answer_key(last["answer"])
+    if key and len(key) >= len(questions) > 1 and not any(q["answer"] for q in questions[:-1]):
+        questions[-1] = last = _question(text, last["start"], last["start"] + last["answer_at"],
+                                         last["number"], marker_re, context)
+        for question in questions:
+            question["answer"] = key.get(question["number"], "")
+            if question["answer"]:
+                question["text"] += f"\nAnswer: {question['answer']}"
+
+    section_kind = _section_kind(context["section"])
+    for question in questions:
+        del question["answer_at"]
+        single_option_answer = re.match(r"^\(?[a-d]\)[^\n]*$", question["answer"], re.IGNORECASE)
+        if question["options"] and (section_kind == "mcq" or single_option_answer):
+            question["kind"] = "mcq"
+        else:
+            question["kind"] = section_kind or ("parts" if question["options"] else "other")
+    return questions
+
+
+def parse_questions(text, default_year=None):
+    """
+    List of question dicts (see module docstring) in paper order, plus
+    "start"/"end" character offsets into `text` and the full question "text"
+    (stem, options and answer) for embedding and prompts.
+    """
+    if not text:
+        return []
+    context = {"section": None, "paper": 1, "marks": None, "year": default_year}
+    papers_seen = 0
+    questions = []
+    section_lines = []
+
+    for match in re.finditer(r"[^\n]*\n?", text):
+        line = match.group()
+        if not line.strip():
+            continue
+        if not _is_header(line):
+            section_lines.append(match)
+            continue
+        if section_lines:
+            questions += _parse_section(text, section_lines, dict(context))
+        section_lines = []
+        if PAPER_HEADER_RE.match(line.strip()):
+            papers_seen += 1
+            year = YEAR_RE.search(line)
+            context.update(paper=papers_seen, section=None, marks=None,
+                           year=int(year.group(1)) if year else default_year)
+        else:
+            marks = MARKS_RE.search(line)
+            context.update(section=line.strip(), marks=float(marks.group(1)) if marks else None)
+    if section_lines:
+        questions += _parse_section(text, section_lines, dict(context))
+    return questions
+
+
+def question_fields(question):
+    """Firestore fields stored alongside "text" for one question"""
+    return {
+        "questionNumber": question["number"],
+        "question": question["question"],
+        "options": question["options"],
+        "answer": question["answer"],
+        "marks": question["marks"],
+        "year": question["year"],
+        "section": question["section"],
+        "paper": question["paper"],
+        "questionType": question["kind"],
+        "charStart": question["start"],
+        "charEnd": question["end"],
+    }
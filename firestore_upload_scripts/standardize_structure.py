@@ -3,24 +3,27 @@
 This script will make ALL subjects match the 'english' structure:
 - subject_name field
 - chapters subcollection with sample chapters
+- embeddingDim on every chunk / PYQ document that has an embedding
 
-Run this ONCE to standardize your database.
+Runs as versioned migrations (see migrations.py) across every class and
+subject; re-running only applies migrations that haven't been applied yet.
+
+Usage:
+    python standardize_structure.py [--dry-run] [--class "class 8"] [--workers 16]
 """
 
+import argparse
+
 import firebase_admin
 from firebase_admin import credentials, firestore
 
+from migrations import DEFAULT_WORKERS, has_documents, migration, read_state, run_migrations
+
 # Initialize Firebase
 cred = credentials.Certificate("serviceAccountKey.json")
 firebase_admin.initialize_app(cred)
 db = firestore.client()
 
-# Configuration
-CLASS_ID = "class 8"
-
-# Subjects to standardize (all except english which already has chapters)
-SUBJECTS_TO_UPDATE = ["hindi", "mathematics", "science", "social science"]
-
 # Sample chapters to create for each subject
 SAMPLE_CHAPTERS = [
     {
@@ -37,104 +40,90 @@ SAMPLE_CHAPTERS = [
     }
 ]
 
-def standardize_subject(class_id, subject_id):
-    """
-    Ensure a subject has:
-    1. subject_name field
-    2. chapters subcollection with sample chapters
-    """
-    print(f"\n📘 Processing subject: {subject_id}")
-    print("-" * 60)
-    
-    subject_ref = (db.collection("classes")
-                    .document(class_id)
-                    .collection("subjects")
-                    .document(subject_id))
-    
-    # Get current subject data
-    subject_doc = subject_ref.get()
-    
-    if subject_doc.exists:
-        subject_data = subject_doc.to_dict()
-        print(f"✓ Subject document exists")
-        print(f"  Current fields: {list(subject_data.keys())}")
-        
-        # Ensure subject_name field exists
-        if 'subject_name' not in subject_data:
-            print(f"  ⚠️  Adding 'subject_name' field...")
-            subject_ref.update({"subject_name": subject_id})
-            print(f"  ✓ Added subject_name: {subject_id}")
-        else:
-            print(f"  ✓ subject_name already exists: {subject_data['subject_name']}")
-    else:
-        print(f"⚠️  Subject document doesn't exist, creating it...")
-        subject_ref.set({"subject_name": subject_id})
-        print(f"✓ Created subject with subject_name: {subject_id}")
-    
-    # Check if chapters subcollection exists
-    chapters_ref = subject_ref.collection("chapters")
-    existing_chapters = list(chapters_ref.stream())
-    
-    if existing_chapters:
-        print(f"✓ Chapters subcollection already has {len(existing_chapters)} chapter(s):")
-        for ch in existing_chapters:
-            print(f"   - {ch.id}")
-    else:
-        print(f"⚠️  No chapters found, creating sample chapters...")
-        
-        # Create sample chapters
-        for chapter_data in SAMPLE_CHAPTERS:
-            chapter_id = chapter_data["id"]
-            chapter_fields = {
-                "chapter_name": chapter_data["chapter_name"],
-                "notesURL": chapter_data["notesURL"],
-                "summary": chapter_data["summary"]
-            }
-            chapters_ref.document(chapter_id).set(chapter_fields)
-            print(f"   ✓ Created chapter: {chapter_id}")
-        
-        print(f"✓ Created {len(SAMPLE_CHAPTERS)} sample chapters")
-    
-    print(f"✅ {subject_id} is now standardized!")
+@migration(1, "subject_name field on every subject", scope="subjects")
+def add_subject_name(snapshot, writer):
+    """Ensure a subject document exists and has subject_name"""
+    if "subject_name" not in (snapshot.to_dict() or {}):
+        writer.set(snapshot.reference, {"subject_name": snapshot.id}, merge=True)
+
+
+@migration(2, "sample chapters for subjects without chapters", scope="subjects")
+def add_sample_chapters(snapshot, writer):
+    """Create SAMPLE_CHAPTERS when a subject has no chapters subcollection yet"""
+    chapters_ref = snapshot.reference.collection("chapters")
+    if has_documents(chapters_ref):
+        return
+    for chapter_data in SAMPLE_CHAPTERS:
+        chapter_fields = {
+            "chapter_name": chapter_data["chapter_name"],
+            "notesURL": chapter_data["notesURL"],
+            "summary": chapter_data["summary"]
+        }
+        # create() skips, rather than overwrites, a chapter added meanwhile
+        writer.create(chapters_ref.document(chapter_data["id"]), chapter_fields)
+
+
+@migration(3, "embeddingDim on embedded chunks", scope="chapters")
+def add_embedding_dim(snapshot, writer):
+    """Backfill embeddingDim (counted by the verify scripts) on documents uploaded before it existed"""
+    for name in ("chunks", "past_papers"):
+        docs = snapshot.reference.collection(name).select(["embedding", "embeddingDim"]).stream()
+        for doc in docs:
+            data = doc.to_dict()
+            embedding = data.get("embedding")
+            if embedding and data.get("embeddingDim") != len(embedding):
+                writer.update(doc.reference, {"embeddingDim": len(embedding)})
 
 
 def main():
+    parser = argparse.ArgumentParser(description="Standardize every subject's structure")
+    parser.add_argument("--dry-run", action="store_true", help="count writes without committing")
+    parser.add_argument("--class", dest="class_ids", action="append",
+                        help="only this class (repeatable); default: all classes")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS)
+    args = parser.parse_args()
+
     print("=" * 70)
     print("🔧 FIRESTORE STRUCTURE STANDARDIZATION TOOL")
     print("=" * 70)
-    print(f"\nTarget: classes/{CLASS_ID}/subjects/")
-    print(f"Subjects to update: {', '.join(SUBJECTS_TO_UPDATE)}")
+    print(f"\nTarget: classes/{', '.join(args.class_ids) if args.class_ids else '*'}/subjects/")
+    print(f"Current schema version: {read_state(db).get('version', 0)}")
     print("\n⚠️  This will:")
     print("   1. Ensure all subjects have 'subject_name' field")
     print("   2. Create 'chapters' subcollection if missing")
     print("   3. Add 2 sample chapters to subjects without chapters")
+    print("   4. Add 'embeddingDim' to embedded chunks that lack it")
     print("\n" + "=" * 70)
     
     # Ask for confirmation
-    response = input("\n🤔 Do you want to proceed? (yes/no): ").strip().lower()
-    
-    if response != "yes":
-        print("❌ Cancelled. No changes made.")
-        return
+    if not args.dry_run:
+        response = input("\n🤔 Do you want to proceed? (yes/no): ").strip().lower()
+        
+        if response != "yes":
+            print("❌ Cancelled. No changes made.")
+            return
     
     print("\n🚀 Starting standardization...")
     
-    # Process each subject
-    for subject_id in SUBJECTS_TO_UPDATE:
-        try:
-            standardize_subject(CLASS_ID, subject_id)
-        except Exception as e:
-            print(f"❌ Error processing {subject_id}: {e}")
+    try:
+        results = run_migrations(db, workers=args.workers, dry_run=args.dry_run, class_ids=args.class_ids)
+    except Exception as e:
+        print(f"❌ Migration failed: {e}")
+        print("   Fix the problem and run again - applied migrations are skipped, the rest are re-run")
+        return
     
     print("\n" + "=" * 70)
-    print("✅ STANDARDIZATION COMPLETE!")
+    print("✅ STANDARDIZATION COMPLETE!" if not args.dry_run else "🔎 DRY RUN COMPLETE (nothing written)")
     print("=" * 70)
     print("\n📊 Summary:")
-    print(f"   - Processed {len(SUBJECTS_TO_UPDATE)} subjects")
+    for result in results:
+        print(f"   - {result['version']}. {result['name']}: {result['targets']} targets, "
+              f"{result['writes']} writes ({result['seconds']}s)")
     print(f"   - All subjects now have:")
     print(f"      ✓ subject_name field")
     print(f"      ✓ chapters subcollection")
     print(f"      ✓ Sample chapters (if they didn't exist)")
+    print(f"   - Embedded chunks have embeddingDim (counted by the verify scripts)")
     print("\n🎯 Next Steps:")
     print("   1. Check Firebase Console to verify the structure")
     print("   2. Run 'diagnostic_tool.py' to verify everything")
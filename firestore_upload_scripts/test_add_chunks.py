@@ -6,6 +6,8 @@ This will verify the upload mechanism works without needing a PDF.
 import firebase_admin
 from firebase_admin import credentials, firestore
 
+from manifest import record_ingest
+
 # Initialize Firebase
 cred = credentials.Certificate("serviceAccountKey.json")
 firebase_admin.initialize_app(cred)
@@ -39,14 +41,19 @@ print(f"\n📍 Target: classes/{CLASS_ID}/subjects/{SUBJECT_ID}/chapters/{CHAPTE
 print(f"\n📝 Creating {len(SAMPLE_CHUNKS)} sample chunks...")
 
 # Create chunks
+uploaded = {}
 for i, chunk_text in enumerate(SAMPLE_CHUNKS, start=1):
     chunk_ref = chapter_ref.collection("chunks").document(f"chunk{i}")
-    chunk_ref.set({
+    data = {
         "chunkNumber": i,
         "text": chunk_text
-    })
+    }
+    chunk_ref.set(data)
+    uploaded[f"chunk{i}"] = data
     print(f"   ✓ Created chunk{i}")
 
+record_ingest(db, chapter_ref, "chunks", "chapter", uploaded)
+
 print("\n" + "=" * 70)
 print("✅ SUCCESS! Chunks added to science/chapter1")
 print("=" * 70)
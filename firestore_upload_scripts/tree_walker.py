@@ -0,0 +1,86 @@
+"""
+Tree Walker
+Concurrent breadth-first walk of the Firestore hierarchy.
+
+Each level (a set of collections, or a set of documents) is expanded in parallel
+on a thread pool: collections with `list_documents()` (references only, no
+document reads) and documents with `collections()`. The walk therefore takes
+time proportional to the depth of the tree, not the number of documents.
+
+Collections named in `leaf_collections` (e.g. "chunks") are reported but not
+listed, so callers can count them with an aggregation query instead.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_WORKERS = 16
+
+# Path segments: classes/{c}/subjects/{s}/chapters/{ch}/meta/manifest is 8 deep;
+# leave room for one more level of subcollections below that
+DEFAULT_MAX_DEPTH = 10
+
+# Big, flat collections that are counted rather than listed
+LEAF_COLLECTIONS = ("chunks", "past_papers", "quizzes", "attempts", "explanations", "progress")
+
+# list_documents() page size (one ListDocuments call per page)
+PAGE_SIZE = 300
+
+
+def collection_path(ref):
+    """Slash-separated path of a collection reference (documents have `.path`)"""
+    return f"{ref.parent.path}/{ref.id}" if ref.parent is not None else ref.id
+
+
+def _expand(ref, leaf_collections):
+    """Children of one node: ("document", ref) for a collection, ("collection", ref) for a document"""
+    if hasattr(ref, "list_documents"):
+        return [("document", doc) for doc in ref.list_documents(page_size=PAGE_SIZE)]
+    return [("leaf" if collection.id in leaf_collections else "collection", collection)
+            for collection in ref.collections()]
+
+
+def walk_tree(db, roots=None, max_depth=DEFAULT_MAX_DEPTH, workers=DEFAULT_WORKERS,
+              leaf_collections=LEAF_COLLECTIONS, on_level=None):
+    """
+    Walk from `roots` (top-level collection references; default: all of them)
+    down to `max_depth` path segments.
+
+    Returns {"collections": [...], "documents": [...], "leaves": [...],
+             "truncated": [...], "levels": n}
+    where "truncated" holds the nodes at max_depth that were not expanded.
+    `on_level(depth, count)` is called after each level, for progress output.
+    """
+    roots = list(db.collections()) if roots is None else list(roots)
+    result = {"collections": [], "documents": [], "leaves": [], "truncated": [], "levels": 0}
+    level = []
+    for root in roots:
+        if root.id in leaf_collections:
+            result["leaves"].append(root)
+        else:
+            level.append(root)
+            result["collections"].append(root)
+
+    # Roots are top-level collections (depth 1); every level adds one path segment
+    depth = 1
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while level:
+            if depth >= max_depth:
+                result["truncated"].extend(level)
+                break
+
+            next_level = []
+            for children in pool.map(lambda ref: _expand(ref, leaf_collections), level):
+                for kind, child in children:
+                    if kind == "leaf":
+                        result["leaves"].append(child)
+                        continue
+                    result["collections" if kind == "collection" else "documents"].append(child)
+                    next_level.append(child)
+
+            result["levels"] += 1
+            if on_level:
+                on_level(depth, len(next_level))
+            level = next_level
+            depth += 1
+
+    return result
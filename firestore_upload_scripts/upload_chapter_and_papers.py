@@ -3,6 +3,9 @@ from firebase_admin import credentials, firestore
 import pdfplumber
 import sys
 
+from chunker import chunk_fields, chunk_text
+from manifest import record_ingest
+
 # Fix encoding for Windows PowerShell
 if sys.platform == "win32":
     sys.stdout.reconfigure(encoding='utf-8')
@@ -26,19 +29,6 @@ def extract_pdf(path):
                 text += extracted + "\n"
     return text
 
-# -----------------------------
-# CHUNKING LOGIC
-# -----------------------------
-def chunk_text(text, chunk_size=400):
-    words = text.split()
-    chunks = []
-
-    for i in range(0, len(words), chunk_size):
-        chunk = " ".join(words[i:i+chunk_size])
-        chunks.append(chunk)
-
-    return chunks
-
 # -----------------------------
 # UPLOAD CHAPTER & CHUNKS
 # -----------------------------
@@ -48,7 +38,7 @@ def upload_chapter(class_id, subject_id, chapter_id, chapter_name, pdf_path):
     # Extract text
     chapter_text = extract_pdf(pdf_path)
 
-    # Chunk text
+    # Sentence/heading-aware chunks sized for the embedding model
     chunks = chunk_text(chapter_text)
 
     # Firestore document path
@@ -68,13 +58,20 @@ def upload_chapter(class_id, subject_id, chapter_id, chapter_name, pdf_path):
     })
 
     # Upload chunks
+    uploaded = {}
     for i, chunk in enumerate(chunks, start=1):
-        chapter_ref.collection("chunks").document(f"chunk{i}").set({
+        data = {
             "chunkNumber": i,
-            "text": chunk,
-        })
+            "text": chunk["text"],
+            **chunk_fields(chunk),
+        }
+        chapter_ref.collection("chunks").document(f"chunk{i}").set(data)
+        uploaded[f"chunk{i}"] = data
         print(f"✓ Uploaded chunk {i}")
 
+    # Record counts and content hashes in the chapter manifest
+    record_ingest(db, chapter_ref, "chunks", "chapter", uploaded)
+
     print("🎉 Chapter upload complete!")
 
 
@@ -96,10 +93,12 @@ def upload_past_papers(class_id, subject_id, chapter_id, pdf_list):
     for index, pdf_path in enumerate(pdf_list, start=1):
         paper_text = extract_pdf(pdf_path)
 
-        papers_ref.document(f"paper{index}").set({
+        data = {
             "paperNumber": index,
             "text": paper_text
-        })
+        }
+        papers_ref.document(f"paper{index}").set(data)
+        record_ingest(db, papers_ref.parent, "past_papers", f"paper{index}", {f"paper{index}": data})
 
         print(f"✓ Uploaded paper {index}")
 
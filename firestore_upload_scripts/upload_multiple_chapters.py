@@ -9,6 +9,9 @@ import firebase_admin
 from firebase_admin import credentials, firestore
 import pdfplumber
 
+from chunker import chunk_fields, chunk_text
+from manifest import record_ingest
+
 # -----------------------------
 # FIREBASE INITIALIZATION
 # -----------------------------
@@ -28,17 +31,6 @@ def extract_pdf(path):
                 text += extracted + "\n"
     return text
 
-# -----------------------------
-# CHUNKING LOGIC
-# -----------------------------
-def chunk_text(text, chunk_size=400):
-    words = text.split()
-    chunks = []
-    for i in range(0, len(words), chunk_size):
-        chunk = " ".join(words[i:i+chunk_size])
-        chunks.append(chunk)
-    return chunks
-
 # -----------------------------
 # UPLOAD CHAPTER & CHUNKS
 # -----------------------------
@@ -49,7 +41,7 @@ def upload_chapter(class_id, subject_id, chapter_id, chapter_name, pdf_path, sum
         # Extract text
         chapter_text = extract_pdf(pdf_path)
         
-        # Chunk text
+        # Sentence/heading-aware chunks sized for the embedding model
         chunks = chunk_text(chapter_text)
         
         # Firestore document path
@@ -69,13 +61,20 @@ def upload_chapter(class_id, subject_id, chapter_id, chapter_name, pdf_path, sum
         })
         
         # Upload chunks
+        uploaded = {}
         for i, chunk in enumerate(chunks, start=1):
-            chapter_ref.collection("chunks").document(f"chunk{i}").set({
+            data = {
                 "chunkNumber": i,
-                "text": chunk,
-            })
+                "text": chunk["text"],
+                **chunk_fields(chunk),
+            }
+            chapter_ref.collection("chunks").document(f"chunk{i}").set(data)
+            uploaded[f"chunk{i}"] = data
             print(f"  ✓ Uploaded chunk {i}/{len(chunks)}")
         
+        # Record counts and content hashes in the chapter manifest
+        record_ingest(db, chapter_ref, "chunks", "chapter", uploaded)
+        
         print(f"  🎉 {chapter_name} - Complete! ({len(chunks)} chunks)")
         return True
         
@@ -1,14 +1,20 @@
 """
 Upload Previous Year Questions (PYQ) PDF with Embeddings
-This script extracts text from PYQ PDFs, chunks them, generates embeddings,
-and uploads to Firestore for AI-powered question generation.
+This script extracts text from PYQ PDFs, splits them into individual questions,
+generates one embedding per question, and uploads one document per question
+to Firestore for AI-powered question generation.
 """
 
 import firebase_admin
 from firebase_admin import credentials, firestore
 import pdfplumber
+import re
 import sys
 
+from chunker import EMBEDDING_MODEL, count_tokens
+from manifest import record_ingest
+from pyq_parser import parse_questions, question_fields
+
 # Fix encoding for Windows PowerShell
 if sys.platform == "win32":
     sys.stdout.reconfigure(encoding='utf-8')
@@ -20,7 +26,8 @@ CLASS_ID = "class 8"
 SUBJECT_ID = "science"
 CHAPTER_ID = "chapter4"
 PYQ_PDF = "chapter4pyq.pdf"  # Your PYQ PDF file
-PYQ_DOC_ID = "pyq2024"  # Document ID for this PYQ
+PYQ_DOC_ID = "pyq2024"  # Document ID prefix for this PYQ
+PYQ_YEAR = None  # Exam year for questions without a year annotation (None = taken from PYQ_DOC_ID)
 
 # -----------------------------
 # FIREBASE INITIALIZATION
@@ -52,32 +59,18 @@ def extract_pdf(path):
         print(f"Error extracting PDF: {e}")
         return None
 
-# -----------------------------
-# CHUNKING LOGIC
-# -----------------------------
-def chunk_text(text, chunk_size=400):
-    """Split text into chunks of approximately chunk_size words"""
-    words = text.split()
-    chunks = []
-    
-    for i in range(0, len(words), chunk_size):
-        chunk = " ".join(words[i:i+chunk_size])
-        chunks.append(chunk)
-    
-    return chunks
-
 # -----------------------------
 # EMBEDDING GENERATION
 # -----------------------------
 def generate_embeddings(chunks):
-    """Generate embeddings for text chunks using sentence-transformers"""
+    """Generate embeddings for question texts using sentence-transformers"""
     try:
         from sentence_transformers import SentenceTransformer
         
-        print("\nLoading embedding model (all-MiniLM-L6-v2)...")
-        model = SentenceTransformer('all-MiniLM-L6-v2')
+        print(f"\nLoading embedding model ({EMBEDDING_MODEL})...")
+        model = SentenceTransformer(EMBEDDING_MODEL)
         
-        print("Generating embeddings for chunks...")
+        print("Generating embeddings for questions...")
         embeddings = model.encode(chunks, show_progress_bar=True)
         
         return embeddings
@@ -95,12 +88,25 @@ def generate_embeddings(chunks):
 # -----------------------------
 # UPLOAD TO FIRESTORE
 # -----------------------------
-def upload_pyq_with_embeddings(pdf_path, class_id, subject_id, chapter_id, doc_id):
+def delete_stale_docs(base_ref, doc_id, keep):
+    """Delete this paper's documents from an earlier upload that are not in `keep` (e.g. old _chunkN docs)"""
+    stale = [doc.reference for doc in base_ref.where("source", "==", doc_id).select([]).stream()
+             if doc.id not in keep]
+    for i in range(0, len(stale), 500):
+        batch = db.batch()
+        for ref in stale[i:i + 500]:
+            batch.delete(ref)
+        batch.commit()
+    if stale:
+        print(f"  Deleted {len(stale)} stale documents from an earlier upload of {doc_id}")
+
+
+def upload_pyq_with_embeddings(pdf_path, class_id, subject_id, chapter_id, doc_id, year=None):
     """
-    Upload PYQ PDF with chunks and embeddings to Firestore
+    Upload PYQ PDF as one document per question, with embeddings, to Firestore
     
     Structure:
-    classes/{class_id}/subjects/{subject_id}/chapters/{chapter_id}/past_papers/{doc_id}_chunk{i}
+    classes/{class_id}/subjects/{subject_id}/chapters/{chapter_id}/past_papers/{doc_id}_q{i}
     """
     
     print("=" * 70)
@@ -121,48 +127,76 @@ def upload_pyq_with_embeddings(pdf_path, class_id, subject_id, chapter_id, doc_i
     
     print(f"Extracted {len(text)} characters")
     
-    # Step 2: Chunk text
-    print("\nStep 2: Chunking text...")
-    chunks = chunk_text(text, chunk_size=400)
-    print(f"Created {len(chunks)} chunks")
+    # Step 2: Split into questions
+    print("\nStep 2: Splitting into questions...")
+    if year is None:
+        match = re.search(r"(?:19|20)\d{2}", doc_id)
+        year = int(match.group()) if match else None
+    questions = parse_questions(text, default_year=year)
+    if not questions:
+        print("ERROR: No numbered questions found (expected Q1:, Question 1., 1. ...)")
+        return False
+    kinds = {}
+    for question in questions:
+        kinds[question["kind"]] = kinds.get(question["kind"], 0) + 1
+    print(f"Found {len(questions)} questions: " + ", ".join(f"{n} {kind}" for kind, n in sorted(kinds.items())))
     
     # Step 3: Generate embeddings
     print("\nStep 3: Generating embeddings...")
-    embeddings = generate_embeddings(chunks)
+    embeddings = generate_embeddings([question["text"] for question in questions])
     
     has_embeddings = embeddings is not None
     
     # Step 4: Upload to Firestore
     print("\nStep 4: Uploading to Firestore...")
     
-    base_ref = (db.collection("classes")
-                 .document(class_id)
-                 .collection("subjects")
-                 .document(subject_id)
-                 .collection("chapters")
-                 .document(chapter_id)
-                 .collection("past_papers"))
-    
-    for i, chunk in enumerate(chunks, start=1):
+    chapter_ref = (db.collection("classes")
+                    .document(class_id)
+                    .collection("subjects")
+                    .document(subject_id)
+                    .collection("chapters")
+                    .document(chapter_id))
+    base_ref = chapter_ref.collection("past_papers")
+    
+    uploaded = {}
+    batch = db.batch()
+    for i, question in enumerate(questions, start=1):
         doc_data = {
             "chunkNumber": i,
-            "text": chunk,
+            "text": question["text"],
             "source": doc_id,
-            "type": "pyq"
+            "type": "pyq",
+            "tokenCount": count_tokens(question["text"]),
+            **question_fields(question),
         }
         
         # Add embedding if available
         if has_embeddings:
             doc_data["embedding"] = embeddings[i-1].tolist()
+            # Scalar twin of the vector, so uploads can be counted without an index override
+            doc_data["embeddingDim"] = len(doc_data["embedding"])
         
-        chunk_doc_id = f"{doc_id}_chunk{i}"
-        base_ref.document(chunk_doc_id).set(doc_data)
-        
-        status = "with embedding" if has_embeddings else "without embedding"
-        print(f"  Uploaded {chunk_doc_id} ({status})")
+        question_doc_id = f"{doc_id}_q{i}"
+        batch.set(base_ref.document(question_doc_id), doc_data)
+        uploaded[question_doc_id] = doc_data
+        if len(uploaded) % 500 == 0:
+            batch.commit()
+            batch = db.batch()
+    batch.commit()
+    
+    status = "with embeddings" if has_embeddings else "without embeddings"
+    print(f"  Uploaded {doc_id}_q1 ... {doc_id}_q{len(questions)} ({status})")
+    delete_stale_docs(base_ref, doc_id, uploaded)
+    
+    # Step 5: Record counts, hashes and the embedding model in the chapter manifest
+    if has_embeddings:
+        record_ingest(db, chapter_ref, "past_papers", doc_id, uploaded,
+                      embedding_model=EMBEDDING_MODEL, embedding_dim=len(embeddings[0]))
+    else:
+        record_ingest(db, chapter_ref, "past_papers", doc_id, uploaded)
     
     print("\n" + "=" * 70)
-    print(f"SUCCESS! Uploaded {len(chunks)} PYQ chunks")
+    print(f"SUCCESS! Uploaded {len(questions)} PYQ questions")
     if has_embeddings:
         print("With vector embeddings for AI search")
     else:
@@ -180,13 +214,14 @@ if __name__ == "__main__":
         class_id=CLASS_ID,
         subject_id=SUBJECT_ID,
         chapter_id=CHAPTER_ID,
-        doc_id=PYQ_DOC_ID
+        doc_id=PYQ_DOC_ID,
+        year=PYQ_YEAR
     )
     
     if success:
         print("\nVerify in Firebase Console:")
         print(f"  classes -> {CLASS_ID} -> subjects -> {SUBJECT_ID}")
         print(f"  -> chapters -> {CHAPTER_ID} -> past_papers")
-        print(f"\nYou should see documents: {PYQ_DOC_ID}_chunk1, {PYQ_DOC_ID}_chunk2, etc.")
+        print(f"\nYou should see documents: {PYQ_DOC_ID}_q1, {PYQ_DOC_ID}_q2, etc.")
     else:
         print("\nUpload failed. Check error messages above.")
@@ -0,0 +1,93 @@
+"""
+Verification Helpers
+Cheap checks for the verify scripts: server-side count aggregations instead of
+streaming every chunk, and small random samples for content checks.
+
+Cost (Firestore bills aggregations per 1000 index entries counted):
+    count_docs / count_with_embeddings  ~1 read per 1000 chunks
+    random_sample(n)                    n reads (only the requested fields)
+
+Embeddings are counted on the scalar `embeddingDim` written next to each
+embedding, which Firestore indexes automatically (a filter on the embedding
+array itself needs an index override). Documents uploaded before embeddingDim
+existed are backfilled by standardize_structure.py (migration 3).
+"""
+
+import random
+import string
+
+from google.cloud.firestore_v1.base_query import FieldFilter
+from google.cloud.firestore_v1.field_path import FieldPath
+
+# Same alphabet as Firestore auto-ids, so random pivots fall between real ids
+_ID_ALPHABET = string.ascii_letters + string.digits
+
+EXPECTED_EMBEDDING_DIM = 384
+# Fields read by check_sample; pass to random_sample(fields=...) plus any to print
+SAMPLE_FIELDS = ["text", "embedding", "embeddingDim"]
+
+
+def count_docs(query):
+    """Number of documents matching `query` (a collection or query), counted server-side"""
+    result = query.count(alias="n").get()
+    return int(result[0][0].value)
+
+
+def count_with_embeddings(collection_ref):
+    """Documents with an embedding, i.e. with `embeddingDim` > 0"""
+    return count_docs(collection_ref.where(filter=FieldFilter("embeddingDim", ">", 0)))
+
+
+def random_sample(collection_ref, size, fields=None, rng=random):
+    """
+    Up to `size` documents starting at a random document id, wrapping around to
+    the start of the collection. Only `fields` are read (None = whole documents).
+    """
+    pivot = "".join(rng.choice(_ID_ALPHABET) for _ in range(20))
+    query = collection_ref.order_by(FieldPath.document_id())
+    if fields is not None:
+        query = query.select(fields)
+
+    docs = list(query.start_at({FieldPath.document_id(): pivot}).limit(size).stream())
+    if len(docs) < size:
+        docs += list(query.end_before({FieldPath.document_id(): pivot}).limit(size - len(docs)).stream())
+    return docs
+
+
+def check_sample(docs, expected_dim=EXPECTED_EMBEDDING_DIM, require_embedding=True):
+    """List of problems found in sampled chunk documents (empty list = all good)"""
+    problems = []
+    for doc in docs:
+        data = doc.to_dict()
+        if "text" in data and not (data.get("text") or "").strip():
+            problems.append(f"{doc.id}: empty text")
+        embedding = data.get("embedding")
+        if embedding is None:
+            if require_embedding:
+                problems.append(f"{doc.id}: no embedding")
+        elif len(embedding) != expected_dim:
+            problems.append(f"{doc.id}: embedding has {len(embedding)} dims, expected {expected_dim}")
+        elif data.get("embeddingDim") != len(embedding):
+            # Not counted by count_with_embeddings
+            problems.append(f"{doc.id}: embeddingDim is {data.get('embeddingDim')}, "
+                            f"expected {len(embedding)} (run standardize_structure.py)")
+    return problems
+
+
+def collection_stats(collection_ref, manifest_totals=None):
+    """
+    {"count", "with_embedding", "manifest_count"} for a chunk collection.
+    `manifest_totals` is the collection entry of the chapter manifest, if any,
+    so a mismatch between the manifest and the live collection can be reported.
+    """
+    return {
+        "count": count_docs(collection_ref),
+        "with_embedding": count_with_embeddings(collection_ref),
+        "manifest_count": manifest_totals.get("count") if manifest_totals else None,
+    }
+
+
+def print_stats(name, stats):
+    print(f"   {name}: {stats['count']} docs, {stats['with_embedding']} with embeddings")
+    if stats["manifest_count"] is not None and stats["manifest_count"] != stats["count"]:
+        print(f"   ⚠️  Manifest says {stats['manifest_count']} - re-run the upload or check for partial writes")
@@ -1,10 +1,21 @@
 """
 Verify PYQ upload with embeddings
+Counts use aggregation queries and content checks use a small random sample,
+so verification costs a handful of reads however large the corpus is.
+
+Usage:
+    python verify_pyq.py             # CHAPTER_ID only
+    python verify_pyq.py --subject   # every chapter of SUBJECT_ID
 """
 
+import sys
+
 import firebase_admin
 from firebase_admin import credentials, firestore
 
+from manifest import print_manifest, read_manifest
+from verification import SAMPLE_FIELDS, check_sample, collection_stats, print_stats, random_sample
+
 # Initialize Firebase
 try:
     app = firebase_admin.get_app()
@@ -17,52 +28,90 @@ db = firestore.client()
 CLASS_ID = "class 8"
 SUBJECT_ID = "science"
 CHAPTER_ID = "chapter4"
+SAMPLE_SIZE = 5
+# Also read for the verbose listing of sampled documents
+PRINTED_FIELDS = ["chunkNumber", "source", "type", "questionNumber", "questionType", "year", "marks", "options"]
+
+
+def verify_chapter(chapter_ref, verbose=True):
+    """Print the PYQ status of one chapter; returns (total, with_embedding, problems)"""
+    past_papers_ref = chapter_ref.collection("past_papers")
+    manifest = read_manifest(chapter_ref)
+    if verbose:
+        print("\nManifest:")
+        print_manifest(manifest)
+
+    stats = collection_stats(past_papers_ref, (manifest or {}).get("collections", {}).get("past_papers"))
+    print_stats(f"{chapter_ref.id}/past_papers", stats)
+    if stats["count"] == 0:
+        return stats["count"], stats["with_embedding"], []
+
+    fields = SAMPLE_FIELDS + (PRINTED_FIELDS if verbose else [])
+    sample = random_sample(past_papers_ref, SAMPLE_SIZE, fields=fields)
+    problems = check_sample(sample, (manifest or {}).get("embedding_dim") or 384)
+    if verbose:
+        print(f"\nRandom sample of {len(sample)} PYQ documents:")
+        print("-" * 70)
+        for i, paper in enumerate(sample, 1):
+            data = paper.to_dict()
+
+            print(f"\n{i}. Document ID: {paper.id}")
+            print(f"   Chunk Number: {data.get('chunkNumber', 'N/A')}")
+            print(f"   Source: {data.get('source', 'N/A')}")
+            print(f"   Type: {data.get('type', 'N/A')}")
+            if 'questionNumber' in data:
+                print(f"   Question: {data['questionNumber']} ({data.get('questionType')}), "
+                      f"year {data.get('year', 'N/A')}, marks {data.get('marks', 'N/A')}, "
+                      f"{len(data.get('options') or [])} options")
+            print(f"   Text preview: {data.get('text', '')[:80]}...")
+
+            # Check if embedding exists
+            if 'embedding' in data:
+                embedding = data['embedding']
+                print(f"   Embedding: {len(embedding)} dimensions")
+                print(f"   Sample values: [{embedding[0]:.4f}, {embedding[1]:.4f}, {embedding[2]:.4f}, ...]")
+            else:
+                print(f"   Embedding: NOT FOUND")
+    for problem in problems:
+        print(f"   ⚠️  {problem}")
+    return stats["count"], stats["with_embedding"], problems
+
 
 print("=" * 70)
 print("VERIFICATION: PYQ Upload Status")
 print("=" * 70)
 
-# Check past_papers subcollection
-past_papers_ref = (db.collection("classes")
-                    .document(CLASS_ID)
-                    .collection("subjects")
-                    .document(SUBJECT_ID)
-                    .collection("chapters")
-                    .document(CHAPTER_ID)
-                    .collection("past_papers"))
-
-papers = list(past_papers_ref.stream())
-
-print(f"\nTotal PYQ chunks found: {len(papers)}")
-
-if len(papers) > 0:
-    print("\nFirst 5 PYQ chunks:")
-    print("-" * 70)
-    
-    for i, paper in enumerate(papers[:5], 1):
-        data = paper.to_dict()
-        
-        print(f"\n{i}. Document ID: {paper.id}")
-        print(f"   Chunk Number: {data.get('chunkNumber', 'N/A')}")
-        print(f"   Source: {data.get('source', 'N/A')}")
-        print(f"   Type: {data.get('type', 'N/A')}")
-        print(f"   Text preview: {data.get('text', '')[:80]}...")
-        
-        # Check if embedding exists
-        if 'embedding' in data:
-            embedding = data['embedding']
-            print(f"   Embedding: {len(embedding)} dimensions")
-            print(f"   Sample values: [{embedding[0]:.4f}, {embedding[1]:.4f}, {embedding[2]:.4f}, ...]")
-        else:
-            print(f"   Embedding: NOT FOUND")
-    
+chapters_ref = (db.collection("classes")
+                .document(CLASS_ID)
+                .collection("subjects")
+                .document(SUBJECT_ID)
+                .collection("chapters"))
+
+if "--subject" in sys.argv:
+    # One read per chapter document (no fields), then aggregations per chapter
+    chapter_refs = [doc.reference for doc in chapters_ref.select([]).stream()]
+    print(f"\nChecking {len(chapter_refs)} chapters of {CLASS_ID}/{SUBJECT_ID}\n")
+    results = [verify_chapter(ref, verbose=False) for ref in chapter_refs]
+else:
+    results = [verify_chapter(chapters_ref.document(CHAPTER_ID))]
+
+total_count = sum(r[0] for r in results)
+embedded_count = sum(r[1] for r in results)
+problem_count = sum(len(r[2]) for r in results)
+
+if total_count > 0:
     print("\n" + "=" * 70)
-    print("SUCCESS! PYQ chunks uploaded with embeddings")
+    if problem_count == 0 and embedded_count == total_count:
+        print("SUCCESS! PYQ chunks uploaded with embeddings")
+    else:
+        print(f"WARNING: {total_count - embedded_count} chunks without embeddings, "
+              f"{problem_count} problems in sampled chunks")
     print("=" * 70)
-    print(f"\nTotal chunks: {len(papers)}")
-    print(f"With embeddings: {sum(1 for p in papers if 'embedding' in p.to_dict())}")
-    print("\nReady for AI-powered search and question generation!")
-    
+    print(f"\nTotal chunks: {total_count}")
+    print(f"With embeddings: {embedded_count}")
+    if problem_count == 0 and embedded_count == total_count:
+        print("\nReady for AI-powered search and question generation!")
+
 else:
     print("\nERROR: No PYQ chunks found!")
     print("The upload may have failed.")
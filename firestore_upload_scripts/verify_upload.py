@@ -1,10 +1,17 @@
 """
 Verify that chapter4 was uploaded successfully
+Counts use aggregation queries and content checks use a small random sample,
+so verification costs a handful of reads however large the chapter is.
 """
 
 import firebase_admin
 from firebase_admin import credentials, firestore
 
+from manifest import print_manifest, read_manifest
+from verification import SAMPLE_FIELDS, check_sample, collection_stats, print_stats, random_sample
+
+SAMPLE_SIZE = 5
+
 # Initialize Firebase (check if already initialized)
 try:
     app = firebase_admin.get_app()
@@ -41,20 +48,30 @@ if chapter_doc.exists:
     print(f"Notes URL: {chapter_data.get('notesURL', 'N/A')}")
     print(f"Summary: {chapter_data.get('summary', 'N/A')[:50]}..." if chapter_data.get('summary') else "Summary: (empty)")
     
-    # Check chunks
+    manifest = read_manifest(chapter_ref)
+    print("\nManifest:")
+    print_manifest(manifest)
+    
     chunks_ref = chapter_ref.collection("chunks")
-    chunks = list(chunks_ref.stream())
+    stats = collection_stats(chunks_ref, (manifest or {}).get("collections", {}).get("chunks"))
+    chunk_count = stats["count"]
     
-    print(f"\nChunks created: {len(chunks)}")
-    if len(chunks) > 0:
-        print("First 5 chunks:")
-        for i, chunk in enumerate(chunks[:5], 1):
-            chunk_data = chunk.to_dict()
-            text_preview = chunk_data.get('text', '')[:60]
+    print(f"\nChunks created:")
+    print_stats("chunks", stats)
+    if chunk_count > 0:
+        sample = random_sample(chunks_ref, SAMPLE_SIZE, fields=SAMPLE_FIELDS)
+        print(f"Random sample of {len(sample)} chunks:")
+        for chunk in sample:
+            text_preview = chunk.to_dict().get('text', '')[:60]
             print(f"  {chunk.id}: {text_preview}...")
+        # Chapter chunks may be uploaded without embeddings; flag only a partial set
+        problems = check_sample(sample, (manifest or {}).get("embedding_dim") or 384,
+                                require_embedding=stats["with_embedding"] > 0)
+        for problem in problems:
+            print(f"  ⚠️  {problem}")
     
     print("\n" + "=" * 70)
-    print(f"SUCCESS! chapter4 uploaded with {len(chunks)} chunks")
+    print(f"SUCCESS! chapter4 uploaded with {chunk_count} chunks")
     print("=" * 70)
     print("\nVerify in Firebase Console:")
     print(f"classes -> class 8 -> subjects -> science -> chapters -> chapter4")